@@ -59,6 +59,15 @@ export async function POST() {
 
 
 
+    // run_all_spiders exits with 75 when another run (e.g. the daily task on
+    // this or another worker) holds the shared run lock.
+    if (py.code === 75) {
+      return NextResponse.json(
+        { error: "A scrape is already running", stdout: py.stdout },
+        { status: 409 }
+      );
+    }
+
     if (py.code !== 0) {
       return NextResponse.json(
         { step: "scrape", stdout: py.stdout, stderr: py.stderr },
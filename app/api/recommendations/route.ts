@@ -12,7 +12,7 @@ export async function GET(req: Request) {
     });
 
     // 2️⃣ Load products (fashion flag already computed elsewhere)
-    const products = await prisma.product.findMany();
+    const products = await prisma.product.findMany({ where: { removedAt: null } });
 
     // 3️⃣ Fetch user calendar events
     const calendarRes = await fetch(
@@ -6,7 +6,7 @@ import prisma from "@/lib/prisma";
 
 async function loadProducts() {
   return prisma.product.findMany({
-    where: { brand: "Aegis" },
+    where: { brand: "Aegis", removedAt: null },
     orderBy: { name: "asc" },
   });
 }
@@ -6,7 +6,7 @@ import prisma from "@/lib/prisma";
 
 async function loadProducts() {
   return prisma.product.findMany({
-    where: { brand: "Smart Master" },
+    where: { brand: "Smart Master", removedAt: null },
     orderBy: { name: "asc" },
   });
 }
@@ -6,7 +6,7 @@ import prisma from "@/lib/prisma";
 
 async function loadProducts() {
   return prisma.product.findMany({
-    where: { brand: "Tomaz" },
+    where: { brand: "Tomaz", removedAt: null },
     orderBy: { name: "asc" },
   });
 }
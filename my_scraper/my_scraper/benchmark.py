@@ -0,0 +1,505 @@
+"""
+Offline benchmarks for the spiders' parse callbacks and DbStorePipeline.
+
+    python -m my_scraper.benchmark record
+        Crawl the live sites once and save a few real responses (Shopify
+        products.json pages and the Playwright-rendered LocalLab collection
+        page) under benchmarks/fixtures/. Needs network access.
+
+    python -m my_scraper.benchmark run [--sizes 1000 10000 100000] [--db fake|URL]
+        Build synthetic catalogues of the given sizes from the recorded
+        fixtures (or from built-in templates when none are recorded) and replay
+        them through the parse callbacks and DbStorePipeline. No network is
+        used; the pipeline writes to a fake connection unless a database URL is
+        given. Reports items/sec, peak traced allocations and DB rows/sec.
+
+    python -m my_scraper.benchmark startup [--spiders tomaz ...] [--repeat 3]
+        Start ``scrapy crawl <spider>`` the way run_all_spiders --mode
+        subprocess does and report how long it takes until the first request
+        reaches the downloader (the spider is closed right there) and until
+        the process has exited. Feeds, the database and run state are off.
+"""
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from parsel import Selector
+from scrapy import signals
+from scrapy.http import HtmlResponse, Request, TextResponse
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+from scrapy.utils.test import get_crawler
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+FIXTURES_DIR = BASE_DIR / "benchmarks" / "fixtures"
+FIXTURES_PER_KIND = 2
+
+# Used when no fixtures have been recorded yet.
+DEFAULT_SHOPIFY_PRODUCT = {
+    "id": 1,
+    "title": "Classic Slim Fit Blazer",
+    "handle": "classic-slim-fit-blazer",
+    "product_type": "Blazer",
+    "vendor": "Tomaz",
+    "tags": ["men", "formal"],
+    "updated_at": "2026-01-01T10:00:00+08:00",
+    "images": [{"src": "https://cdn.shopify.com/s/files/1/0000/0001/products/blazer.jpg?v=1"}],
+    "variants": [
+        {"id": 11, "title": "S", "price": "299.00", "available": True},
+        {"id": 12, "title": "M", "price": "299.00", "available": False},
+    ],
+}
+DEFAULT_PRODUCT_CARD = (
+    '<div class="product-card"><div class="product-card__figure">'
+    '<a href="/collections/aegis/products/tee" title="Aegis Tee">'
+    '<img src="//cdn.shopify.com/s/files/1/0000/0002/products/tee.jpg?v=1" alt="Aegis Tee"></a>'
+    "</div></div>"
+)
+
+
+# -- recording -----------------------------------------------------------------
+
+
+class FixtureRecorderMiddleware:
+    """Downloader middleware that saves the first few responses of each kind per spider."""
+
+    def __init__(self, fixtures_dir):
+        self.fixtures_dir = Path(fixtures_dir)
+        self.saved = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("BENCHMARK_FIXTURES_DIR", FIXTURES_DIR))
+
+    def process_response(self, request, response, spider):
+        if response.status != 200:
+            return response
+        if request.meta.get("playwright"):
+            kind = "html"
+        elif "/products.json" in request.url:
+            kind = "json"
+        else:
+            return response
+        key = (spider.name, kind)
+        n = self.saved.get(key, 0)
+        if n < FIXTURES_PER_KIND:
+            self.saved[key] = n + 1
+            path = self.fixtures_dir / spider.name / f"{kind}-{n}.{kind}"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(response.body)
+            spider.logger.info(f"Recorded fixture {path}")
+        return response
+
+
+def record():
+    from scrapy.crawler import CrawlerProcess
+
+    settings = get_project_settings()
+    settings.set("ITEM_PIPELINES", {})
+    settings.set("FEEDS", {})
+    settings.set("INCREMENTAL_ENABLED", False)
+    settings.set("CLOSESPIDER_PAGECOUNT", FIXTURES_PER_KIND + 1)
+    settings.set("BENCHMARK_FIXTURES_DIR", str(FIXTURES_DIR))
+    middlewares = settings.getdict("DOWNLOADER_MIDDLEWARES")
+    middlewares["my_scraper.benchmark.FixtureRecorderMiddleware"] = 950
+    settings.set("DOWNLOADER_MIDDLEWARES", middlewares)
+
+    process = CrawlerProcess(settings)
+    for name in process.spider_loader.list():
+        process.crawl(name)
+    # The JSON probe succeeds for LocalLab, so render it explicitly as well.
+    process.crawl("products", force_render="1")
+    process.start()
+
+
+# -- synthetic catalogues ------------------------------------------------------
+
+
+def shopify_template():
+    for path in sorted(FIXTURES_DIR.glob("*/json-*.json")):
+        products = json.loads(path.read_text(encoding="utf-8")).get("products") or []
+        if products:
+            return products
+    return [DEFAULT_SHOPIFY_PRODUCT]
+
+
+def card_template():
+    for path in sorted(FIXTURES_DIR.glob("*/html-*.html")):
+        sel = Selector(text=path.read_text(encoding="utf-8"))
+        cards = sel.css("div.product-card, div.grid-product").getall()
+        if cards:
+            return cards
+    return [DEFAULT_PRODUCT_CARD]
+
+
+def synthetic_products(size):
+    templates = shopify_template()
+    products = []
+    for i in range(size):
+        product = copy.deepcopy(templates[i % len(templates)])
+        product["id"] = i + 1
+        product["handle"] = f"{product.get('handle') or 'product'}-{i}"
+        for j, variant in enumerate(product.get("variants") or []):
+            variant["id"] = (i + 1) * 1000 + j
+        products.append(product)
+    return products
+
+
+def shopify_pages(size, page_size):
+    products = synthetic_products(size)
+    for start in range(0, size, page_size):
+        yield json.dumps({"products": products[start:start + page_size]}).encode("utf-8")
+
+
+def html_pages(size, per_page=48):
+    templates = card_template()
+    for start in range(0, size, per_page):
+        cards = []
+        for i in range(start, min(size, start + per_page)):
+            card = templates[i % len(templates)]
+            cards.append(card.replace('/products/', f'/products/bench-{i}-', 1))
+        yield ("<html><body>" + "".join(cards) + "</body></html>").encode("utf-8")
+
+
+# -- measurement ---------------------------------------------------------------
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "count": count,
+        "seconds": round(elapsed, 4),
+        "per_second": round(count / elapsed, 1) if elapsed else None,
+        "peak_alloc_kib": round(peak / 1024, 1),
+    }
+
+
+def make_spider(spidercls):
+    settings = get_project_settings().copy_to_dict()
+    # Measure parsing of every product, not the delta against local watermarks.
+    settings["SHOPIFY_WATERMARK_ENABLED"] = False
+    crawler = get_crawler(spidercls, settings)
+    spider = spidercls.from_crawler(crawler)
+    spider.page_window = crawler.settings.getint("SHOPIFY_PAGE_WINDOW", 3)
+    return spider
+
+
+def bench_shopify_parse(spidercls, size):
+    spider = make_spider(spidercls)
+    collection = spider.collections[0]
+    api_url = f"{collection['url']}/products.json"
+    pages = list(shopify_pages(size, spider.page_size))
+
+    def run():
+        items = 0
+        for page, body in enumerate(pages, start=1):
+            request = Request(api_url, cb_kwargs={"page": page, "collection": collection})
+            response = TextResponse(api_url, body=body, encoding="utf-8", request=request)
+            for result in spider.parse_products(response, page, collection):
+                if not isinstance(result, Request):
+                    items += 1
+        return items
+
+    return measure(run)
+
+
+def iterate_async(agen):
+    """Drain an async generator that never actually suspends (no Playwright page offline)."""
+    while True:
+        try:
+            agen.__anext__().send(None)
+        except StopIteration as exc:
+            yield exc.value
+        except StopAsyncIteration:
+            return
+
+
+def bench_html_parse(size):
+    from my_scraper.spiders.registry import SPIDERS
+
+    spider = make_spider(SPIDERS["products"])
+    collection = spider.collections[0]
+    pages = list(html_pages(size))
+
+    def run():
+        items = 0
+        for body in pages:
+            request = Request(collection["url"], cb_kwargs={"collection": collection})
+            response = HtmlResponse(collection["url"], body=body, encoding="utf-8", request=request)
+            for result in iterate_async(spider.parse_rendered(response, collection)):
+                if not isinstance(result, Request):
+                    items += 1
+        return items
+
+    return measure(run)
+
+
+class FakeCursor:
+    """Just enough of a psycopg2 cursor for execute_values and the touch UPDATE."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+        self.page = []
+        self.last = []
+
+    def mogrify(self, template, args):
+        self.page.append(args)
+        return repr(args).encode("utf-8")
+
+    def execute(self, query, params=None):
+        self.connection.statements += 1
+        self.last, self.page = self.page, []
+        self.rowcount = len(self.last)
+
+    def fetchall(self):
+        # Report every row as written: the worst case for the upsert.
+        return [(args[3],) for args in self.last]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    encoding = "UTF8"
+    closed = 0
+
+    def __init__(self):
+        self.statements = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeConnectionManager:
+    retry_times = 0
+
+    @classmethod
+    def from_settings(cls, db_url, settings):
+        return cls()
+
+    def getconn(self):
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def release(self):
+        pass
+
+    def delay(self, attempt):
+        return 0
+
+
+def bench_pipeline(size, db_url, load_mode):
+    from twisted.internet import reactor
+
+    from my_scraper.pipelines import DbStorePipeline
+    from my_scraper.spiders.registry import SPIDERS
+
+    spidercls = SPIDERS["tomaz"]
+
+    class BenchmarkPipeline(DbStorePipeline):
+        connection_manager_class = FakeConnectionManager
+
+    pipeline_cls = DbStorePipeline if db_url != "fake" else BenchmarkPipeline
+    os.environ["DATABASE_URL"] = db_url
+    settings = get_project_settings().copy_to_dict()
+    settings["DB_LOAD_MODE"] = load_mode
+    settings["SHOPIFY_WATERMARK_ENABLED"] = False
+    crawler = get_crawler(spidercls, settings)
+    spider = crawler.spider = spidercls.from_crawler(crawler)
+    items = [
+        spider.build_item(product, spider.collections[0])
+        for product in synthetic_products(size)
+    ]
+    result = {}
+
+    async def run():
+        pipeline = pipeline_cls.from_crawler(crawler)
+        await pipeline.open_spider()
+        tracemalloc.start()
+        started = time.perf_counter()
+        for item in items:
+            await pipeline.process_item(item)
+        await pipeline.close_spider()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result.update(
+            count=size,
+            seconds=round(elapsed, 4),
+            per_second=round(size / elapsed, 1) if elapsed else None,
+            peak_alloc_kib=round(peak / 1024, 1),
+            stats={k: v for k, v in crawler.stats.get_stats().items() if k.startswith("db/")},
+        )
+
+    failures = []
+    d = deferred_from_coro(run())
+    d.addErrback(failures.append)
+    d.addBoth(lambda _: reactor.stop())
+    reactor.run()
+    if failures:
+        failures[0].raiseException()
+    return result
+
+
+def run_benchmarks(sizes, db_url, load_mode):
+    from my_scraper.spiders.registry import SPIDERS
+
+    results = []
+    for size in sizes:
+        results.append({"stage": "shopify.parse_products", "size": size,
+                        **bench_shopify_parse(SPIDERS["tomaz"], size)})
+        results.append({"stage": "locallab.parse_products", "size": size,
+                        **bench_shopify_parse(SPIDERS["products"], size)})
+        results.append({"stage": "locallab.parse_rendered", "size": size, **bench_html_parse(size)})
+    return results
+
+
+# -- startup -------------------------------------------------------------------
+
+
+STARTUP_MARKER = "BENCHMARK_FIRST_REQUEST"
+
+
+class StartupProbe:
+    """Extension: prints the wall clock time of the first request to reach the downloader, then closes the spider."""
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.reported = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        probe = cls(crawler)
+        crawler.signals.connect(probe.request_reached_downloader, signal=signals.request_reached_downloader)
+        return probe
+
+    def request_reached_downloader(self, request, spider):
+        if self.reported:
+            return
+        self.reported = True
+        print(f"{STARTUP_MARKER} {time.time()}", flush=True)
+        deferred_from_coro(self.crawler.engine.close_spider_async(reason="startup_probe"))
+
+
+def bench_startup(spider, repeat):
+    settings = get_project_settings()
+    extensions = {**settings.getdict("EXTENSIONS"), "my_scraper.benchmark.StartupProbe": 0}
+    overrides = {
+        "EXTENSIONS": json.dumps(extensions),
+        "FEEDS": "{}",
+        "RUN_STATE_ENABLED": "False",
+        "METRICS_ENABLED": "False",
+        "LOG_LEVEL": "ERROR",
+    }
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    env["PYTHONPATH"] = os.pathsep.join([str(BASE_DIR), env.get("PYTHONPATH", "")]).strip(os.pathsep)
+    command = [sys.executable, "-m", "scrapy", "crawl", spider]
+    for name, value in overrides.items():
+        command += ["-s", f"{name}={value}"]
+
+    ready, total = [], []
+    for _ in range(repeat):
+        started = time.time()
+        proc = subprocess.run(command, cwd=str(BASE_DIR), env=env, capture_output=True, text=True)
+        total.append(time.time() - started)
+        for line in proc.stdout.splitlines():
+            if line.startswith(STARTUP_MARKER):
+                ready.append(float(line.split()[1]) - started)
+                break
+        else:
+            print(f"{spider}: no request reached the downloader (exit {proc.returncode})\n{proc.stderr[-2000:]}")
+    return {
+        "stage": f"startup.{spider}",
+        "repeat": repeat,
+        "first_request_seconds": round(statistics.median(ready), 3) if ready else None,
+        "exit_seconds": round(statistics.median(total), 3),
+    }
+
+
+def print_startup_table(results):
+    print(f"{'stage':<28}{'repeat':>7}{'first request s':>17}{'exit s':>9}")
+    for row in results:
+        print(f"{row['stage']:<28}{row['repeat']:>7}{row['first_request_seconds'] or '-':>17}{row['exit_seconds']:>9}")
+
+
+def print_table(results):
+    print(f"{'stage':<28}{'size':>9}{'seconds':>10}{'per sec':>12}{'peak KiB':>11}")
+    for row in results:
+        print(
+            f"{row['stage']:<28}{row['size']:>9}{row['seconds']:>10}"
+            f"{row['per_second'] or '-':>12}{row['peak_alloc_kib']:>11}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline spider/pipeline benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("record", help="save live responses as fixtures (needs network)")
+    run_parser = sub.add_parser("run", help="replay fixtures through spiders and pipeline")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    run_parser.add_argument(
+        "--db",
+        default="fake",
+        help="'fake' (default) for an in-memory cursor, a Postgres URL, or 'none' to skip",
+    )
+    run_parser.add_argument("--load-mode", choices=("upsert", "copy"), default="upsert")
+    run_parser.add_argument("--json", help="also write the results to this file")
+    startup_parser = sub.add_parser("startup", help="time spider process startup")
+    startup_parser.add_argument("--spiders", nargs="+", help="spider names (default: all)")
+    startup_parser.add_argument("--repeat", type=int, default=3)
+    startup_parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record()
+        return
+
+    if args.command == "startup":
+        from scrapy.spiderloader import SpiderLoader
+
+        spiders = args.spiders or SpiderLoader.from_settings(get_project_settings()).list()
+        results = [bench_startup(spider, args.repeat) for spider in spiders]
+        print_startup_table(results)
+        if args.json:
+            Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        return
+
+    if args.db == "fake" and args.load_mode == "copy":
+        parser.error("--load-mode copy needs a real database (--db URL)")
+    install_reactor(get_project_settings()["TWISTED_REACTOR"])
+    results = run_benchmarks(args.sizes, args.db, args.load_mode)
+    if args.db != "none":
+        # The reactor cannot be restarted, so the pipeline runs once, at the largest size.
+        size = max(args.sizes)
+        results.append({"stage": f"DbStorePipeline.{args.load_mode}", "size": size,
+                        **bench_pipeline(size, args.db, args.load_mode)})
+    print_table(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Playwright resource governor for the rendered (non-JSON) spiders.
+
+Does not import Playwright, so ``RenderFallbackSpider.update_settings`` can
+build the :class:`ResourceBlocker` for ``PLAYWRIGHT_ABORT_REQUEST`` without
+loading it.
+"""
+
+import logging
+from urllib.parse import urlsplit
+
+from scrapy import signals
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - optional
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+# Resource types that can run code or keep the page busy before
+# wait_for_selector resolves.
+SCRIPT_RESOURCE_TYPES = frozenset(["script", "xhr", "fetch", "eventsource", "websocket"])
+
+
+def _host_allowed(host, allowlist):
+    return any(host == domain or host.endswith("." + domain) for domain in allowlist)
+
+
+class ResourceBlocker:
+    """
+    ``PLAYWRIGHT_ABORT_REQUEST`` callable.
+
+    Aborts every request of the given resource types (images, fonts, ...) and
+    every script-like request to a host outside ``script_allowlist``, so
+    analytics, chat widgets and trackers never load.
+    """
+
+    def __init__(self, script_allowlist, blocked_types=("image", "media", "font", "stylesheet")):
+        self.script_allowlist = tuple(d.lower() for d in script_allowlist)
+        self.blocked_types = frozenset(blocked_types)
+
+    def __call__(self, request):
+        if request.resource_type in self.blocked_types:
+            return True
+        if request.resource_type in SCRIPT_RESOURCE_TYPES:
+            host = (urlsplit(request.url).hostname or "").lower()
+            return not _host_allowed(host, self.script_allowlist)
+        return False
+
+
+def browser_rss():
+    """Combined RSS in bytes of this process's child processes (Playwright driver and browser)."""
+    if psutil is None:
+        return None
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            continue
+    return total
+
+
+class BrowserGovernor:
+    """
+    Decides what happens to a Playwright page once a spider has extracted it.
+
+    * With ``PLAYWRIGHT_REUSE_PAGES`` the warm page is handed to the next
+      pagination request (``playwright_page`` meta) instead of opening a new one.
+    * Otherwise the page is closed straight away.
+    * After ``PLAYWRIGHT_RECYCLE_AFTER_PAGES`` pages, or when the browser
+      processes use more than ``PLAYWRIGHT_RECYCLE_MEMORY_MB``, the browser is
+      closed; scrapy-playwright launches a fresh one for the next request
+      (``PLAYWRIGHT_RESTART_DISCONNECTED_BROWSER``, on by default). The
+      recycle waits until no other Playwright request is in the downloader.
+    """
+
+    def __init__(self, stats, reuse_pages=True, recycle_after_pages=50, recycle_memory_mb=0):
+        self.stats = stats
+        self.reuse_pages = reuse_pages
+        self.recycle_after_pages = recycle_after_pages
+        self.recycle_memory = recycle_memory_mb * 1024 * 1024
+        self.pages_since_recycle = 0
+        self.in_flight = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        # Spiders build their governor in from_crawler, before crawler.stats exists.
+        governor = cls(
+            None,
+            reuse_pages=settings.getbool("PLAYWRIGHT_REUSE_PAGES", True),
+            recycle_after_pages=settings.getint("PLAYWRIGHT_RECYCLE_AFTER_PAGES", 50),
+            recycle_memory_mb=settings.getint("PLAYWRIGHT_RECYCLE_MEMORY_MB", 0),
+        )
+        crawler.signals.connect(governor.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(governor.request_reached, signal=signals.request_reached_downloader)
+        crawler.signals.connect(governor.request_left, signal=signals.request_left_downloader)
+        return governor
+
+    def spider_opened(self, spider):
+        if self.stats is None:
+            self.stats = spider.crawler.stats
+
+    def request_reached(self, request, spider):
+        if request.meta.get("playwright"):
+            self.in_flight += 1
+
+    def request_left(self, request, spider):
+        if request.meta.get("playwright"):
+            self.in_flight -= 1
+
+    def track(self, request):
+        """Ask scrapy-playwright for the page object so it can be reused or closed."""
+        request.meta["playwright_include_page"] = True
+        return request
+
+    def should_recycle(self):
+        if self.recycle_after_pages and self.pages_since_recycle >= self.recycle_after_pages:
+            return True
+        if self.recycle_memory:
+            rss = browser_rss()
+            return rss is not None and rss > self.recycle_memory
+        return False
+
+    async def release(self, page, next_request=None):
+        """Reuse ``page`` for ``next_request`` if allowed, otherwise close it (and maybe the browser)."""
+        if page is None:
+            return
+        self.pages_since_recycle += 1
+        recycle = self.should_recycle()
+        if next_request is not None and self.reuse_pages and not recycle:
+            next_request.meta["playwright_page"] = page
+            self.stats.inc_value("browser_governor/pages_reused")
+            return
+        browser = page.context.browser
+        await page.close()
+        self.stats.inc_value("browser_governor/pages_closed")
+        if recycle and browser is not None and self.in_flight == 0:
+            logger.info(f"Recycling browser after {self.pages_since_recycle} pages")
+            self.stats.inc_value("browser_governor/browser_recycles")
+            self.pages_since_recycle = 0
+            await browser.close()
+
+    async def discard(self, failure):
+        """Errback helper: close the page of a failed request."""
+        page = failure.request.meta.get("playwright_page")
+        if page is not None:
+            await page.close()
+            self.stats.inc_value("browser_governor/pages_closed")
@@ -0,0 +1,191 @@
+"""
+Run-to-run change detection: which products a run added, removed or changed
+compared to the catalogue the previous runs left behind.
+"""
+
+import json
+import os
+import sqlite3
+
+from itemadapter import ItemAdapter
+from scrapy.utils.project import data_path
+
+from my_scraper.dedup import canonical_product_url, digest
+
+# Item fields that make up a product's content hash. Run metadata, image
+# metadata and shopify_updated_at (bumped by inventory-only edits) are left out.
+CONTENT_FIELDS = (
+    "name", "image", "category", "brand", "vendor", "product_type", "tags",
+    "price_min", "price_max", "available",
+)
+VARIANT_FIELDS = ("shopify_id", "price", "compare_at_price", "available")
+
+# Snapshot rows the run neither emitted nor announced through products_seen.
+ABSENT_SQL = (
+    "url_hash NOT IN (SELECT url_hash FROM current) "
+    "AND url_hash NOT IN (SELECT url_hash FROM seen)"
+)
+
+
+def _fingerprint(key):
+    """Signed 64-bit hash of ``key`` (SQLite INTEGER)."""
+    return int.from_bytes(digest(key, 8), "big", signed=True)
+
+
+def product_row(item):
+    """``(url_hash, url, content_hash, name, price_min, price_max, image)`` for an item, or None."""
+    adapter = ItemAdapter(item)
+    url = canonical_product_url(adapter.get("url"))
+    if not url:
+        return None
+    content = {key: adapter.get(key) for key in CONTENT_FIELDS}
+    variants = adapter.get("variants")
+    if variants:
+        content["variants"] = [
+            [v.get(key) if isinstance(v, dict) else getattr(v, key, None) for key in VARIANT_FIELDS]
+            for v in variants
+        ]
+    content_hash = _fingerprint(json.dumps(content, sort_keys=True, default=str))
+    return (
+        _fingerprint(url), url, content_hash, content["name"],
+        content["price_min"], content["price_max"], content["image"],
+    )
+
+
+class SnapshotStore:
+    """
+    Per-spider SQLite index of the catalogue as of the last run, one row per
+    canonical product URL (8-byte URL hash, content hash, and the name, price
+    range and image shown in change reports).
+
+    A run records its items in ``current`` and the URLs it saw without
+    re-emitting them (``products_seen``) in ``seen``; :meth:`diff` compares
+    them with ``snapshot`` in SQL and :meth:`commit` folds the run into the
+    snapshot, so neither side is ever held in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS snapshot (
+                url_hash INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                content_hash INTEGER NOT NULL,
+                name TEXT,
+                price_min TEXT,
+                price_max TEXT,
+                image TEXT,
+                scrape_run_id TEXT
+            );
+            CREATE TABLE IF NOT EXISTS current (
+                url_hash INTEGER PRIMARY KEY,
+                url TEXT NOT NULL,
+                content_hash INTEGER NOT NULL,
+                name TEXT,
+                price_min TEXT,
+                price_max TEXT,
+                image TEXT
+            );
+            CREATE TABLE IF NOT EXISTS seen (url_hash INTEGER PRIMARY KEY);
+            """
+        )
+        self.conn.commit()
+
+    @classmethod
+    def from_settings(cls, settings, spider_name):
+        path = data_path(os.path.join(settings.get("CHANGES_SNAPSHOT_DIR", "snapshots"), f"{spider_name}.sqlite"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return cls(path)
+
+    def reset(self):
+        """Forget what an earlier, unfinished run recorded."""
+        self.conn.execute("DELETE FROM current")
+        self.conn.execute("DELETE FROM seen")
+        self.conn.commit()
+
+    def add(self, rows):
+        self.conn.executemany("INSERT OR REPLACE INTO current VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+    def add_seen(self, urls):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO seen VALUES (?)",
+            ((_fingerprint(url),) for url in filter(None, map(canonical_product_url, urls))),
+        )
+        self.conn.commit()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM snapshot LIMIT 1").fetchone() is None
+
+    def diff(self, removals=True):
+        """
+        Yield change records, streamed from SQLite::
+
+            {"change": "added", "url": ..., "name": ..., "price": [min, max], "image": ...}
+            {"change": "changed", "url": ..., "fields": ["price", "image"],
+             "price": {"old": [...], "new": [...]}, "image": {"old": ..., "new": ...}}
+            {"change": "removed", "url": ..., "name": ..., "price": [min, max], "image": ...}
+
+        ``fields`` lists ``price``/``image``/``name`` when those differ and
+        ``other`` when only the rest of the content (tags, variants, ...) did.
+        Removals are only reported when ``removals`` is true, i.e. the run
+        listed the whole catalogue.
+        """
+        for url, name, price_min, price_max, image in self.conn.execute(
+            """
+            SELECT c.url, c.name, c.price_min, c.price_max, c.image
+            FROM current c LEFT JOIN snapshot s ON s.url_hash = c.url_hash
+            WHERE s.url_hash IS NULL ORDER BY c.url
+            """
+        ):
+            yield {"change": "added", "url": url, "name": name, "price": [price_min, price_max], "image": image}
+        for row in self.conn.execute(
+            """
+            SELECT c.url, c.name, s.name, c.price_min, c.price_max, s.price_min, s.price_max, c.image, s.image
+            FROM current c JOIN snapshot s ON s.url_hash = c.url_hash
+            WHERE c.content_hash != s.content_hash ORDER BY c.url
+            """
+        ):
+            url, name, old_name, new_min, new_max, old_min, old_max, image, old_image = row
+            record = {"change": "changed", "url": url, "name": name, "fields": []}
+            if (new_min, new_max) != (old_min, old_max):
+                record["fields"].append("price")
+                record["price"] = {"old": [old_min, old_max], "new": [new_min, new_max]}
+            if image != old_image:
+                record["fields"].append("image")
+                record["image"] = {"old": old_image, "new": image}
+            if name != old_name:
+                record["fields"].append("name")
+                record["old_name"] = old_name
+            if not record["fields"]:
+                record["fields"].append("other")
+            yield record
+        if not removals:
+            return
+        for url, name, price_min, price_max, image in self.conn.execute(
+            f"""
+            SELECT url, name, price_min, price_max, image FROM snapshot
+            WHERE {ABSENT_SQL} ORDER BY url
+            """
+        ):
+            yield {"change": "removed", "url": url, "name": name, "price": [price_min, price_max], "image": image}
+
+    def commit(self, scrape_run_id, removals=True):
+        """Fold this run into the snapshot (dropping absent products when ``removals``) and clear it."""
+        with self.conn:
+            if removals:
+                self.conn.execute(f"DELETE FROM snapshot WHERE {ABSENT_SQL}")
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO snapshot
+                SELECT url_hash, url, content_hash, name, price_min, price_max, image, ? FROM current
+                """,
+                (scrape_run_id,),
+            )
+            self.conn.execute("DELETE FROM current")
+            self.conn.execute("DELETE FROM seen")
+
+    def close(self):
+        self.conn.close()
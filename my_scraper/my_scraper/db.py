@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+
+import psycopg2
+from psycopg2 import pool
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the connection is assumed dead and worth re-opening.
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class PoolExhausted(pool.PoolError):
+    """Every pooled connection stayed checked out for ``DB_POOL_TIMEOUT`` seconds."""
+
+
+class ConnectionManager:
+    """
+    Process-wide psycopg2 connection pool, one per database URL.
+
+    Every spider running in the same process (see ``run_all_spiders``) shares
+    the pool instead of opening its own connections. Connections are health
+    checked when they are handed out, and opening one is retried with
+    exponential backoff so a failover does not disable the pipeline.
+
+    When all ``maxconn`` connections are checked out, :meth:`getconn` waits
+    for one to come back, for at most ``timeout`` seconds, and then raises
+    :class:`PoolExhausted`.
+    """
+
+    _managers = {}
+    _lock = threading.Lock()
+
+    def __init__(self, db_url, maxconn=4, retry_times=5, backoff=1.0, backoff_max=30.0, timeout=300.0):
+        self.db_url = db_url
+        self.maxconn = maxconn
+        self.retry_times = retry_times
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.pool = pool.ThreadedConnectionPool(0, maxconn, db_url)
+        # One slot per connection; ThreadedConnectionPool raises instead of waiting.
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.users = 0
+
+    @classmethod
+    def from_settings(cls, db_url, settings):
+        """Return the shared manager for ``db_url``, creating it on first use."""
+        with cls._lock:
+            manager = cls._managers.get(db_url)
+            if manager is None:
+                manager = cls(
+                    db_url,
+                    maxconn=settings.getint("DB_POOL_MAXCONN", 4),
+                    retry_times=settings.getint("DB_RETRY_TIMES", 5),
+                    backoff=settings.getfloat("DB_RETRY_BACKOFF", 1.0),
+                    backoff_max=settings.getfloat("DB_RETRY_BACKOFF_MAX", 30.0),
+                    timeout=settings.getfloat("DB_POOL_TIMEOUT", 300.0),
+                )
+                cls._managers[db_url] = manager
+            manager.users += 1
+            return manager
+
+    def release(self):
+        """Drop one user; the pool is closed when the last spider is done with it."""
+        with self._lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            self._managers.pop(self.db_url, None)
+        self.pool.closeall()
+
+    def delay(self, attempt):
+        return min(self.backoff * 2 ** (attempt - 1), self.backoff_max)
+
+    def getconn(self):
+        """Check out a live connection, retrying with backoff while the DB is unreachable."""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(
+                f"all {self.maxconn} pooled connections stayed checked out for {self.timeout:g}s; "
+                "raise DB_POOL_MAXCONN (or DB_POOL_TIMEOUT)"
+            )
+        try:
+            return self._getconn()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _getconn(self):
+        attempt = 0
+        while True:
+            try:
+                conn = self.pool.getconn()
+                if self._healthy(conn):
+                    return conn
+                self.pool.putconn(conn, close=True)
+                raise psycopg2.OperationalError("pooled connection failed health check")
+            except CONNECTION_ERRORS as exc:
+                attempt += 1
+                if attempt > self.retry_times:
+                    raise
+                delay = self.delay(attempt)
+                logger.warning(f"Database unavailable ({exc}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def putconn(self, conn, close=False):
+        if not close and not conn.closed:
+            try:
+                conn.rollback()
+            except CONNECTION_ERRORS:
+                close = True
+        try:
+            self.pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            self.slots.release()
+
+    @staticmethod
+    def _healthy(conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except CONNECTION_ERRORS:
+            return False
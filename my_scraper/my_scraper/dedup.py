@@ -0,0 +1,96 @@
+"""
+Canonical product URLs and bounded-memory "seen" sets for DedupPipeline.
+"""
+
+import hashlib
+import math
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# /collections/<handle>/products/<handle> -> /products/<handle>
+COLLECTION_PREFIX = re.compile(r"^/collections/[^/]+(?=/products/)")
+
+# Query parameters that never change which product a non-/products/ URL points at.
+TRACKING_PARAMS = ("variant", "_pos", "_sid", "_ss", "_psq", "_fid", "ref", "fbclid", "gclid")
+
+
+def canonical_product_url(url):
+    """
+    Normalize a product URL so the same product always maps to one string.
+
+    Lower-cases scheme and host, drops the fragment, any
+    ``/collections/<x>`` prefix and trailing slashes. Shopify ``/products/``
+    URLs lose their whole query string (variant, search and tracking
+    parameters); other URLs only lose known tracking parameters.
+    """
+    if not url:
+        return url
+    parts = urlsplit(url.strip())
+    path = COLLECTION_PREFIX.sub("", parts.path).rstrip("/") or "/"
+    if "/products/" in path:
+        query = ""
+    else:
+        query = urlencode([
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if key not in TRACKING_PARAMS and not key.startswith("utm_")
+        ])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+
+def digest(key, size):
+    """``size``-byte BLAKE2b hash of ``key``; shared by the seen sets and the change snapshots."""
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=size).digest()
+
+
+class FingerprintSet:
+    """Exact set of 8-byte URL hashes (~60 bytes per entry instead of the full URL)."""
+
+    def __init__(self):
+        self.fingerprints = set()
+
+    def add(self, key):
+        """Add ``key``; return True if it was already present."""
+        fp = int.from_bytes(digest(key, 8), "big")
+        if fp in self.fingerprints:
+            return True
+        self.fingerprints.add(fp)
+        return False
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter for very large catalogues.
+
+    Memory is fixed up front from ``capacity`` and ``error_rate``; past
+    ``capacity`` entries the false-positive rate (a new product wrongly
+    dropped as a duplicate) rises above ``error_rate``.
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001):
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def add(self, key):
+        """Add ``key``; return True if it was (probably) already present."""
+        hashed = digest(key, 16)
+        h1 = int.from_bytes(hashed[:8], "big")
+        h2 = int.from_bytes(hashed[8:], "big") | 1
+        present = True
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.array[byte] & mask:
+                present = False
+                self.array[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+    def __len__(self):
+        return self.count
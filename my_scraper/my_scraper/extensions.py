@@ -0,0 +1,668 @@
+# Define here the extensions for your project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import task
+
+from my_scraper.changes import SnapshotStore, product_row
+from my_scraper.profiling import StackSampler, StageProfiler
+from my_scraper.runstate import RunState, now_iso
+from my_scraper.signals import db_committed, products_seen
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - optional
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+
+class LatencySamples:
+    """Running count/total/max plus a fixed-size reservoir for percentiles."""
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < self.size:
+                self.samples[i] = value
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+        return round(ordered[index], 4)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else None,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": round(self.max, 4) if self.count else None,
+        }
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None if it cannot be measured."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+class CrawlMetrics:
+    """
+    Per-spider run metrics written to ``METRICS_DIR/<scrape_run_id>/<spider>.json``.
+
+    Records elapsed time, request/response/byte counts, download latency
+    percentiles (plain HTTP and Playwright pages separately), items/sec, DB
+    flush latency (from the ``db/flush_*`` stats of DbStorePipeline) and peak
+    RSS. ``run_all_spiders`` copies a summary into last-scrape.json.
+    """
+
+    def __init__(self, crawler, metrics_dir, sample_size, rss_interval):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.metrics_dir = metrics_dir
+        self.rss_interval = rss_interval
+        self.http_latency = LatencySamples(sample_size)
+        self.playwright_latency = LatencySamples(sample_size)
+        self.peak_rss = None
+        self.rss_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            metrics_dir=settings.get("METRICS_DIR", "metrics"),
+            sample_size=settings.getint("METRICS_LATENCY_SAMPLES", 10000),
+            rss_interval=settings.getfloat("METRICS_RSS_INTERVAL", 5.0),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.sample_rss()
+        self.rss_task = task.LoopingCall(self.sample_rss)
+        self.rss_task.start(self.rss_interval, now=False)
+
+    def sample_rss(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, rss)
+
+    def response_received(self, response, request, spider):
+        latency = request.meta.get("download_latency")
+        if latency is None:
+            return
+        if request.meta.get("playwright"):
+            self.playwright_latency.add(latency)
+        else:
+            self.http_latency.add(latency)
+
+    def spider_closed(self, spider, reason):
+        if self.rss_task and self.rss_task.running:
+            self.rss_task.stop()
+        self.sample_rss()
+        metrics = self.collect(spider, reason)
+        run_id = getattr(spider, "scrape_run_id", None) or self.started_at.strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.metrics_dir, run_id, f"{spider.name}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(metrics, f, indent=2)
+        spider.logger.info(
+            f"Metrics: {metrics['items']} items in {metrics['elapsed_seconds']}s "
+            f"({metrics['items_per_second']}/s), written to {path}"
+        )
+
+    def collect(self, spider, reason):
+        elapsed = time.perf_counter() - self.started
+        items = self.stats.get_value("item_scraped_count", 0)
+        flush_count = self.stats.get_value("db/flush_count", 0)
+        flush_total = self.stats.get_value("db/flush_seconds", 0.0)
+        return {
+            "spider": spider.name,
+            "scrape_run_id": getattr(spider, "scrape_run_id", None),
+            "finish_reason": reason,
+            # "delta" feeds (Shopify watermark runs) do not list the whole catalogue.
+            "feed": getattr(spider, "feed_kind", "complete"),
+            "started_at": self.started_at.isoformat(),
+            "elapsed_seconds": round(elapsed, 3),
+            "requests": self.stats.get_value("downloader/request_count", 0),
+            "responses": self.stats.get_value("downloader/response_count", 0),
+            "bytes_downloaded": self.stats.get_value("downloader/response_bytes", 0),
+            "items": items,
+            "items_per_second": round(items / elapsed, 3) if elapsed else None,
+            "download_latency_seconds": self.http_latency.summary(),
+            "playwright_page_seconds": self.playwright_latency.summary(),
+            "pipeline_flush_seconds": {
+                "count": flush_count,
+                "total": round(flush_total, 4),
+                "mean": round(flush_total / flush_count, 4) if flush_count else None,
+                "max": round(self.stats.get_value("db/flush_seconds_max", 0.0), 4),
+            },
+            "peak_rss_bytes": self.peak_rss,
+        }
+
+
+class RunStateRecorder:
+    """
+    Keeps ``spiders/<name>.json`` of the run's :class:`~my_scraper.runstate.RunState`
+    current: ``running`` while crawling, then ``finished`` or the close reason,
+    with the item count over all attempts and the last DB checkpoint.
+    ``run_all_spiders --resume`` skips the spiders recorded as finished.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.state = None
+        self.resumed = False
+        self.previous_items = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("RUN_STATE_ENABLED"):
+            raise NotConfigured
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.db_committed, signal=db_committed)
+        return ext
+
+    def spider_opened(self, spider):
+        run_id = getattr(spider, "scrape_run_id", None)
+        if not run_id:
+            return
+        self.state = RunState.for_run(self.crawler.settings, run_id)
+        previous = self.state.spider(spider.name)
+        self.resumed = self.crawler.settings.getbool("RUN_RESUME") and bool(previous)
+        # A fresh attempt starts counting again; a resumed one adds to it.
+        self.previous_items = previous.get("items", 0) if self.resumed else 0
+        self.state.update_spider(
+            spider.name,
+            status="running",
+            attempts=previous.get("attempts", 0) + 1 if self.resumed else 1,
+            started_at=now_iso(),
+            jobdir=self.crawler.settings.get("JOBDIR"),
+            items=self.previous_items,
+            checkpoint=previous.get("checkpoint") if self.resumed else None,
+        )
+
+    def db_committed(self, rows, spider):
+        if self.state is None:
+            return
+        checkpoint = self.state.spider(spider.name).get("checkpoint") or {"batches": 0, "rows": 0}
+        self.state.update_spider(
+            spider.name,
+            items=self.previous_items + self.stats.get_value("item_scraped_count", 0),
+            checkpoint={
+                "batches": checkpoint["batches"] + 1,
+                "rows": checkpoint["rows"] + rows,
+                "at": now_iso(),
+            },
+        )
+
+    def spider_closed(self, spider, reason):
+        if self.state is None:
+            return
+        self.state.update_spider(
+            spider.name,
+            status="finished" if reason == "finished" else reason,
+            finished_at=now_iso(),
+            items=self.previous_items + self.stats.get_value("item_scraped_count", 0),
+            # Items of the interrupted attempt may be missing from the feed.
+            feed="partial" if self.resumed else getattr(spider, "feed_kind", "complete"),
+        )
+
+
+class ChangeDetector:
+    """
+    Per-spider change report of a run against the catalogue of the previous
+    runs, kept in a :class:`~my_scraper.changes.SnapshotStore`.
+
+    Scraped items are recorded in batches of ``CHANGES_BATCH_SIZE`` as they
+    pass the pipelines, and URLs announced through ``products_seen`` count as
+    present and unchanged. On close the report is streamed to
+    ``CHANGES_DIR/<scrape_run_id>/<spider>.jsonl`` (one added / changed /
+    removed product per line) with the counts in ``<spider>.json``, and the
+    run is folded into the snapshot. Products are only reported removed after
+    a finished, non-resumed run with a ``complete`` feed; delta and partial
+    runs only add and update. ``run_all_spiders`` copies the counts into
+    last-scrape.json so downstream jobs can work through the delta alone.
+    """
+
+    def __init__(self, crawler, changes_dir, batch_size):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.changes_dir = changes_dir
+        self.batch_size = batch_size
+        self.resume = crawler.settings.getbool("RUN_RESUME")
+        self.store = None
+        self.rows = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("CHANGES_ENABLED"):
+            raise NotConfigured
+        ext = cls(
+            crawler,
+            changes_dir=settings.get("CHANGES_DIR", "changes"),
+            batch_size=settings.getint("CHANGES_BATCH_SIZE", 500),
+        )
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.products_seen, signal=products_seen)
+        return ext
+
+    def spider_opened(self, spider):
+        self.store = SnapshotStore.from_settings(self.crawler.settings, spider.name)
+        if not self.resume:
+            # A resumed run keeps what the interrupted attempt recorded.
+            self.store.reset()
+
+    def item_scraped(self, item, response, spider):
+        row = product_row(item)
+        if row is None:
+            return
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.store.add(self.rows)
+            self.rows = []
+
+    def products_seen(self, urls, spider):
+        if self.store is not None:
+            self.store.add_seen(urls)
+
+    def spider_closed(self, spider, reason):
+        if self.store is None:
+            return
+        self.store.add(self.rows)
+        self.rows = []
+        removals = (
+            reason == "finished"
+            and not self.resume
+            and getattr(spider, "feed_kind", "complete") == "complete"
+        )
+        run_id = getattr(spider, "scrape_run_id", None) or datetime.now().strftime("%Y%m%d_%H%M%S")
+        run_dir = os.path.join(self.changes_dir, run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        summary_path = os.path.join(run_dir, f"{spider.name}.json")
+        list_path = os.path.join(run_dir, f"{spider.name}.jsonl")
+
+        counts = dict.fromkeys(("added", "changed", "removed", "price_changed", "image_changed"), 0)
+        baseline = self.store.is_empty()
+        # A resumed attempt adds to the report of the interrupted one.
+        append = self.resume and os.path.exists(summary_path)
+        if append:
+            with open(summary_path, encoding="utf-8") as f:
+                previous = json.load(f)
+            counts.update({key: previous.get(key, 0) for key in counts})
+            baseline = previous.get("baseline", baseline)
+        with open(list_path, "a" if append else "w", encoding="utf-8") as f:
+            for record in self.store.diff(removals=removals):
+                counts[record["change"]] += 1
+                if "price" in record.get("fields", ()):
+                    counts["price_changed"] += 1
+                if "image" in record.get("fields", ()):
+                    counts["image_changed"] += 1
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.store.commit(run_id, removals=removals)
+        self.store.close()
+        self.store = None
+
+        for key, value in counts.items():
+            self.stats.set_value(f"changes/{key}", value)
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "spider": spider.name,
+                "scrape_run_id": run_id,
+                # Nothing to compare against yet: every product is "added".
+                "baseline": baseline,
+                "removals_checked": removals,
+                **counts,
+                "changes_file": os.path.basename(list_path),
+            }, f, indent=2)
+        spider.logger.info(
+            f"Changes: {counts['added']} added, {counts['changed']} changed, "
+            f"{counts['removed']} removed, written to {list_path}"
+        )
+
+
+class StageProfiling:
+    """
+    Writes the stage timings of a profiled crawl (``PROFILE_ENABLED``, see
+    :mod:`my_scraper.profiling`) to ``PROFILE_DIR/<scrape_run_id>/``:
+
+    * ``<spider>.json``: count/total/mean/max seconds per stage
+    * ``<spider>.folded``: the stages as folded stacks (self time in µs)
+    * ``<spider>.prof`` and ``<spider>.cprofile.txt`` with ``PROFILE_CPROFILE``
+    * ``<spider>.stacks.folded``: sampled Python stacks every
+      ``PROFILE_SAMPLE_INTERVAL`` seconds, when set
+    * ``<spider>.tracemalloc.txt``: the top ``PROFILE_TRACEMALLOC_TOP``
+      allocation sites with ``PROFILE_TRACEMALLOC``
+
+    cProfile, stack sampling and tracemalloc cover the whole process, so when
+    several spiders share one (run_all_spiders in-process mode) only the
+    first spider opened gets them; profile with ``--mode subprocess`` to get
+    them for every spider.
+    """
+
+    # The instance running cProfile / the sampler / tracemalloc in this process.
+    process_owner = None
+
+    def __init__(self, crawler, profile_dir):
+        self.crawler = crawler
+        self.settings = crawler.settings
+        self.profiler = StageProfiler.for_crawler(crawler)
+        self.profile_dir = profile_dir
+        self.cprofile = None
+        self.sampler = None
+        self.tracemalloc = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("PROFILE_ENABLED"):
+            raise NotConfigured
+        ext = cls(crawler, profile_dir=crawler.settings.get("PROFILE_DIR", "profiles"))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started_at = datetime.now(timezone.utc)
+        if StageProfiling.process_owner is not None:
+            spider.logger.info("Profiling: cProfile/sampling/tracemalloc already run by another spider")
+            return
+        StageProfiling.process_owner = self
+        if self.settings.getbool("PROFILE_TRACEMALLOC") and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracemalloc = True
+        interval = self.settings.getfloat("PROFILE_SAMPLE_INTERVAL", 0)
+        if interval > 0:
+            self.sampler = StackSampler(threading.get_ident(), interval)
+            self.sampler.start()
+        if self.settings.getbool("PROFILE_CPROFILE"):
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def spider_closed(self, spider, reason):
+        run_id = getattr(spider, "scrape_run_id", None) or self.started_at.strftime("%Y%m%d_%H%M%S")
+        run_dir = os.path.join(self.profile_dir, run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        base = os.path.join(run_dir, spider.name)
+        report = {
+            "spider": spider.name,
+            "scrape_run_id": run_id,
+            "finish_reason": reason,
+            "stages": self.profiler.summary(),
+        }
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(f"{base}.prof")
+            with open(f"{base}.cprofile.txt", "w", encoding="utf-8") as f:
+                pstats.Stats(self.cprofile, stream=f).sort_stats("cumulative").print_stats(60)
+            self.cprofile = None
+        if self.sampler is not None:
+            self.sampler.stop()
+            with open(f"{base}.stacks.folded", "w", encoding="utf-8") as f:
+                f.writelines(self.sampler.folded())
+            self.sampler = None
+        if self.tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report["tracemalloc"] = {"current_bytes": current, "peak_bytes": peak}
+            with open(f"{base}.tracemalloc.txt", "w", encoding="utf-8") as f:
+                for stat in snapshot.statistics("lineno")[: self.settings.getint("PROFILE_TRACEMALLOC_TOP", 25)]:
+                    f.write(f"{stat}\n")
+            self.tracemalloc = False
+        if StageProfiling.process_owner is self:
+            StageProfiling.process_owner = None
+        with open(f"{base}.folded", "w", encoding="utf-8") as f:
+            f.writelines(self.profiler.folded(spider.name))
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        spider.logger.info(f"Profile: {len(report['stages'])} stages written to {base}.json / {base}.folded")
+
+
+class _SlotState:
+    """Controller state for one downloader slot (normally one domain)."""
+
+    def __init__(self, key, profile_name, profile):
+        self.key = key
+        self.profile_name = profile_name
+        self.min_delay = profile["min_delay"]
+        self.max_delay = profile["max_delay"]
+        self.max_concurrency = profile["max_concurrency"]
+        self.target_latency = profile["target_latency"]
+        self.delay = profile["start_delay"]
+        self.concurrency = profile["start_concurrency"]
+        self.latency = None
+        self.healthy = 0
+        self.backoffs = 0
+        self.last_backoff = None
+        self.slot = None
+
+    def apply(self, slot):
+        slot.delay = self.delay
+        slot.concurrency = self.concurrency
+        self.slot = slot
+
+    def rate(self):
+        return f"concurrency={self.concurrency} delay={self.delay:.2f}s latency={self.latency or 0:.2f}s"
+
+
+class AdaptiveThrottle:
+    """
+    Per-domain delay and concurrency controller.
+
+    Each downloader slot starts from a profile (``ADAPTIVE_THROTTLE_PROFILES``)
+    picked by the request's ``throttle_profile`` meta key, the spider's
+    ``throttle_profile`` attribute, the request domain
+    (``ADAPTIVE_THROTTLE_DOMAINS``) or, for Playwright requests,
+    ``ADAPTIVE_THROTTLE_RENDER_PROFILE``. From there it ramps up while the
+    latency EWMA stays under the profile's ``target_latency``: every
+    ``ADAPTIVE_THROTTLE_RAMP_AFTER`` healthy responses the delay shrinks by a
+    quarter and the concurrency grows by one. Slow responses raise the delay,
+    and 429/503 (``ADAPTIVE_THROTTLE_BACKOFF_CODES``) halve the concurrency,
+    double the delay and honour ``Retry-After``.
+
+    Replaces the fixed DOWNLOAD_DELAY while enabled; AutoThrottle should stay off.
+    """
+
+    def __init__(self, crawler, profiles, domains, render_profile, backoff_codes, ramp_after, smoothing, debug):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.profiles = profiles
+        self.domains = domains
+        self.render_profile = render_profile
+        self.backoff_codes = set(backoff_codes)
+        self.ramp_after = ramp_after
+        self.smoothing = smoothing
+        self.log_level = logging.INFO if debug else logging.DEBUG
+        self.slots = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_THROTTLE_ENABLED"):
+            raise NotConfigured
+        if settings.getbool("AUTOTHROTTLE_ENABLED"):
+            raise NotConfigured("AdaptiveThrottle and AutoThrottle both adjust slot delays; enable only one")
+        profiles = settings.getdict("ADAPTIVE_THROTTLE_PROFILES")
+        if "default" not in profiles:
+            raise NotConfigured("ADAPTIVE_THROTTLE_PROFILES needs a 'default' profile")
+        ext = cls(
+            crawler,
+            profiles=profiles,
+            domains=settings.getdict("ADAPTIVE_THROTTLE_DOMAINS"),
+            render_profile=settings.get("ADAPTIVE_THROTTLE_RENDER_PROFILE", "default"),
+            backoff_codes=settings.getlist("ADAPTIVE_THROTTLE_BACKOFF_CODES", [429, 503]),
+            ramp_after=settings.getint("ADAPTIVE_THROTTLE_RAMP_AFTER", 5),
+            smoothing=settings.getfloat("ADAPTIVE_THROTTLE_SMOOTHING", 0.3),
+            debug=settings.getbool("ADAPTIVE_THROTTLE_DEBUG"),
+        )
+        crawler.signals.connect(ext.request_reached, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def profile_name(self, request, spider):
+        if request.meta.get("throttle_profile"):
+            return request.meta["throttle_profile"]
+        if request.meta.get("playwright"):
+            return self.render_profile
+        name = getattr(spider, "throttle_profile", None)
+        if name:
+            return name
+        host = (urlparse_cached(request).hostname or "").lower()
+        for domain, name in self.domains.items():
+            if host == domain or host.endswith("." + domain):
+                return name
+        return "default"
+
+    def request_reached(self, request, spider):
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return
+        state = self.slots.get(key)
+        if state is None:
+            name = self.profile_name(request, spider)
+            if name not in self.profiles:
+                logger.warning(f"Unknown throttle profile {name!r} for {key}, using 'default'")
+                name = "default"
+            state = self.slots[key] = _SlotState(key, name, self.profiles[name])
+            logger.info(f"Throttle {key}: profile {name!r}, starting at {state.rate()}")
+        if state.slot is not slot:
+            # New slot, or the downloader garbage-collected an idle one.
+            state.apply(slot)
+
+    def response_downloaded(self, response, request, spider):
+        state = self.slots.get(request.meta.get("download_slot"))
+        if state is None or state.slot is None:
+            return
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            state.latency = latency if state.latency is None else (
+                self.smoothing * latency + (1 - self.smoothing) * state.latency
+            )
+
+        if response.status in self.backoff_codes:
+            self.back_off(state, response)
+        elif response.status < 400 and state.latency is not None:
+            if state.latency > state.target_latency:
+                self.slow_down(state)
+            else:
+                self.ramp_up(state)
+        state.apply(state.slot)
+
+    def back_off(self, state, response):
+        state.healthy = 0
+        now = time.monotonic()
+        # Requests already in flight when the first 429 arrived fail together;
+        # count them as one signal rather than halving once per response.
+        if state.last_backoff is None or now - state.last_backoff >= state.delay:
+            state.backoffs += 1
+            state.last_backoff = now
+            state.concurrency = max(1, state.concurrency // 2)
+            state.delay = min(state.max_delay, max(state.delay * 2, state.min_delay, 0.5))
+            self.stats.inc_value("adaptive_throttle/backoffs")
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after:
+            state.delay = min(state.max_delay, max(state.delay, retry_after))
+        logger.info(f"Throttle {state.key}: HTTP {response.status}, backing off to {state.rate()}")
+
+    def slow_down(self, state):
+        state.healthy = 0
+        old = state.delay
+        state.delay = min(state.max_delay, max(state.delay * 1.25, state.min_delay, 0.1))
+        if state.delay != old:
+            logger.log(self.log_level, f"Throttle {state.key}: latency above target, slowing to {state.rate()}")
+
+    def ramp_up(self, state):
+        state.healthy += 1
+        if state.healthy < self.ramp_after:
+            return
+        state.healthy = 0
+        old = (state.concurrency, state.delay)
+        state.delay = max(state.min_delay, state.delay * 0.75)
+        if state.delay < 0.01:
+            state.delay = state.min_delay
+        state.concurrency = min(state.max_concurrency, state.concurrency + 1)
+        if (state.concurrency, state.delay) != old:
+            level = logging.INFO if state.concurrency != old[0] else self.log_level
+            logger.log(level, f"Throttle {state.key}: healthy, ramping to {state.rate()}")
+
+    def spider_closed(self, spider, reason):
+        for key, state in self.slots.items():
+            logger.info(f"Throttle {key} ({state.profile_name}): finished at {state.rate()}, {state.backoffs} backoffs")
+            self.stats.set_value(f"adaptive_throttle/{key}/delay", round(state.delay, 3))
+            self.stats.set_value(f"adaptive_throttle/{key}/concurrency", state.concurrency)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    value = value.decode("latin-1").strip() if isinstance(value, bytes) else str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
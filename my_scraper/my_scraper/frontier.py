@@ -0,0 +1,591 @@
+"""
+Shared crawl frontier: a request queue, a dupefilter and run locks that
+several worker processes or hosts can use at once.
+
+Two backends:
+
+* ``"sqlite"``: one SQLite file (WAL mode), for several processes on one host.
+* ``"redis"``: a Redis (or Redis-compatible) server, for several hosts. Needs
+  the ``redis`` package.
+
+Queues, fingerprints and the spiders' crawl progress
+(:class:`my_scraper.progress.SharedProgress`) are keyed by
+``<spider>:<scrape_run_id>``: every worker started with the same spider and
+run id shares one frontier, and a new run starts from an empty one.
+"""
+
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from heapq import heappop, heappush
+from itertools import count
+
+from scrapy import signals
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.misc import build_from_crawler, load_object
+from scrapy.utils.project import data_path
+from scrapy.utils.request import request_from_dict
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+def frontier_key(spider):
+    return f"{spider.name}:{getattr(spider, 'scrape_run_id', '') or 'default'}"
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SqliteFrontier:
+    """Frontier in a SQLite file; safe for concurrent processes on one host."""
+
+    def __init__(self, path, retention_days=7):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.worker = worker_id()
+        self.touched = {}
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS requests_next ON requests (key, priority DESC, id);
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                key TEXT NOT NULL,
+                fp BLOB NOT NULL,
+                PRIMARY KEY (key, fp)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS frontiers (
+                key TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                active_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                key TEXT NOT NULL,
+                worker TEXT NOT NULL,
+                active_at REAL NOT NULL,
+                PRIMARY KEY (key, worker)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS progress (
+                key TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value,
+                PRIMARY KEY (key, name)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS locks (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """
+        )
+
+    @classmethod
+    def from_settings(cls, settings):
+        path = data_path(settings.get("FRONTIER_SQLITE_PATH", "frontier.sqlite"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return cls(path, retention_days=settings.getint("FRONTIER_RETENTION_DAYS", 7))
+
+    def register(self, key):
+        """Create ``key`` if needed and drop frontiers of runs older than the retention."""
+        now = time.time()
+        with self._transaction():
+            for (old,) in self.conn.execute(
+                "SELECT key FROM frontiers WHERE active_at < ? AND key <> ?", (now - self.retention, key)
+            ).fetchall():
+                self.clear(old)
+            self.conn.execute("INSERT OR IGNORE INTO frontiers VALUES (?, ?, ?)", (key, now, now))
+
+    def clear(self, key):
+        for table in ("requests", "fingerprints", "frontiers", "workers", "progress"):
+            self.conn.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+
+    def push(self, key, data, priority):
+        self.conn.execute("INSERT INTO requests (key, priority, data) VALUES (?, ?, ?)", (key, priority, data))
+        self._touch(key)
+
+    def pop(self, key):
+        row = self.conn.execute(
+            """
+            DELETE FROM requests WHERE id = (
+                SELECT id FROM requests WHERE key = ? ORDER BY priority DESC, id LIMIT 1
+            ) RETURNING data
+            """,
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None
+        self._touch(key)
+        return row[0]
+
+    def has_pending(self, key):
+        return self.conn.execute("SELECT 1 FROM requests WHERE key = ? LIMIT 1", (key,)).fetchone() is not None
+
+    def pending(self, key):
+        return self.conn.execute("SELECT count(*) FROM requests WHERE key = ?", (key,)).fetchone()[0]
+
+    def add_fingerprint(self, key, fp):
+        """Record ``fp``; return True if some worker had already recorded it."""
+        cur = self.conn.execute("INSERT OR IGNORE INTO fingerprints VALUES (?, ?)", (key, fp))
+        return cur.rowcount == 0
+
+    def progress(self, key):
+        """Every progress value of ``key``, by name."""
+        return dict(self.conn.execute("SELECT name, value FROM progress WHERE key = ?", (key,)).fetchall())
+
+    def progress_add(self, key, name, amount):
+        self.conn.execute(
+            "INSERT INTO progress VALUES (?, ?, ?) "
+            "ON CONFLICT (key, name) DO UPDATE SET value = value + excluded.value",
+            (key, name, amount),
+        )
+
+    def progress_max(self, key, name, value):
+        """Raise ``name`` to ``value``; return its previous value (None if unset)."""
+        return self._progress_replace(key, name, value, lambda new, old: new > old)
+
+    def progress_min(self, key, name, value):
+        """Lower ``name`` to ``value``; return its previous value (None if unset)."""
+        return self._progress_replace(key, name, value, lambda new, old: new < old)
+
+    def progress_setdefault(self, key, name, value):
+        """Set ``name`` unless it is set already; return the stored value."""
+        self.conn.execute("INSERT OR IGNORE INTO progress VALUES (?, ?, ?)", (key, name, value))
+        return self.progress_get(key, name)
+
+    def progress_get(self, key, name):
+        row = self.conn.execute("SELECT value FROM progress WHERE key = ? AND name = ?", (key, name)).fetchone()
+        return row[0] if row else None
+
+    def _progress_replace(self, key, name, value, better):
+        with self._transaction():
+            previous = self.progress_get(key, name)
+            if previous is None or better(value, previous):
+                self.conn.execute("INSERT OR REPLACE INTO progress VALUES (?, ?, ?)", (key, name, value))
+        return previous
+
+    def others_active_at(self, key):
+        """Last time another worker pushed or popped on ``key`` (0 if never)."""
+        row = self.conn.execute(
+            "SELECT max(active_at) FROM workers WHERE key = ? AND worker <> ?", (key, self.worker)
+        ).fetchone()
+        return row[0] or 0.0
+
+    def _touch(self, key):
+        now = time.time()
+        if now - self.touched.get(key, 0.0) < 1.0:
+            return
+        self.touched[key] = now
+        self.conn.execute("INSERT OR REPLACE INTO workers VALUES (?, ?, ?)", (key, self.worker, now))
+        self.conn.execute("UPDATE frontiers SET active_at = ? WHERE key = ?", (now, key))
+
+    def acquire_lock(self, name, owner, ttl):
+        now = time.time()
+        with self._transaction():
+            self.conn.execute("DELETE FROM locks WHERE name = ? AND expires_at < ?", (name, now))
+            self.conn.execute("INSERT OR IGNORE INTO locks VALUES (?, ?, ?)", (name, owner, now + ttl))
+            row = self.conn.execute("SELECT owner FROM locks WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == owner
+
+    def refresh_lock(self, name, owner, ttl):
+        cur = self.conn.execute(
+            "UPDATE locks SET expires_at = ? WHERE name = ? AND owner = ?", (time.time() + ttl, name, owner)
+        )
+        return cur.rowcount == 1
+
+    def release_lock(self, name, owner):
+        self.conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, owner))
+
+    def lock_owner(self, name):
+        row = self.conn.execute(
+            "SELECT owner FROM locks WHERE name = ? AND expires_at >= ?", (name, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _transaction(self):
+        return _SqliteTransaction(self.conn)
+
+    def close(self):
+        self.conn.close()
+
+
+class _SqliteTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+# Compare-and-delete / compare-and-extend, so a lock is only touched by its owner.
+_RELEASE_LUA = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+_REFRESH_LUA = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+)
+# Keep the higher (ARGV[3] == "max") or lower of a hash field and ARGV[2]; return the previous value.
+_REPLACE_LUA = """
+local old = redis.call('hget', KEYS[1], ARGV[1])
+local new = tonumber(ARGV[2])
+if not old or (ARGV[3] == 'max' and new > tonumber(old)) or (ARGV[3] == 'min' and new < tonumber(old)) then
+    redis.call('hset', KEYS[1], ARGV[1], ARGV[2])
+end
+return old
+"""
+
+
+class RedisFrontier:
+    """
+    Frontier on a Redis server (5.0+), shared by workers on any number of hosts.
+
+    Requests live in a sorted set scored by ``-priority``; members start with a
+    zero-padded sequence number, so equal priorities pop in FIFO order.
+    """
+
+    SEQ_WIDTH = 20
+    PARTS = ("queue", "seen", "seq", "workers", "progress")
+
+    def __init__(self, url, prefix="my_scraper", retention_days=7):
+        if redis is None:
+            raise RuntimeError("FRONTIER_BACKEND = 'redis' needs the redis package (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.retention = retention_days * 86400
+        self.worker = worker_id()
+        self.touched = {}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get("FRONTIER_REDIS_URL", "redis://localhost:6379/0"),
+            prefix=settings.get("FRONTIER_REDIS_PREFIX", "my_scraper"),
+            retention_days=settings.getint("FRONTIER_RETENTION_DAYS", 7),
+        )
+
+    def _k(self, key, part):
+        return f"{self.prefix}:{key}:{part}"
+
+    def register(self, key):
+        self._touch(key)
+
+    def clear(self, key):
+        self.client.delete(*(self._k(key, part) for part in self.PARTS))
+
+    def push(self, key, data, priority):
+        seq = self.client.incr(self._k(key, "seq"))
+        member = str(seq).zfill(self.SEQ_WIDTH).encode() + data
+        self.client.zadd(self._k(key, "queue"), {member: -priority})
+        self._touch(key)
+
+    def pop(self, key):
+        popped = self.client.zpopmin(self._k(key, "queue"))
+        if not popped:
+            return None
+        self._touch(key)
+        return popped[0][0][self.SEQ_WIDTH:]
+
+    def has_pending(self, key):
+        return self.pending(key) > 0
+
+    def pending(self, key):
+        return self.client.zcard(self._k(key, "queue"))
+
+    def add_fingerprint(self, key, fp):
+        return self.client.sadd(self._k(key, "seen"), fp) == 0
+
+    def progress(self, key):
+        return {name.decode(): value.decode() for name, value in self.client.hgetall(self._k(key, "progress")).items()}
+
+    def progress_add(self, key, name, amount):
+        self.client.hincrbyfloat(self._k(key, "progress"), name, amount)
+        self._touch(key)
+
+    def progress_max(self, key, name, value):
+        return self._progress_replace(key, name, value, "max")
+
+    def progress_min(self, key, name, value):
+        return self._progress_replace(key, name, value, "min")
+
+    def progress_setdefault(self, key, name, value):
+        self.client.hsetnx(self._k(key, "progress"), name, value)
+        return self.progress_get(key, name)
+
+    def progress_get(self, key, name):
+        value = self.client.hget(self._k(key, "progress"), name)
+        return value.decode() if value is not None else None
+
+    def _progress_replace(self, key, name, value, op):
+        previous = self.client.eval(_REPLACE_LUA, 1, self._k(key, "progress"), name, value, op)
+        self._touch(key)
+        return float(previous) if previous is not None else None
+
+    def others_active_at(self, key):
+        workers = self.client.hgetall(self._k(key, "workers"))
+        return max(
+            (float(ts) for worker, ts in workers.items() if worker.decode() != self.worker),
+            default=0.0,
+        )
+
+    def _touch(self, key):
+        now = time.time()
+        if now - self.touched.get(key, 0.0) < 1.0:
+            return
+        self.touched[key] = now
+        # Every key of the frontier expires once no worker used it for the retention period.
+        pipe = self.client.pipeline()
+        pipe.hset(self._k(key, "workers"), self.worker, now)
+        for part in self.PARTS:
+            pipe.expire(self._k(key, part), self.retention)
+        pipe.execute()
+
+    def acquire_lock(self, name, owner, ttl):
+        return bool(self.client.set(f"{self.prefix}:lock:{name}", owner, nx=True, px=int(ttl * 1000)))
+
+    def refresh_lock(self, name, owner, ttl):
+        return bool(self.client.eval(_REFRESH_LUA, 1, f"{self.prefix}:lock:{name}", owner, int(ttl * 1000)))
+
+    def release_lock(self, name, owner):
+        self.client.eval(_RELEASE_LUA, 1, f"{self.prefix}:lock:{name}", owner)
+
+    def lock_owner(self, name):
+        value = self.client.get(f"{self.prefix}:lock:{name}")
+        return value.decode() if value else None
+
+    def close(self):
+        self.client.close()
+
+
+BACKENDS = {
+    "sqlite": SqliteFrontier,
+    "redis": RedisFrontier,
+}
+
+
+def open_frontier(settings):
+    """The ``FRONTIER_BACKEND`` frontier (a name from BACKENDS or a class path); SQLite by default."""
+    backend = settings.get("FRONTIER_BACKEND") or "sqlite"
+    cls = BACKENDS.get(backend) or load_object(backend)
+    return cls.from_settings(settings)
+
+
+class RunLock:
+    """
+    Lock held for a whole run so two runs never overlap, across every host
+    that shares the frontier backend.
+
+    The lock expires after ``ttl`` seconds unless refreshed; a background
+    thread refreshes it while the run is alive, so a crashed run frees it.
+    """
+
+    def __init__(self, settings, name, ttl):
+        self.settings = settings
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{worker_id()}:{uuid.uuid4().hex[:8]}"
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def acquire(self):
+        frontier = open_frontier(self.settings)
+        try:
+            if not frontier.acquire_lock(self.name, self.owner, self.ttl):
+                return False
+        finally:
+            frontier.close()
+        self.thread = threading.Thread(target=self._refresh, name=f"RunLock-{self.name}", daemon=True)
+        self.thread.start()
+        return True
+
+    def holder(self):
+        frontier = open_frontier(self.settings)
+        try:
+            return frontier.lock_owner(self.name)
+        finally:
+            frontier.close()
+
+    def _refresh(self):
+        # Own connection: SQLite connections cannot be shared between threads.
+        frontier = open_frontier(self.settings)
+        try:
+            while not self.stopped.wait(self.ttl / 3):
+                if not frontier.refresh_lock(self.name, self.owner, self.ttl):
+                    logger.error(f"Run lock {self.name!r} was lost")
+                    return
+        finally:
+            frontier.close()
+
+    def release(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        frontier = open_frontier(self.settings)
+        try:
+            frontier.release_lock(self.name, self.owner)
+        finally:
+            frontier.close()
+
+
+class FrontierDupeFilter(BaseDupeFilter):
+    """Request fingerprints shared by every worker of the same spider and run."""
+
+    def __init__(self, crawler, frontier, debug=False):
+        self.crawler = crawler
+        self.frontier = frontier
+        self.fingerprinter = crawler.request_fingerprinter
+        self.debug = debug
+        self.logdupes = True
+        self.key = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler, open_frontier(crawler.settings), debug=crawler.settings.getbool("DUPEFILTER_DEBUG"))
+
+    def open(self):
+        self.key = frontier_key(self.crawler.spider)
+        self.frontier.register(self.key)
+
+    def request_seen(self, request):
+        return self.frontier.add_fingerprint(self.key, self.fingerprinter.fingerprint(request))
+
+    def log(self, request, spider):
+        if self.debug:
+            logger.debug("Filtered duplicate request: %(request)s", {"request": request}, extra={"spider": spider})
+        elif self.logdupes:
+            logger.debug(
+                "Filtered duplicate request: %(request)s - no more duplicates will be shown"
+                " (see DUPEFILTER_DEBUG to show all duplicates)",
+                {"request": request},
+                extra={"spider": spider},
+            )
+            self.logdupes = False
+        self.crawler.stats.inc_value("dupefilter/filtered")
+
+    def close(self, reason):
+        self.frontier.close()
+
+
+class FrontierScheduler(BaseScheduler):
+    """
+    Scheduler whose queue is the shared frontier.
+
+    Requests are stored as ``Request.to_dict()`` pickles, so any worker can
+    rebuild them. Requests that cannot be serialized (a reused Playwright page
+    in meta, a callback that is not a spider method) stay in a local priority
+    queue and are always served first: they belong to this process.
+
+    A worker whose own work ran out stays open while another worker of the
+    same frontier pushed or popped in the last ``FRONTIER_IDLE_TIMEOUT``
+    seconds, since it may still push requests.
+    """
+
+    def __init__(self, crawler, frontier, dupefilter, idle_timeout=30):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.frontier = frontier
+        self.df = dupefilter
+        self.idle_timeout = idle_timeout
+        self.local = []
+        self.local_seq = count()
+        self.spider = None
+        self.key = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter = build_from_crawler(load_object(settings["DUPEFILTER_CLASS"]), crawler)
+        scheduler = cls(
+            crawler,
+            open_frontier(settings),
+            dupefilter,
+            idle_timeout=settings.getfloat("FRONTIER_IDLE_TIMEOUT", 30),
+        )
+        crawler.signals.connect(scheduler.spider_idle, signal=signals.spider_idle)
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        self.key = frontier_key(spider)
+        self.frontier.register(self.key)
+        logger.info(
+            f"Frontier {type(self.frontier).__name__} {self.key!r}: "
+            f"{self.frontier.pending(self.key)} requests pending",
+            extra={"spider": spider},
+        )
+        return self.df.open()
+
+    def close(self, reason):
+        self.frontier.close()
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        return bool(self.local) or self.frontier.has_pending(self.key)
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        try:
+            data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        except (ValueError, TypeError, AttributeError, pickle.PicklingError):
+            heappush(self.local, (-request.priority, next(self.local_seq), request))
+            self.stats.inc_value("scheduler/enqueued/local")
+        else:
+            self.frontier.push(self.key, data, request.priority)
+            self.stats.inc_value("scheduler/enqueued/frontier")
+        self.stats.inc_value("scheduler/enqueued")
+        return True
+
+    def next_request(self):
+        if self.local:
+            request = heappop(self.local)[2]
+            self.stats.inc_value("scheduler/dequeued/local")
+        else:
+            data = self.frontier.pop(self.key)
+            if data is None:
+                return None
+            request = request_from_dict(pickle.loads(data), spider=self.spider)
+            self.stats.inc_value("scheduler/dequeued/frontier")
+        self.stats.inc_value("scheduler/dequeued")
+        return request
+
+    def __len__(self):
+        return len(self.local) + self.frontier.pending(self.key)
+
+    def spider_idle(self, spider):
+        if time.time() - self.frontier.others_active_at(self.key) < self.idle_timeout:
+            raise DontCloseSpider
+
+
+class FrontierAddon:
+    """
+    Switches the scheduler and dupefilter to the shared frontier when
+    ``FRONTIER_BACKEND`` is set (in settings, the environment or ``-s``).
+    """
+
+    def update_settings(self, settings):
+        if not settings.get("FRONTIER_BACKEND"):
+            return
+        settings.set("SCHEDULER", "my_scraper.frontier.FrontierScheduler", priority="addon")
+        settings.set("DUPEFILTER_CLASS", "my_scraper.frontier.FrontierDupeFilter", priority="addon")
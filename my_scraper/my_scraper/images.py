@@ -0,0 +1,160 @@
+"""
+Helpers for ImageMetadataPipeline: Shopify sized URLs, image analysis and
+the content-addressed image cache.
+"""
+
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+from urllib.parse import urlsplit, urlunsplit
+
+
+def _pillow():
+    """``PIL.Image``, imported on first use (the image stage is off by default), or None."""
+    try:
+        from PIL import Image
+    except ImportError:  # pragma: no cover - optional
+        return None
+    return Image
+
+
+# products/foo.jpg, products/foo_1024x1024.jpg, products/foo_grande.png, ...
+SHOPIFY_IMAGE_NAME = re.compile(
+    r"^(?P<stem>.+?)"
+    r"(?:_(?:\d+x\d*|x\d+|pico|icon|thumb|small|compact|medium|large|grande|original|master))?"
+    r"(?P<ext>\.(?:jpe?g|png|gif|webp|avif))$",
+    re.IGNORECASE,
+)
+
+
+def is_shopify_cdn(url):
+    parts = urlsplit(url)
+    return parts.hostname == "cdn.shopify.com" or parts.path.startswith("/cdn/shop/")
+
+
+def shopify_sized_url(url, width):
+    """
+    Ask the Shopify CDN for a ``width`` px wide variant (``foo.jpg`` -> ``foo_800x.jpg``).
+
+    Non-Shopify URLs and unrecognised file names are returned unchanged.
+    """
+    if not url or not width or not is_shopify_cdn(url):
+        return url
+    parts = urlsplit(url)
+    head, _, name = parts.path.rpartition("/")
+    match = SHOPIFY_IMAGE_NAME.match(name)
+    if match is None:
+        return url
+    sized = f"{match['stem']}_{width}x{match['ext']}"
+    return urlunsplit(parts._replace(path=f"{head}/{sized}"))
+
+
+def dhash(image, size=8):
+    """64-bit difference hash (hex) of a PIL image: near-identical images share most bits."""
+    gray = image.convert("L").resize((size + 1, size), _pillow().LANCZOS)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:0{size * size // 4}x}"
+
+
+def analyze(body, thumb_size):
+    """
+    Content hash plus, when Pillow is installed, dimensions, dHash and a JPEG thumbnail.
+
+    Returns ``(metadata, thumbnail_bytes_or_None)``. Runs off the reactor thread.
+    """
+    meta = {"sha256": hashlib.sha256(body).hexdigest(), "bytes": len(body)}
+    Image = _pillow()
+    if Image is None:
+        return meta, None
+    try:
+        with Image.open(io.BytesIO(body)) as image:
+            image.load()
+            meta["width"], meta["height"] = image.size
+            meta["dhash"] = dhash(image)
+            thumb = image.convert("RGB")
+            thumb.thumbnail((thumb_size, thumb_size))
+            out = io.BytesIO()
+            thumb.save(out, "JPEG", quality=80, optimize=True)
+    except Exception:  # not an image Pillow can read
+        return meta, None
+    return meta, out.getvalue()
+
+
+class ImageCache:
+    """
+    Content-addressed image store under ``root``::
+
+        index.sqlite                 url -> sha256
+        objects/ab/abcd....json      metadata per content hash
+        objects/ab/abcd....img       the fetched (sized) image, optional
+        thumbs/ab/abcd....jpg        thumbnail (needs Pillow)
+
+    Shopify image URLs carry a ``?v=`` version that changes whenever the
+    image does, so a URL already in the index is never fetched again, and
+    identical images reached through different URLs are stored once.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, "index.sqlite"))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT NOT NULL)")
+        self.conn.commit()
+
+    def path(self, kind, digest, ext):
+        return os.path.join(self.root, kind, digest[:2], f"{digest}.{ext}")
+
+    def relpath(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def lookup(self, url):
+        """Cached metadata for ``url``, or None when it has to be fetched."""
+        row = self.conn.execute("SELECT sha256 FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return self.load(row[0])
+
+    def load(self, digest):
+        try:
+            with open(self.path("objects", digest, "json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def store(self, body, meta, thumbnail, keep_image):
+        """Write the objects for one image (writer thread); returns the final metadata."""
+        digest = meta["sha256"]
+        existing = self.load(digest)
+        if existing is not None:
+            return existing
+        if thumbnail is not None:
+            meta["thumbnail"] = self.relpath(self._write(self.path("thumbs", digest, "jpg"), thumbnail))
+        if keep_image:
+            meta["file"] = self.relpath(self._write(self.path("objects", digest, "img"), body))
+        self._write(self.path("objects", digest, "json"), json.dumps(meta).encode("utf-8"))
+        return meta
+
+    def remember(self, url, digest):
+        self.conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, digest))
+        self.conn.commit()
+
+    @staticmethod
+    def _write(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+    def close(self):
+        self.conn.close()
@@ -3,10 +3,215 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
-import scrapy
+import logging
+from collections.abc import KeysView
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
 
+from itemadapter import ItemAdapter
+from itemadapter.adapter import AdapterInterface
 
-class MyScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class RunInfo:
+    """Metadata of one scrape run, shared by every item of the run."""
+
+    scraped_at: datetime
+    scrape_run_id: str
+    scrape_time: str = field(default="", compare=False)
+    scrape_date: str = field(default="", compare=False)
+
+    def __post_init__(self):
+        # Keep the caller's ISO string so feeds show exactly what run_all_spiders passed in.
+        if not self.scrape_time:
+            object.__setattr__(self, "scrape_time", self.scraped_at.isoformat())
+        if not self.scrape_date:
+            object.__setattr__(self, "scrape_date", self.scraped_at.strftime("%Y-%m-%d"))
+
+    @classmethod
+    def from_args(cls, scrape_time=None, scrape_run_id=None):
+        """
+        Build from the ``-a scrape_time=... -a scrape_run_id=...`` spider
+        arguments. A ``scrape_time`` that is not an ISO timestamp is replaced
+        by the current time, with a warning.
+        """
+        now = datetime.now()
+        scraped_at = now
+        if scrape_time:
+            try:
+                scraped_at = datetime.fromisoformat(scrape_time)
+            except ValueError:
+                logger.warning(f"Ignoring malformed scrape_time {scrape_time!r}; using the current time")
+                scrape_time = None
+        return cls(
+            scraped_at=scraped_at,
+            scrape_run_id=scrape_run_id or now.strftime("%Y%m%d_%H%M%S"),
+            scrape_time=scrape_time or scraped_at.isoformat(),
+            scrape_date=now.strftime("%Y-%m-%d"),
+        )
+
+
+def _check_url(name, value, required=False):
+    if value is None:
+        if required:
+            raise ValueError(f"{name} is required")
+        return
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be a string, got {type(value).__name__}")
+    # Cheaper than urlsplit on every item: "http(s)://" followed by a host.
+    scheme, sep, rest = value.partition("://")
+    if not sep or scheme not in ("http", "https") or not rest or rest[0] in "/?#":
+        raise ValueError(f"{name} must be an absolute http(s) URL, got {value!r}")
+
+
+def _check_price(name, value):
+    if value is None:
+        return
+    try:
+        Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"{name} must be a decimal string, got {value!r}") from None
+
+
+@dataclass(slots=True)
+class ProductVariant:
+    """One Shopify variant of a product (size/colour/...), written to "ProductVariant"."""
+
+    shopify_id: int
+    title: str | None = None
+    sku: str | None = None
+    price: str | None = None
+    compare_at_price: str | None = None
+    available: bool | None = None
+    options: list[str] = field(default_factory=list)
+    position: int | None = None
+
+    def __post_init__(self):
+        if not isinstance(self.shopify_id, int):
+            raise ValueError(f"variant shopify_id must be an int, got {self.shopify_id!r}")
+        _check_price("variant price", self.price)
+        _check_price("variant compare_at_price", self.compare_at_price)
+
+
+@dataclass(slots=True)
+class ProductItem:
+    """
+    A scraped product.
+
+    Validated on creation (``ValueError`` for a missing/relative URL,
+    malformed prices or wrongly typed fields). Run metadata lives in the shared :class:`RunInfo`;
+    :class:`ProductItemAdapter` exposes it as the flat ``scraped_at`` /
+    ``scrape_date`` / ``scrape_run_id`` fields the feeds have always had.
+    """
+
+    url: str
+    name: str | None
+    image: str | None
+    category: str | None
+    run: RunInfo
+    brand: str | None = None
+
+    # Shopify products.json data (None for rendered HTML products).
+    shopify_id: int | None = None
+    vendor: str | None = None
+    product_type: str | None = None
+    tags: list[str] | None = None
+    price_min: str | None = None
+    price_max: str | None = None
+    available: bool | None = None
+    shopify_updated_at: str | None = None
+    variants: list[ProductVariant] | None = None
+
+    # Filled in by ImageMetadataPipeline.
+    image_sized: str | None = None
+    image_hash: str | None = None
+    image_width: int | None = None
+    image_height: int | None = None
+    image_dhash: str | None = None
+    image_thumbnail: str | None = None
+
+    def __post_init__(self):
+        _check_url("url", self.url, required=True)
+        _check_url("image", self.image)
+        if self.name is not None:
+            if not isinstance(self.name, str):
+                raise ValueError(f"name must be a string, got {type(self.name).__name__}")
+            self.name = self.name.strip() or None
+        if self.category is not None and not isinstance(self.category, str):
+            raise ValueError(f"category must be a string, got {type(self.category).__name__}")
+        if not isinstance(self.run, RunInfo):
+            raise ValueError("run must be a RunInfo")
+        _check_price("price_min", self.price_min)
+        _check_price("price_max", self.price_max)
+        if self.tags is not None and not all(isinstance(tag, str) for tag in self.tags):
+            raise ValueError("tags must be a list of strings")
+        if self.variants is not None and not all(isinstance(v, ProductVariant) for v in self.variants):
+            raise ValueError("variants must be ProductVariant instances")
+
+    @property
+    def scraped_at(self):
+        return self.run.scraped_at
+
+
+# Fields that always appear in feeds, in feed order.
+PRODUCT_FIELDS = ("name", "image", "url", "category", "brand")
+RUN_FIELDS = {"scraped_at": "scrape_time", "scrape_date": "scrape_date", "scrape_run_id": "scrape_run_id"}
+# Only exported once something has set them.
+OPTIONAL_FIELDS = tuple(
+    f.name for f in fields(ProductItem) if f.name not in PRODUCT_FIELDS and f.name != "run"
+)
+ALL_FIELDS = PRODUCT_FIELDS + tuple(RUN_FIELDS) + OPTIONAL_FIELDS
+
+
+class ProductItemAdapter(AdapterInterface):
+    """itemadapter view of :class:`ProductItem` as a flat mapping (run fields are read-only)."""
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return issubclass(item_class, ProductItem)
+
+    @classmethod
+    def get_field_names_from_class(cls, item_class):
+        return list(ALL_FIELDS)
+
+    def field_names(self):
+        return KeysView(dict.fromkeys(ALL_FIELDS))
+
+    def __getitem__(self, field_name):
+        if field_name in RUN_FIELDS:
+            return getattr(self.item.run, RUN_FIELDS[field_name])
+        if field_name in PRODUCT_FIELDS or field_name in OPTIONAL_FIELDS:
+            return getattr(self.item, field_name)
+        raise KeyError(field_name)
+
+    def __setitem__(self, field_name, value):
+        if field_name in PRODUCT_FIELDS or field_name in OPTIONAL_FIELDS:
+            setattr(self.item, field_name, value)
+        else:
+            raise KeyError(f"ProductItem does not support setting field: {field_name}")
+
+    def __delitem__(self, field_name):
+        if field_name in OPTIONAL_FIELDS or field_name == "brand":
+            setattr(self.item, field_name, None)
+        else:
+            raise KeyError(f"ProductItem does not support deleting field: {field_name}")
+
+    def __iter__(self):
+        item = self.item
+        yield from ("name", "image", "url", "category")
+        if item.brand is not None:
+            yield "brand"
+        yield from RUN_FIELDS
+        for name in OPTIONAL_FIELDS:
+            if getattr(item, name) is not None:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+# Ahead of the built-in dataclass adapter, which would nest ``run`` in the feeds.
+ItemAdapter.ADAPTER_CLASSES.appendleft(ProductItemAdapter)
@@ -3,98 +3,375 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from scrapy.utils.project import data_path
+from scrapy.utils.request import request_from_dict
 
 # useful for handling different item types with a single interface
-from itemadapter import ItemAdapter
+from itemadapter import ItemAdapter, is_item
+
+from my_scraper.dedup import canonical_product_url
+from my_scraper.profiling import StageProfiler
+from my_scraper.signals import products_seen
 
 
 class MyScraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """
+    Times spider callbacks for the stage profiler (``PROFILE_ENABLED``).
+
+    Sits next to the spider (order 990), so only the callback itself is timed,
+    as stage ``parse;<callback>``: each step of the callback's generator up to
+    the next item or request, not the pipelines or middlewares handling what
+    it yields. ``stage()`` blocks inside the callback (JSON decoding,
+    selectors) nest under it.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
-        return s
+        if not crawler.settings.getbool("PROFILE_ENABLED"):
+            raise NotConfigured
+        return cls(StageProfiler.for_crawler(crawler))
+
+    def process_spider_output(self, response, result, spider):
+        name = _callback_name(response, spider)
+        iterator = iter(result)
+        while True:
+            frame = self.profiler.push(f"parse;{name}")
+            try:
+                i = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.profiler.pop(frame)
+            yield i
+
+    async def process_spider_output_async(self, response, result, spider):
+        # Wall time: includes whatever the callback awaits (e.g. closing a page).
+        name = _callback_name(response, spider)
+        iterator = result.__aiter__()
+        while True:
+            frame = self.profiler.push(f"parse;{name}")
+            try:
+                i = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                self.profiler.pop(frame)
+            yield i
+
+
+def _callback_name(response, spider):
+    request = response.request
+    callback = request.callback if request is not None else None
+    return getattr(callback, "__name__", None) or "parse"
+
+
+class MyScraperDownloaderMiddleware:
+    """
+    Times downloads for the stage profiler (``PROFILE_ENABLED``).
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
+    Sits next to the download handler (order 990). Each response records its
+    ``download_latency`` as ``download;http`` or ``download;playwright``
+    (rendering included), and the rest of the time since this middleware saw
+    the request as ``download;queue`` (waiting for a downloader slot).
+    """
 
-        # Should return None or raise an exception.
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("PROFILE_ENABLED"):
+            raise NotConfigured
+        return cls(StageProfiler.for_crawler(crawler))
+
+    def process_request(self, request, spider):
+        request.meta["profile_started"] = time.perf_counter()
         return None
 
-    def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
+    def process_response(self, request, response, spider):
+        self._record(request)
+        return response
 
-        # Must return an iterable of Request, or item objects.
-        for i in result:
-            yield i
+    def process_exception(self, request, exception, spider):
+        self._record(request, failed=True)
+        return None
 
-    def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
+    def _record(self, request, failed=False):
+        started = request.meta.pop("profile_started", None)
+        if started is None:
+            return
+        total = time.perf_counter() - started
+        latency = request.meta.get("download_latency")
+        kind = "playwright" if request.meta.get("playwright") else "http"
+        if failed or latency is None:
+            self.profiler.record(f"download;{kind}{';failed' if failed else ''}", total)
+            return
+        self.profiler.record(f"download;{kind}", latency)
+        self.profiler.record("download;queue", max(0.0, total - latency))
 
-        # Should return either None or an iterable of Request or item objects.
-        pass
 
-    async def process_start(self, start):
-        # Called with an async iterator over the spider start() method or the
-        # maching method of an earlier spider middleware.
-        async for item_or_request in start:
-            yield item_or_request
+class ResponseFingerprintStore:
+    """
+    On-disk record of what each URL looked like on the previous run.
 
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+    Keeps the HTTP validators (ETag / Last-Modified), a hash of the body, the
+    product URLs the page yielded, the follow-up requests it produced and the
+    spider's own summary of the page (``response.meta["incremental_page"]``),
+    so an unchanged page can be replayed without being parsed again.
+    """
 
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body_hash TEXT,
+                item_urls BLOB,
+                followups BLOB,
+                page BLOB
+            )
+            """
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(pages)")}
+        if "page" not in columns:  # stores written before page summaries
+            self.conn.execute("ALTER TABLE pages ADD COLUMN page BLOB")
+        self.conn.commit()
 
-class MyScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    @classmethod
+    def from_settings(cls, settings):
+        path = data_path(settings.get("INCREMENTAL_STORE_PATH"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return cls(path)
+
+    def get(self, url):
+        row = self.conn.execute(
+            "SELECT etag, last_modified, body_hash, item_urls, followups, page FROM pages WHERE url = ?",
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "body_hash": row[2],
+            "item_urls": pickle.loads(row[3]),
+            "followups": pickle.loads(row[4]),
+            "page": pickle.loads(row[5]) if row[5] is not None else None,
+        }
+
+    def put(self, url, etag, last_modified, body_hash, item_urls, followups, page=None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                url, etag, last_modified, body_hash, pickle.dumps(item_urls), pickle.dumps(followups),
+                pickle.dumps(page) if page is not None else None,
+            ),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _incremental_skip(request):
+    # Requests that hold a Playwright page (BrowserGovernor) must reach their
+    # callback so the page gets closed, and the page cannot be stored.
+    return (
+        request.method != "GET"
+        or request.meta.get("dont_incremental", False)
+        or request.meta.get("playwright_include_page", False)
+    )
+
+
+def _replayable(record, spider):
+    # A spider with its own replay_page() hook can only replay pages it
+    # summarised when they were last parsed.
+    return record is not None and (
+        getattr(spider, "replay_page", None) is None or record["page"] is not None
+    )
+
+
+class IncrementalDownloaderMiddleware:
+    """
+    Sends conditional requests for pages fetched on a previous run and flags
+    responses whose content did not change.
+
+    A ``304 Not Modified`` (or a 200 whose body hashes to the stored value) is
+    marked with ``response.meta["incremental"]`` so that
+    :class:`IncrementalSpiderMiddleware` can skip the callback. Playwright
+    requests only get the body hash check, not the conditional headers.
+    Spiders that define ``replay_page()`` only get conditional requests for
+    pages they left a summary for.
+    """
+
+    def __init__(self, store, stats):
+        self.store = store
+        self.stats = stats
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        if not crawler.settings.getbool("INCREMENTAL_ENABLED"):
+            raise NotConfigured
+        s = cls(ResponseFingerprintStore.from_settings(crawler.settings), crawler.stats)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        if _incremental_skip(request) or request.meta.get("playwright"):
+            return None
+        record = self.store.get(request.url)
+        if not _replayable(record, spider):
+            return None
+        if record["etag"]:
+            request.headers.setdefault("If-None-Match", record["etag"])
+        if record["last_modified"]:
+            request.headers.setdefault("If-Modified-Since", record["last_modified"])
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
+        if _incremental_skip(request):
+            return response
+        record = self.store.get(request.url)
+        if not _replayable(record, spider):
+            record = None
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        if response.status == 304 and record is not None:
+            self.stats.inc_value("incremental/not_modified")
+            request.meta["incremental"] = "not_modified"
+            return response.replace(status=200, body=b"")
+        if response.status != 200:
+            return response
+
+        body_hash = hashlib.sha1(response.body).hexdigest()
+        request.meta["incremental_validators"] = {
+            "etag": response.headers.get("ETag", b"").decode("latin-1") or None,
+            "last_modified": response.headers.get("Last-Modified", b"").decode("latin-1") or None,
+            "body_hash": body_hash,
+        }
+        if record is not None and record["body_hash"] == body_hash:
+            self.stats.inc_value("incremental/unchanged")
+            request.meta["incremental"] = "unchanged"
         return response
 
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+    def spider_closed(self, spider):
+        self.store.close()
+
+
+class IncrementalSpiderMiddleware:
+    """
+    Replays unchanged pages from the fingerprint store instead of parsing them.
+
+    For a page flagged by :class:`IncrementalDownloaderMiddleware` the callback
+    is never iterated: the stored follow-up requests are re-issued and the
+    stored product URLs are announced through the ``products_seen`` signal so
+    pipelines can refresh them. A spider that keeps per-page state (such as
+    pagination and completeness tracking) defines
+    ``replay_page(response, summary)`` instead: it gets back the summary it
+    stored in ``response.meta["incremental_page"]`` when the page was parsed,
+    and its output replaces the stored follow-ups. For changed pages the
+    callback output is recorded once it has been fully consumed, so a callback
+    that fails halfway is simply parsed again on the next run.
+    """
+
+    def __init__(self, crawler, store):
+        self.crawler = crawler
+        self.store = store
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("INCREMENTAL_ENABLED"):
+            raise NotConfigured
+        s = cls(crawler, ResponseFingerprintStore.from_settings(crawler.settings))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_output(self, response, result, spider):
+        replay = self._replay(response, spider)
+        if replay is not None:
+            yield from replay
+            return
+        recorder = _OutputRecorder(response, spider)
+        for i in result:
+            recorder.add(i)
+            yield i
+        recorder.save(self.store)
+
+    async def process_spider_output_async(self, response, result, spider):
+        replay = self._replay(response, spider)
+        if replay is not None:
+            for i in replay:
+                yield i
+            return
+        recorder = _OutputRecorder(response, spider)
+        async for i in result:
+            recorder.add(i)
+            yield i
+        recorder.save(self.store)
+
+    def _replay(self, response, spider):
+        if response.meta.get("incremental") is None:
+            return None
+        record = self.store.get(response.request.url)
+        if not _replayable(record, spider):
+            return None
+        replay_page = getattr(spider, "replay_page", None)
+        if replay_page is not None:
+            self.crawler.stats.inc_value("incremental/replayed_pages")
+            return list(replay_page(response, record["page"]))
+        urls = [url for url in record["item_urls"] if url]
+        self.crawler.stats.inc_value("incremental/replayed_pages")
+        self.crawler.stats.inc_value("incremental/seen_items", len(urls))
+        self.crawler.signals.send_catch_log(signal=products_seen, urls=urls, spider=spider)
+        return [request_from_dict(d, spider=spider) for d in record["followups"]]
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+
+class _OutputRecorder:
+    def __init__(self, response, spider):
+        self.url = response.request.url if response.request else response.url
+        self.meta = response.meta
+        self.validators = response.meta.get("incremental_validators")
+        self.spider = spider
+        self.item_urls = []
+        self.followups = []
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+    def add(self, obj):
+        if self.validators is None:
+            return
+        if isinstance(obj, Request):
+            try:
+                self.followups.append(obj.to_dict(spider=self.spider))
+            except ValueError:
+                # Callbacks that are not spider methods cannot be replayed.
+                self.validators = None
+        elif is_item(obj):
+            self.item_urls.append(canonical_product_url(ItemAdapter(obj).get("url")))
 
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+    def save(self, store):
+        if self.validators is None:
+            return
+        store.put(
+            self.url,
+            item_urls=self.item_urls,
+            followups=self.followups,
+            # Set by the callback, so only read once its output was consumed.
+            page=self.meta.get("incremental_page"),
+            **self.validators,
+        )
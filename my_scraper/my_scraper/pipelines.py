@@ -1,9 +1,40 @@
+import asyncio
+import hashlib
+import io
+import logging
 import os
+import time
 import uuid
 from datetime import datetime
+from typing import NamedTuple
 from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
-import psycopg2
-from psycopg2.extras import execute_values
+from itemadapter import ItemAdapter
+from scrapy import Request
+from scrapy.exceptions import DropItem, NotConfigured
+from scrapy.utils.defer import deferred_from_coro, maybe_deferred_to_future
+from scrapy.utils.project import data_path
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
+from my_scraper.dedup import BloomFilter, FingerprintSet, canonical_product_url
+from my_scraper.images import ImageCache, analyze, shopify_sized_url
+from my_scraper.items import ProductItem
+from my_scraper.profiling import StageProfiler
+from my_scraper.signals import db_committed, products_seen
+
+logger = logging.getLogger(__name__)
+
+# psycopg2 (and my_scraper.db) are only imported once DbStorePipeline has a
+# DATABASE_URL to write to; see _import_psycopg2.
+sql = execute_values = CONNECTION_ERRORS = ConnectionManager = PoolExhausted = None
+
+
+def _import_psycopg2():
+    global sql, execute_values, CONNECTION_ERRORS, ConnectionManager, PoolExhausted
+    from psycopg2 import sql
+    from psycopg2.extras import execute_values
+
+    from my_scraper.db import CONNECTION_ERRORS, ConnectionManager, PoolExhausted
 
 
 def _normalize_db_url(db_url: str) -> str:
@@ -23,72 +54,794 @@ def _normalize_db_url(db_url: str) -> str:
     return urlunsplit(parts._replace(query=new_query))
 
 
+def _parse_scraped_at(raw_scraped_at):
+    try:
+        return (
+            raw_scraped_at
+            if isinstance(raw_scraped_at, datetime)
+            else datetime.fromisoformat(raw_scraped_at)  # may be a string
+        )
+    except Exception:
+        return datetime.utcnow()
+
+
+PRODUCT_COLUMNS = (
+    "id", "name", "image", "url", "brand", "scrapedAt",
+    "shopifyId", "vendor", "productType", "tags", "priceMin", "priceMax", "available", "shopifyUpdatedAt",
+)
+
+_PRODUCT_SET = """
+  SET name = EXCLUDED.name,
+      image = EXCLUDED.image,
+      brand = EXCLUDED.brand,
+      "scrapedAt" = EXCLUDED."scrapedAt",
+      "shopifyId" = EXCLUDED."shopifyId",
+      vendor = EXCLUDED.vendor,
+      "productType" = EXCLUDED."productType",
+      tags = EXCLUDED.tags,
+      "priceMin" = EXCLUDED."priceMin",
+      "priceMax" = EXCLUDED."priceMax",
+      available = EXCLUDED.available,
+      "shopifyUpdatedAt" = EXCLUDED."shopifyUpdatedAt",
+      "removedAt" = NULL
+  WHERE (p.name, p.image, p.brand, p."shopifyId", p.vendor, p."productType", p.tags,
+         p."priceMin", p."priceMax", p.available, p."shopifyUpdatedAt")
+        IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.image, EXCLUDED.brand, EXCLUDED."shopifyId",
+                          EXCLUDED.vendor, EXCLUDED."productType", EXCLUDED.tags, EXCLUDED."priceMin",
+                          EXCLUDED."priceMax", EXCLUDED.available, EXCLUDED."shopifyUpdatedAt")
+     OR p."removedAt" IS NOT NULL"""
+
+# Shopify timestamps carry an offset; "Product" stores UTC like Prisma does.
+PRODUCT_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::timestamptz AT TIME ZONE 'UTC')"
+
+UPSERT_SQL = f"""
+INSERT INTO "Product" AS p ({", ".join(f'"{c}"' for c in PRODUCT_COLUMNS)})
+VALUES %s
+ON CONFLICT (url) DO UPDATE{_PRODUCT_SET}
+RETURNING url;
+"""
+
+# Staging rows are merged newest-first per URL, so a product listed twice in
+# one run ends up with its last scraped values. Rows without a URL never
+# conflict, so each one is inserted, as the upsert does.
+MERGE_SQL = f"""
+INSERT INTO "Product" AS p ({", ".join(f'"{c}"' for c in PRODUCT_COLUMNS)})
+SELECT DISTINCT ON (url, CASE WHEN url IS NULL THEN seq END)
+       id, name, image, url, brand, "scrapedAt",
+       "shopifyId", vendor, "productType", tags, "priceMin", "priceMax", available,
+       "shopifyUpdatedAt"::timestamptz AT TIME ZONE 'UTC'
+FROM {{staging}}
+ORDER BY url, CASE WHEN url IS NULL THEN seq END, seq DESC
+ON CONFLICT (url) DO UPDATE{_PRODUCT_SET};
+"""
+
+STAGED_COUNT_SQL = """
+SELECT count(DISTINCT url) + count(*) FILTER (WHERE url IS NULL) FROM {staging};
+"""
+
+TOUCH_STAGED_SQL = """
+UPDATE "Product" AS p
+SET "scrapedAt" = s."scrapedAt", "removedAt" = NULL
+FROM (SELECT url, max("scrapedAt") AS "scrapedAt" FROM {staging} GROUP BY url) AS s
+WHERE p.url = s.url AND (p."scrapedAt" < s."scrapedAt" OR p."removedAt" IS NOT NULL);
+"""
+
+# Products seen unchanged (or skipped as unchanged) are live again if they
+# had been marked removed.
+TOUCH_SEEN_SQL = """
+UPDATE "Product" SET "scrapedAt" = %s, "removedAt" = NULL
+WHERE url = ANY(%s) AND ("scrapedAt" < %s OR "removedAt" IS NOT NULL);
+"""
+
+# Variant rows reference their product by URL; the product id is looked up
+# in the same statement, after the product rows have been written.
+VARIANT_COLUMNS = (
+    "id", "url", "shopifyId", "title", "sku", "price", "compareAtPrice", "available", "options", "position",
+)
+
+_VARIANT_SET = """
+  SET "productId" = EXCLUDED."productId",
+      title = EXCLUDED.title,
+      sku = EXCLUDED.sku,
+      price = EXCLUDED.price,
+      "compareAtPrice" = EXCLUDED."compareAtPrice",
+      available = EXCLUDED.available,
+      options = EXCLUDED.options,
+      position = EXCLUDED.position
+  WHERE (v."productId", v.title, v.sku, v.price, v."compareAtPrice", v.available, v.options, v.position)
+        IS DISTINCT FROM (EXCLUDED."productId", EXCLUDED.title, EXCLUDED.sku, EXCLUDED.price,
+                          EXCLUDED."compareAtPrice", EXCLUDED.available, EXCLUDED.options, EXCLUDED.position)"""
+
+VARIANT_TEMPLATE = "(%s, %s, %s::bigint, %s, %s, %s::numeric, %s::numeric, %s::boolean, %s::text[], %s::integer)"
+
+VARIANT_UPSERT_SQL = f"""
+INSERT INTO "ProductVariant" AS v
+  (id, "productId", "shopifyId", title, sku, price, "compareAtPrice", available, options, position)
+SELECT s.id, p.id, s.shopify_id, s.title, s.sku, s.price, s.compare_at_price, s.available, s.options, s.position
+FROM (VALUES %s) AS s (id, url, shopify_id, title, sku, price, compare_at_price, available, options, position)
+JOIN "Product" p ON p.url = s.url
+ON CONFLICT ("shopifyId") DO UPDATE{_VARIANT_SET};
+"""
+
+# Variants that disappeared from a product that was just written.
+VARIANT_PRUNE_SQL = """
+DELETE FROM "ProductVariant" AS v
+USING "Product" p, (VALUES %s) AS s (url, ids)
+WHERE p.url = s.url AND v."productId" = p.id AND v."shopifyId" <> ALL(s.ids);
+"""
+
+VARIANT_MERGE_SQL = f"""
+INSERT INTO "ProductVariant" AS v
+  (id, "productId", "shopifyId", title, sku, price, "compareAtPrice", available, options, position)
+SELECT DISTINCT ON (s."shopifyId")
+       s.id, p.id, s."shopifyId", s.title, s.sku, s.price, s."compareAtPrice", s.available, s.options, s.position
+FROM {{staging}} s
+JOIN "Product" p ON p.url = s.url
+ORDER BY s."shopifyId", s.seq DESC
+ON CONFLICT ("shopifyId") DO UPDATE{_VARIANT_SET};
+"""
+
+VARIANT_PRUNE_STAGED_SQL = """
+DELETE FROM "ProductVariant" AS v
+USING "Product" p
+WHERE v."productId" = p.id
+  AND p.url IN (SELECT url FROM {staging})
+  AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE s."shopifyId" = v."shopifyId");
+"""
+
+
+def staging_tables(spider_name, suffix=""):
+    """
+    Names of the COPY staging tables of one spider. A ``DB_STAGING_SUFFIX``
+    (every ``--worker`` process sets its own) gives the process tables of its
+    own, so it never drops rows another process staged but has not merged.
+    The suffix is hashed to keep names within PostgreSQL's 63 characters.
+    """
+    if suffix:
+        spider_name = f"{spider_name}_{hashlib.sha1(suffix.encode()).hexdigest()[:8]}"
+    return f"product_staging_{spider_name}", f"product_variant_staging_{spider_name}"
+
+
+class Batch(NamedTuple):
+    """Rows flushed to the writer together: products and their variants."""
+
+    products: list
+    variants: list
+
+
+def _copy_value(value):
+    """Python value -> COPY field text (None for NULL)."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in value)
+        return "{" + ",".join(f'"{v}"' for v in escaped) + "}"
+    return value
+
+
+def _copy_row(row):
+    """
+    One ``COPY ... (FORMAT csv)`` line. Every value is quoted, so only None
+    (an unquoted empty field) loads as NULL and ``""`` stays an empty
+    string, as it does with the upsert.
+    """
+    fields = []
+    for value in map(_copy_value, row):
+        fields.append("" if value is None else '"' + str(value).replace('"', '""') + '"')
+    return ",".join(fields) + "\n"
+
+
+class DedupPipeline:
+    """
+    Drops products already scraped in this run.
+
+    The item URL is rewritten to its canonical form
+    (:func:`~my_scraper.dedup.canonical_product_url`) and repeats are dropped
+    before they reach the feed or DbStorePipeline. Seen URLs are kept as
+    8-byte hashes, or in a fixed-size Bloom filter when ``DEDUP_BACKEND`` is
+    ``"bloom"`` (``DEDUP_BLOOM_CAPACITY`` / ``DEDUP_BLOOM_ERROR_RATE``).
+    """
+
+    def __init__(self, stats, backend="set", bloom_capacity=1_000_000, bloom_error_rate=0.001):
+        if backend not in ("set", "bloom"):
+            raise ValueError(f"Unknown DEDUP_BACKEND: {backend!r}")
+        self.stats = stats
+        self.backend = backend
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("DEDUP_ENABLED", True):
+            raise NotConfigured
+        return cls(
+            stats=crawler.stats,
+            backend=settings.get("DEDUP_BACKEND", "set"),
+            bloom_capacity=settings.getint("DEDUP_BLOOM_CAPACITY", 1_000_000),
+            bloom_error_rate=settings.getfloat("DEDUP_BLOOM_ERROR_RATE", 0.001),
+        )
+
+    def open_spider(self):
+        if self.backend == "bloom":
+            self.seen = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        else:
+            self.seen = FingerprintSet()
+
+    def close_spider(self):
+        self.stats.set_value("dedup/unique", len(self.seen))
+        self.seen = None
+
+    def process_item(self, item):
+        adapter = ItemAdapter(item)
+        url = canonical_product_url(adapter.get("url"))
+        if not url:
+            return item
+        adapter["url"] = url
+        if self.seen.add(url):
+            self.stats.inc_value("dedup/dropped")
+            raise DropItem(f"Duplicate product {url}", log_level="DEBUG")
+        return item
+
+
+class ImageMetadataPipeline:
+    """
+    Adds image metadata to items from a local content-addressed cache.
+
+    For each item's ``image`` the Shopify CDN is asked for a
+    ``IMAGE_METADATA_WIDTH`` px variant (``image_sized``). Images not in the
+    cache (:class:`~my_scraper.images.ImageCache`) are fetched through the
+    crawler's downloader, at most ``IMAGE_METADATA_CONCURRENCY`` at a time and
+    in their own ``images/<host>`` download slots (throttle profile
+    ``"images"``). Items get ``image_hash`` (sha256 of the content) and, with
+    Pillow installed, ``image_width``/``image_height``, ``image_dhash`` and
+    ``image_thumbnail`` (path inside the cache).
+
+    A failed fetch only leaves the metadata out; the item is never dropped.
+    """
+
+    def __init__(self, crawler, cache_dir, width=800, thumb_size=256, concurrency=8,
+                 keep_images=True, max_bytes=10 * 1024 * 1024):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.cache_dir = cache_dir
+        self.width = width
+        self.thumb_size = thumb_size
+        self.concurrency = concurrency
+        self.keep_images = keep_images
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("IMAGE_METADATA_ENABLED"):
+            raise NotConfigured
+        return cls(
+            crawler,
+            cache_dir=settings.get("IMAGE_METADATA_DIR", "images"),
+            width=settings.getint("IMAGE_METADATA_WIDTH", 800),
+            thumb_size=settings.getint("IMAGE_METADATA_THUMB_SIZE", 256),
+            concurrency=settings.getint("IMAGE_METADATA_CONCURRENCY", 8),
+            keep_images=settings.getbool("IMAGE_METADATA_KEEP_IMAGES", True),
+            max_bytes=settings.getint("IMAGE_METADATA_MAX_BYTES", 10 * 1024 * 1024),
+        )
+
+    def open_spider(self):
+        self.cache = ImageCache(data_path(self.cache_dir))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    def close_spider(self):
+        self.cache.close()
+
+    async def process_item(self, item):
+        adapter = ItemAdapter(item)
+        url = adapter.get("image")
+        if not url:
+            return item
+        sized = shopify_sized_url(url, self.width)
+        adapter["image_sized"] = sized
+
+        meta = self.cache.lookup(sized)
+        if meta is not None:
+            self.stats.inc_value("images/cache_hits")
+        else:
+            meta = await self._fetch(sized)
+        if meta is not None:
+            adapter["image_hash"] = meta["sha256"]
+            adapter["image_width"] = meta.get("width")
+            adapter["image_height"] = meta.get("height")
+            adapter["image_dhash"] = meta.get("dhash")
+            adapter["image_thumbnail"] = meta.get("thumbnail")
+        return item
+
+    async def _fetch(self, url):
+        async with self.semaphore:
+            request = Request(
+                url,
+                dont_filter=True,
+                meta={
+                    "download_slot": f"images/{urlsplit(url).hostname}",
+                    "throttle_profile": "images",
+                    "download_maxsize": self.max_bytes,
+                    "dont_incremental": True,
+                },
+            )
+            try:
+                response = await self._download(request)
+            except Exception as exc:
+                self.stats.inc_value("images/failed")
+                logger.debug(f"Image fetch failed for {url}: {exc}")
+                return None
+            if response.status != 200:
+                self.stats.inc_value("images/failed")
+                logger.debug(f"Image fetch for {url} returned HTTP {response.status}")
+                return None
+
+        body = response.body
+        meta, thumbnail = await maybe_deferred_to_future(
+            threads.deferToThread(analyze, body, self.thumb_size)
+        )
+        meta = await maybe_deferred_to_future(
+            threads.deferToThread(self.cache.store, body, meta, thumbnail, self.keep_images)
+        )
+        self.cache.remember(url, meta["sha256"])
+        self.stats.inc_value("images/fetched")
+        self.stats.inc_value("images/bytes", len(body))
+        return meta
+
+    async def _download(self, request):
+        engine = self.crawler.engine
+        if hasattr(engine, "download_async"):  # Scrapy >= 2.14
+            return await engine.download_async(request)
+        return await maybe_deferred_to_future(engine.download(request))
+
+
 class DbStorePipeline:
-    def open_spider(self, spider):
+    """
+    Writes scraped products into the "Product" table, and the Shopify
+    variants attached to them into "ProductVariant" (variants that vanished
+    from a product are deleted).
+
+    Two loading modes are available through ``DB_LOAD_MODE``:
+
+    * ``"upsert"`` sends batches of ``DB_BATCH_SIZE`` rows with
+      ``INSERT ... ON CONFLICT``.
+    * ``"copy"`` streams batches into an unlogged staging table with
+      ``COPY FROM STDIN`` and merges it into "Product" with a single
+      ``INSERT ... SELECT`` when the spider closes.
+
+    ``DB_COMMIT_POLICY`` is ``"batch"`` (commit after every batch) or
+    ``"close"`` (one transaction for the whole run, so readers never see a
+    half-updated catalogue).
+
+    Rows whose product data did not change are not rewritten; their
+    scrapedAt is refreshed in bulk when the spider closes (or left alone when
+    ``DB_TOUCH_UNCHANGED`` is off).
+
+    Products are never deleted here: ``scripts/import-products.js`` marks
+    the products missing from a complete feed with "removedAt" (keeping
+    wishlist links), and every product written or seen again by the pipeline
+    gets "removedAt" cleared.
+
+    Under the ``"batch"`` policy every commit is announced with the
+    ``db_committed`` signal (the run state checkpoint). A resumed crawl
+    (``RUN_RESUME``) keeps the staging table of the interrupted attempt, so
+    rows staged before the interruption are still merged.
+
+    All database work runs on a dedicated writer thread, in submission order,
+    so a slow round trip or commit never blocks the reactor. At most
+    ``DB_MAX_PENDING_BATCHES`` batches may wait for the writer; beyond that
+    ``process_item`` waits, and Scrapy holds further items, until the writer
+    catches up.
+
+    Connections come from the process-wide :class:`~my_scraper.db.ConnectionManager`.
+    Under the ``"batch"`` policy a connection is only checked out while a job
+    runs, so any number of spiders share a small pool; under ``"close"`` each
+    spider holds one until it closes. A spider that cannot get a connection
+    within ``DB_POOL_TIMEOUT`` fails (or is closed with ``db_pool_exhausted``)
+    instead of running without its database writes.
+
+    When a connection drops, the pipeline reconnects with backoff and replays
+    the work that was not committed yet (the failed batch, or every batch
+    since the start under the ``"close"`` policy); the SQL is idempotent, so
+    replaying is safe.
+    """
+
+    # Swapped for a fake in the offline benchmark (my_scraper.benchmark);
+    # None means my_scraper.db.ConnectionManager.
+    connection_manager_class = None
+
+    def __init__(self, stats, settings, touch_unchanged=True, load_mode="upsert",
+                 batch_size=100, commit_policy="batch", max_pending_batches=4):
+        if load_mode not in ("upsert", "copy"):
+            raise ValueError(f"Unknown DB_LOAD_MODE: {load_mode!r}")
+        if commit_policy not in ("batch", "close"):
+            raise ValueError(f"Unknown DB_COMMIT_POLICY: {commit_policy!r}")
+        self.stats = stats
+        self.settings = settings
+        self.touch_unchanged = touch_unchanged
+        self.load_mode = load_mode
+        self.batch_size = batch_size
+        self.commit_policy = commit_policy
+        self.max_pending_batches = max(1, max_pending_batches)
+        self.resume = settings.getbool("RUN_RESUME")
+        self.staging_suffix = settings.get("DB_STAGING_SUFFIX", "")
+        self.crawler = None
+        self.signals = None
+        self.seen_urls = set()
+        self.profiler = StageProfiler()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(
+            stats=crawler.stats,
+            settings=settings,
+            touch_unchanged=settings.getbool("DB_TOUCH_UNCHANGED", True),
+            load_mode=settings.get("DB_LOAD_MODE", "upsert"),
+            batch_size=settings.getint("DB_BATCH_SIZE", 100),
+            commit_policy=settings.get("DB_COMMIT_POLICY", "batch"),
+            max_pending_batches=settings.getint("DB_MAX_PENDING_BATCHES", 4),
+        )
+        crawler.signals.connect(pipeline.products_seen, signal=products_seen)
+        pipeline.crawler = crawler
+        pipeline.signals = crawler.signals
+        pipeline.profiler = StageProfiler.for_crawler(crawler)
+        return pipeline
+
+    async def open_spider(self):
+        spider = self.spider = self.crawler.spider
         self.batch = []
+        self.variant_batch = []
         self.enabled = True
+        self.pending = 0
+        self.waiters = []
+        self.uncommitted = []
+        self.conn = None
         db_url = _normalize_db_url(os.getenv("DATABASE_URL"))
         if not db_url:
             self.enabled = False
             spider.logger.warning("DbStorePipeline disabled: DATABASE_URL not set")
             return
+        _import_psycopg2()
+        self.db = (self.connection_manager_class or ConnectionManager).from_settings(db_url, self.settings)
+        self.writer = ThreadPool(minthreads=1, maxthreads=1, name=f"DbStorePipeline-{spider.name}")
+        self.writer.start()
         try:
-            self.conn = psycopg2.connect(db_url)
-            self.cur = self.conn.cursor()
+            await maybe_deferred_to_future(self._submit(self._connect, spider.name))
         except Exception as exc:
             self.enabled = False
+            self.writer.stop()
+            self.db.release()
+            if isinstance(exc, PoolExhausted):
+                raise
             spider.logger.error(f"DbStorePipeline disabled: failed to connect ({exc})")
 
-    def close_spider(self, spider):
+    async def close_spider(self):
         if not self.enabled:
             return
         self._flush()
-        self.cur.close()
-        self.conn.close()
+        d = self._submit(
+            self._finish,
+            list(self.seen_urls),
+            _parse_scraped_at(getattr(self.spider, "scrape_time", None)),
+        )
+        self.seen_urls.clear()
+        d.addCallback(self._apply_counts)
+        d.addErrback(self._log_failure, "final merge/commit")
+        d.addBoth(self._stop_writer)
+        await maybe_deferred_to_future(d)
+
+    def _stop_writer(self, _):
+        self.writer.stop()
+        if self.conn is not None:
+            self.db.putconn(self.conn)
+            self.conn = None
+        self.db.release()
 
-    def process_item(self, item, spider):
+    async def process_item(self, item):
         if not self.enabled:
             return item
-        brand = item.get("brand") or {
-            "products": "Aegis",
-            "tomaz": "Tomaz",
-            "smart_master": "Smart Master",
-        }.get(spider.name)
-
-        raw_scraped_at = item.get("scraped_at") or item.get("scrape_time")
-        try:
-            scraped_at = (
-                raw_scraped_at
-                if isinstance(raw_scraped_at, datetime)
-                else datetime.fromisoformat(raw_scraped_at)  # may be a string
+        if isinstance(item, ProductItem):
+            # Typed items carry the run's datetime already parsed.
+            name, image, url, brand = item.name, item.image, item.url, item.brand
+            scraped_at = item.run.scraped_at
+            shopify = (
+                item.shopify_id, item.vendor, item.product_type, item.tags or [],
+                item.price_min, item.price_max, item.available, item.shopify_updated_at,
             )
-        except Exception:
-            scraped_at = datetime.utcnow()
+            for variant in item.variants or ():
+                self.variant_batch.append((
+                    str(uuid.uuid4()),
+                    url,
+                    variant.shopify_id,
+                    variant.title,
+                    variant.sku,
+                    variant.price,
+                    variant.compare_at_price,
+                    variant.available,
+                    variant.options,
+                    variant.position,
+                ))
+        else:
+            adapter = ItemAdapter(item)
+            name, image, url, brand = (adapter.get(k) for k in ("name", "image", "url", "brand"))
+            scraped_at = _parse_scraped_at(adapter.get("scraped_at") or adapter.get("scrape_time"))
+            shopify = (None, None, None, [], None, None, None, None)
+        # Dict items from older spiders may not carry the brand.
+        brand = brand or getattr(self.spider, "brand", None)
 
         self.batch.append((
             str(uuid.uuid4()),
-            item.get("name"),
-            item.get("image"),
-            item.get("url"),
+            name,
+            image,
+            url,
             brand,
             scraped_at,
+            *shopify,
         ))
-        if len(self.batch) >= 100:
+        if len(self.batch) >= self.batch_size:
             self._flush()
+            if self.pending > self.max_pending_batches:
+                # Backpressure: hold this item until the writer has caught up.
+                self.stats.inc_value("db/backpressure_waits")
+                waiter = defer.Deferred()
+                self.waiters.append(waiter)
+                await maybe_deferred_to_future(waiter)
         return item
 
+    def products_seen(self, urls, spider):
+        # Products on pages that were skipped as unchanged only get scrapedAt refreshed.
+        self.seen_urls.update(urls)
+
+    # -- reactor side -------------------------------------------------------
+
     def _flush(self):
         if not self.enabled or not self.batch:
             return
-        sql = """
-        INSERT INTO "Product" (id, name, image, url, brand, "scrapedAt")
-        VALUES %s
-        ON CONFLICT (url) DO UPDATE
-          SET name = EXCLUDED.name,
-              image = EXCLUDED.image,
-              brand = EXCLUDED.brand,
-              "scrapedAt" = EXCLUDED."scrapedAt";
-        """
-        execute_values(self.cur, sql, self.batch)
+        batch = Batch(self.batch, self.variant_batch)
+        self.batch, self.variant_batch = [], []
+        d = self._submit(self._write_batch, batch)
+        d.addCallback(self._batch_written, len(batch.products))
+        d.addErrback(self._log_failure, f"batch of {len(batch.products)} rows")
+
+    def _submit(self, func, *args):
+        """Queue ``func(*args)`` on the writer thread, after everything queued before it."""
+        from twisted.internet import reactor
+
+        self.pending += 1
+        d = threads.deferToThreadPool(reactor, self.writer, func, *args)
+        d.addBoth(self._job_done)
+        return d
+
+    def _job_done(self, result):
+        self.pending -= 1
+        while self.waiters and self.pending <= self.max_pending_batches:
+            self.waiters.pop(0).callback(None)
+        return result
+
+    def _batch_written(self, result, rows):
+        counts, unchanged = result
+        self._apply_counts(counts)
+        if self.touch_unchanged:
+            self.seen_urls.update(unchanged)
+        if self.commit_policy == "batch" and self.signals is not None:
+            self.signals.send_catch_log(signal=db_committed, rows=rows, spider=self.spider)
+
+    def _apply_counts(self, counts):
+        for key, value in counts.items():
+            self.stats.inc_value(key, value)
+        if "db/flush_seconds" in counts:
+            self.stats.max_value("db/flush_seconds_max", counts["db/flush_seconds"])
+
+    def _log_failure(self, failure, what):
+        self.stats.inc_value("db/failed_jobs")
+        self.spider.logger.error(f"DbStorePipeline: {what} failed: {failure.getErrorMessage()}")
+        if failure.check(PoolExhausted) and self.crawler is not None and self.crawler.crawling:
+            # Crawling on would only queue more batches for a pool that is not coming back.
+            deferred_from_coro(self.crawler.engine.close_spider_async(reason="db_pool_exhausted"))
+
+    # -- writer thread ------------------------------------------------------
+
+    def _connect(self, spider_name):
+        self._checkout()
+        try:
+            if self.load_mode == "copy":
+                staging, variant_staging = staging_tables(spider_name, self.staging_suffix)
+                self.staging = sql.Identifier(staging)
+                self.variant_staging = sql.Identifier(variant_staging)
+                self._create_staging()
+        finally:
+            self._checkin()
+
+    def _checkout(self):
+        self.conn = self.db.getconn()
+        self.cur = self.conn.cursor()
+
+    def _checkin(self):
+        """Under the "batch" policy, give the connection back to the pool between jobs."""
+        if self.commit_policy == "batch" and self.conn is not None:
+            self.db.putconn(self.conn)
+            self.conn = None
+
+    def _reconnect(self):
+        if self.conn is not None:
+            self.db.putconn(self.conn, close=True)
+            self.conn = None
+        self._checkout()
+        for batch in self.uncommitted:
+            self._apply_batch(batch)
+
+    def _retrying(self, func, *args):
+        """Run ``func`` on the current connection, reconnecting and replaying on connection loss."""
+        attempt = 0
+        while True:
+            try:
+                if self.conn is None:
+                    self._reconnect()
+                return func(*args)
+            except CONNECTION_ERRORS as exc:
+                attempt += 1
+                if attempt > self.db.retry_times:
+                    raise
+                delay = self.db.delay(attempt)
+                self.spider.logger.warning(
+                    f"DbStorePipeline: connection lost ({exc}); "
+                    f"reconnecting in {delay:.1f}s and replaying {len(self.uncommitted)} uncommitted batches"
+                )
+                self.stats.inc_value("db/reconnects")
+                time.sleep(delay)
+                if self.conn is not None:
+                    self.db.putconn(self.conn, close=True)
+                    self.conn = None
+
+    def _write_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            with self.profiler.stage("db_flush"):
+                counts, unchanged = self._retrying(self._apply_batch, batch, True)
+        finally:
+            self._checkin()
+        if self.commit_policy == "close":
+            self.uncommitted.append(batch)
+        counts["db/flush_count"] = 1
+        counts["db/flush_seconds"] = time.perf_counter() - started
+        return counts, unchanged
+
+    def _apply_batch(self, batch, commit=False):
+        if self.load_mode == "copy":
+            result = self._copy_batch(batch)
+        else:
+            result = self._upsert_batch(batch)
+        if commit and self.commit_policy == "batch":
+            with self.profiler.stage("commit"):
+                self.conn.commit()
+        return result
+
+    def _finish(self, seen_urls, scraped_at):
+        try:
+            with self.profiler.stage("db_finish"):
+                return self._retrying(self._merge_and_commit, seen_urls, scraped_at)
+        finally:
+            self._checkin()
+
+    def _merge_and_commit(self, seen_urls, scraped_at):
+        counts = {}
+        if self.load_mode == "copy":
+            counts = self._merge_staging()
+        counts["db/rows_touched"] = counts.get("db/rows_touched", 0) + self._touch_seen(seen_urls, scraped_at)
+        self.conn.commit()
+        self.uncommitted.clear()
+        self.cur.close()
+        return counts
+
+    def _upsert_batch(self, batch):
+        products = batch.products
+        with self.profiler.stage("execute_values"):
+            rows = execute_values(self.cur, UPSERT_SQL, products, template=PRODUCT_TEMPLATE, fetch=True)
+        written = {row[0] for row in rows}
+        unchanged = {row[3] for row in products} - written
+        counts = {"db/rows_written": len(written), "db/rows_unchanged": len(unchanged)}
+        if batch.variants:
+            # Last row wins if a variant shows up twice in one batch.
+            variants = list({row[2]: row for row in batch.variants}.values())
+            with self.profiler.stage("execute_values_variants"):
+                execute_values(self.cur, VARIANT_UPSERT_SQL, variants, template=VARIANT_TEMPLATE)
+            counts["db/variants_written"] = max(self.cur.rowcount, 0)
+            ids_by_url = {}
+            for row in variants:
+                ids_by_url.setdefault(row[1], []).append(row[2])
+            with self.profiler.stage("execute_values_variant_prune"):
+                execute_values(self.cur, VARIANT_PRUNE_SQL, list(ids_by_url.items()), template="(%s, %s::bigint[])")
+            counts["db/variants_deleted"] = max(self.cur.rowcount, 0)
+        return counts, unchanged
+
+    def _create_staging(self):
+        if not self.resume:
+            self.cur.execute(sql.SQL("DROP TABLE IF EXISTS {staging}, {variant_staging};").format(
+                staging=self.staging, variant_staging=self.variant_staging,
+            ))
+        # Unlogged: no WAL for rows that only live until the merge.
+        self.cur.execute(sql.SQL(
+            """
+            CREATE UNLOGGED TABLE IF NOT EXISTS {staging} (
+                seq BIGSERIAL,
+                id TEXT NOT NULL,
+                name TEXT,
+                image TEXT,
+                url TEXT,
+                brand TEXT,
+                "scrapedAt" TIMESTAMP(3) NOT NULL,
+                "shopifyId" BIGINT,
+                vendor TEXT,
+                "productType" TEXT,
+                tags TEXT[],
+                "priceMin" DECIMAL(10,2),
+                "priceMax" DECIMAL(10,2),
+                available BOOLEAN,
+                "shopifyUpdatedAt" TEXT
+            );
+            CREATE UNLOGGED TABLE IF NOT EXISTS {variant_staging} (
+                seq BIGSERIAL,
+                id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                "shopifyId" BIGINT NOT NULL,
+                title TEXT,
+                sku TEXT,
+                price DECIMAL(10,2),
+                "compareAtPrice" DECIMAL(10,2),
+                available BOOLEAN,
+                options TEXT[],
+                position INTEGER
+            );
+            """
+        ).format(staging=self.staging, variant_staging=self.variant_staging))
         self.conn.commit()
-        self.batch.clear()
+
+    def _copy_rows(self, table, columns, rows):
+        buf = io.StringIO()
+        buf.writelines(_copy_row(row) for row in rows)
+        buf.seek(0)
+        copy_sql = sql.SQL("COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)").format(
+            table=table,
+            columns=sql.SQL(", ").join(sql.Identifier(c) for c in columns),
+        )
+        self.cur.copy_expert(copy_sql.as_string(self.conn), buf)
+
+    def _copy_batch(self, batch):
+        with self.profiler.stage("copy"):
+            self._copy_rows(self.staging, PRODUCT_COLUMNS, batch.products)
+        counts = {"db/rows_staged": len(batch.products)}
+        if batch.variants:
+            with self.profiler.stage("copy_variants"):
+                self._copy_rows(self.variant_staging, VARIANT_COLUMNS, batch.variants)
+            counts["db/variants_staged"] = len(batch.variants)
+        return counts, ()
+
+    def _merge_staging(self):
+        self.cur.execute(sql.SQL(STAGED_COUNT_SQL).format(staging=self.staging))
+        staged = self.cur.fetchone()[0]
+        self.cur.execute(sql.SQL(MERGE_SQL).format(staging=self.staging))
+        written = self.cur.rowcount
+        counts = {"db/rows_written": written, "db/rows_unchanged": staged - written}
+        if self.touch_unchanged:
+            self.cur.execute(sql.SQL(TOUCH_STAGED_SQL).format(staging=self.staging))
+            counts["db/rows_touched"] = self.cur.rowcount
+        self.cur.execute(sql.SQL(VARIANT_MERGE_SQL).format(staging=self.variant_staging))
+        counts["db/variants_written"] = self.cur.rowcount
+        self.cur.execute(sql.SQL(VARIANT_PRUNE_STAGED_SQL).format(staging=self.variant_staging))
+        counts["db/variants_deleted"] = self.cur.rowcount
+        self.cur.execute(sql.SQL("DROP TABLE {staging}, {variant_staging};").format(
+            staging=self.staging, variant_staging=self.variant_staging,
+        ))
+        return counts
+
+    def _touch_seen(self, urls, scraped_at):
+        if not urls:
+            return 0
+        self.cur.execute(TOUCH_SEEN_SQL, (scraped_at, urls, scraped_at))
+        return self.cur.rowcount
@@ -0,0 +1,213 @@
+"""
+Opt-in stage profiling (``PROFILE_ENABLED``): where a crawl spends its time.
+
+Stages are timed by the project middlewares (downloads and spider
+callbacks), by :class:`ProfiledItemPipelineManager` (each item pipeline) and
+by :meth:`StageProfiler.stage` blocks inside the spiders and DbStorePipeline
+(JSON decoding, selectors, ``execute_values``). Nested stages form a path
+such as ``parse;parse_products;json_decode``; each path keeps a count, total
+and max, and its self time (minus nested stages) for a folded flame graph.
+"""
+
+import contextlib
+import sys
+import threading
+import time
+import weakref
+from collections import defaultdict
+from functools import wraps
+from inspect import isawaitable
+
+from scrapy.pipelines import ItemPipelineManager
+from twisted.internet.defer import Deferred
+
+# One profiler per crawler, shared by every component that reports to it.
+_profilers = weakref.WeakKeyDictionary()
+
+
+class _Frame:
+    __slots__ = ("path", "started", "children")
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.perf_counter()
+        self.children = 0.0
+
+
+class StageProfiler:
+    """
+    Stage timings of one crawl. A disabled profiler (the default) hands out a
+    shared no-op context from :meth:`stage`, so instrumented code costs
+    nothing when profiling is off.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # path -> [count, total seconds, max seconds, self seconds]
+        self.stages = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+
+    @classmethod
+    def for_crawler(cls, crawler):
+        profiler = _profilers.get(crawler)
+        if profiler is None:
+            profiler = _profilers[crawler] = cls(crawler.settings.getbool("PROFILE_ENABLED"))
+        return profiler
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def push(self, name):
+        """Start a stage nested in the current one (per thread); returns the frame for :meth:`pop`."""
+        stack = self._stack()
+        frame = _Frame(f"{stack[-1].path};{name}" if stack else name)
+        stack.append(frame)
+        return frame
+
+    def pop(self, frame):
+        elapsed = time.perf_counter() - frame.started
+        stack = self._stack()
+        # Async callbacks may interleave at their awaits, so the frame is not
+        # necessarily on top.
+        index = len(stack) - 1 - stack[::-1].index(frame)
+        del stack[index]
+        if index:
+            stack[index - 1].children += elapsed
+        self.record(frame.path, elapsed, elapsed - frame.children)
+
+    def record(self, path, seconds, self_seconds=None):
+        """Add one timing of ``path`` (measured elsewhere, e.g. download latency)."""
+        with self.lock:
+            entry = self.stages[path]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += seconds if self_seconds is None else max(0.0, self_seconds)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        frame = self.push(name)
+        try:
+            yield
+        finally:
+            self.pop(frame)
+
+    def stage(self, name):
+        """Context manager timing the block as stage ``name``."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._timed(name)
+
+    def summary(self):
+        """``{path: {count, total, mean, max}}`` in seconds, slowest total first."""
+        with self.lock:
+            items = sorted(self.stages.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            path: {
+                "count": count,
+                "total": round(total, 6),
+                "mean": round(total / count, 6) if count else None,
+                "max": round(maximum, 6),
+            }
+            for path, (count, total, maximum, _) in items
+        }
+
+    def folded(self, root):
+        """Folded stacks (``root;path microseconds``) for flamegraph.pl, speedscope or inferno."""
+        with self.lock:
+            items = sorted(self.stages.items())
+        for path, (_, _, _, self_seconds) in items:
+            micros = round(self_seconds * 1_000_000)
+            if micros:
+                yield f"{root};{path} {micros}\n"
+
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class StackSampler:
+    """
+    Samples the Python stack of one thread every ``interval`` seconds from a
+    background thread and counts identical stacks, for a flame graph of the
+    code itself rather than of the named stages.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = defaultdict(int)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="StackSampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        for stack, count in sorted(self.counts.items()):
+            yield f"{stack} {count}\n"
+
+
+class ProfiledItemPipelineManager(ItemPipelineManager):
+    """
+    ``ITEM_PROCESSOR`` that times every pipeline's ``process_item`` as stage
+    ``pipeline;<class>`` when profiling is on (otherwise it is the stock
+    manager). Pipelines that return a Deferred or coroutine are timed until it
+    fires, so their stage includes any waiting (DB backpressure, image fetches).
+
+    Only the pipelines' own ``process_item`` is wrapped, before the stock
+    manager registers it, so the manager's internals are left alone.
+    """
+
+    def __init__(self, *middlewares, crawler=None):
+        profiler = StageProfiler.for_crawler(crawler) if crawler is not None else None
+        if profiler is not None and profiler.enabled:
+            for mw in middlewares:
+                if hasattr(mw, "process_item"):
+                    mw.process_item = _timed_process_item(
+                        profiler, f"pipeline;{type(mw).__name__}", mw.process_item
+                    )
+        super().__init__(*middlewares, crawler=crawler)
+
+
+def _timed_process_item(profiler, path, method):
+    @wraps(method)
+    def process_item(item, *args):
+        started = time.perf_counter()
+        result = method(item, *args)
+        if isinstance(result, Deferred):
+            def done(value):
+                profiler.record(path, time.perf_counter() - started)
+                return value
+
+            return result.addBoth(done)
+        if isawaitable(result):
+            async def awaited():
+                try:
+                    return await result
+                finally:
+                    profiler.record(path, time.perf_counter() - started)
+
+            return awaited()
+        profiler.record(path, time.perf_counter() - started)
+        return result
+
+    return process_item
@@ -0,0 +1,186 @@
+"""
+Pagination and completeness bookkeeping for the Shopify spiders.
+
+:class:`CollectionProgress` keeps it in this process (and in the JOBDIR job
+state of a resumable run). :class:`SharedProgress` keeps it in the shared
+crawl frontier (:mod:`my_scraper.frontier`), so every worker of a run sees
+the same pages requested, parsed and failed, and agrees on the crawl mode
+and watermarks.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from my_scraper.frontier import frontier_key, open_frontier
+
+
+class CollectionProgress:
+    """
+    Per collection URL: the highest page requested, the first short page,
+    the pages requested but not parsed yet, whether a page failed and the
+    newest ``updated_at`` seen.
+    """
+
+    def __init__(self):
+        self.requested_pages = {}
+        self.last_pages = {}
+        self.in_flight = defaultdict(int)
+        self.failed = set()
+        self.newest = {}
+
+    @property
+    def sole_worker(self):
+        """True when no other process worked on the same crawl."""
+        return True
+
+    def restore(self, state):
+        """
+        Keep the progress in ``spider.state``, which Scrapy saves to the
+        JOBDIR on close, so a resumed crawl can still tell when a collection
+        was fully seen. Requests lost with the interrupted process keep
+        their collection incomplete. Returns True when resuming.
+        """
+        progress = state.setdefault("shopify_progress", {})
+        resumed = bool(progress)
+        if resumed:
+            self.requested_pages.update(progress["requested_pages"])
+            self.last_pages.update(progress["last_pages"])
+            self.in_flight.update(progress["in_flight"])
+            self.failed.update(progress["failed"])
+            self.newest.update(progress["newest"])
+        progress.update(
+            requested_pages=self.requested_pages,
+            last_pages=self.last_pages,
+            in_flight=self.in_flight,
+            failed=self.failed,
+            newest=self.newest,
+        )
+        return resumed
+
+    def agree(self, name, value):
+        """The run-wide value of ``name``: ``value`` unless another worker set it first."""
+        return value
+
+    def claim_pages(self, url, upper, after=0):
+        """Pages after ``after`` (or the highest one requested) up to ``upper``, now marked requested."""
+        pages = range(self.requested_pages.get(url, after) + 1, upper + 1)
+        if pages:
+            self.requested_pages[url] = upper
+        return pages
+
+    def page_started(self, url):
+        self.in_flight[url] += 1
+
+    def page_done(self, url):
+        self.in_flight[url] -= 1
+
+    def page_failed(self, url):
+        self.in_flight[url] -= 1
+        self.failed.add(url)
+
+    def short_page(self, url, page):
+        last_page = self.last_pages.get(url)
+        if last_page is None or page < last_page:
+            self.last_pages[url] = page
+
+    def last_page(self, url):
+        return self.last_pages.get(url)
+
+    def saw_updated_at(self, url, updated_at):
+        newest = self.newest.get(url)
+        if updated_at is not None and (newest is None or updated_at > newest):
+            self.newest[url] = updated_at
+
+    def complete(self, url):
+        return url in self.last_pages and self.in_flight[url] == 0 and url not in self.failed
+
+    def newest_seen(self):
+        return dict(self.newest)
+
+    def close(self):
+        pass
+
+
+class SharedProgress:
+    """
+    :class:`CollectionProgress` kept in the frontier under the spider's
+    frontier key, for spiders whose requests go through the shared frontier.
+
+    Counters are updated atomically by the backend, so a page requested by
+    one worker and parsed by another still balances out, and a collection
+    is only complete once every worker is done with it. :meth:`close` keeps
+    the final values, for the feed kind and metrics reported after the
+    spider closed.
+    """
+
+    def __init__(self, frontier, key):
+        self.frontier = frontier
+        self.key = key
+        self.final = None
+        self.frontier.register(key)
+
+    @classmethod
+    def for_spider(cls, spider, settings):
+        return cls(open_frontier(settings), frontier_key(spider))
+
+    @property
+    def sole_worker(self):
+        if self.final is not None:
+            return self.final["sole_worker"]
+        return self.frontier.others_active_at(self.key) == 0
+
+    def values(self):
+        if self.final is not None:
+            return self.final["values"]
+        return self.frontier.progress(self.key)
+
+    def restore(self, state):
+        # The frontier outlives the process; there is nothing to restore.
+        return False
+
+    def agree(self, name, value):
+        return self.frontier.progress_setdefault(self.key, name, value)
+
+    def claim_pages(self, url, upper, after=0):
+        previous = self.frontier.progress_max(self.key, f"requested {url}", upper)
+        return range(int(previous) + 1 if previous is not None else after + 1, upper + 1)
+
+    def page_started(self, url):
+        self.frontier.progress_add(self.key, f"in_flight {url}", 1)
+
+    def page_done(self, url):
+        self.frontier.progress_add(self.key, f"in_flight {url}", -1)
+
+    def page_failed(self, url):
+        self.page_done(url)
+        self.frontier.progress_add(self.key, f"failed {url}", 1)
+
+    def short_page(self, url, page):
+        self.frontier.progress_min(self.key, f"last_page {url}", page)
+
+    def last_page(self, url):
+        value = self.frontier.progress_get(self.key, f"last_page {url}")
+        return int(float(value)) if value is not None else None
+
+    def saw_updated_at(self, url, updated_at):
+        if updated_at is not None:
+            self.frontier.progress_max(self.key, f"newest {url}", updated_at.timestamp())
+
+    def complete(self, url):
+        values = self.values()
+        return (
+            values.get(f"last_page {url}") is not None
+            and float(values.get(f"in_flight {url}", 0)) == 0
+            and values.get(f"failed {url}") is None
+        )
+
+    def newest_seen(self):
+        return {
+            name.split(" ", 1)[1]: datetime.fromtimestamp(float(value), timezone.utc)
+            for name, value in self.values().items()
+            if name.startswith("newest ")
+        }
+
+    def close(self):
+        self.final = {"sole_worker": self.sole_worker, "values": self.values()}
+        self.frontier.close()
@@ -0,0 +1,96 @@
+"""
+Job state of one scrape run, for ``run_all_spiders --resume``::
+
+    .scrapy/runs/<scrape_run_id>/
+        run.json              scrape_time and spider list of the run
+        spiders/<name>.json   status, attempts, items and DB checkpoint per spider
+        jobs/<name>/          the spider's Scrapy JOBDIR (queue, seen requests, spider.state)
+"""
+
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+from scrapy.utils.project import data_path
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class RunState:
+    def __init__(self, root):
+        self.root = root
+
+    @staticmethod
+    def base_dir(settings):
+        return data_path(settings.get("RUN_STATE_DIR", "runs"))
+
+    @classmethod
+    def for_run(cls, settings, scrape_run_id):
+        return cls(os.path.join(cls.base_dir(settings), scrape_run_id))
+
+    @classmethod
+    def latest(cls, settings):
+        """The most recently started run, or None."""
+        base = cls.base_dir(settings)
+        runs = [
+            os.path.join(base, name) for name in os.listdir(base)
+            if os.path.isfile(os.path.join(base, name, "run.json"))
+        ] if os.path.isdir(base) else []
+        if not runs:
+            return None
+        return cls(max(runs, key=lambda path: os.path.getmtime(os.path.join(path, "run.json"))))
+
+    @classmethod
+    def prune(cls, settings, keep_days, keep=()):
+        """Delete the state (and JOBDIRs) of runs not touched for ``keep_days`` days."""
+        base = cls.base_dir(settings)
+        if not os.path.isdir(base):
+            return
+        cutoff = time.time() - keep_days * 86400
+        for name in os.listdir(base):
+            path = os.path.join(base, name)
+            if name not in keep and os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.root, "run.json"))
+
+    def jobdir(self, spider_name):
+        return os.path.join(self.root, "jobs", spider_name)
+
+    def read_run(self):
+        return _read_json(os.path.join(self.root, "run.json"))
+
+    def write_run(self, **fields):
+        _write_json(os.path.join(self.root, "run.json"), {**self.read_run(), **fields})
+
+    def spider(self, name):
+        return _read_json(os.path.join(self.root, "spiders", f"{name}.json"))
+
+    def update_spider(self, name, **fields):
+        data = {**self.spider(name), **fields}
+        _write_json(os.path.join(self.root, "spiders", f"{name}.json"), data)
+        return data
+
+    def finished(self, name):
+        return self.spider(name).get("status") == "finished"
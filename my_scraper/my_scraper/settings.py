@@ -7,12 +7,22 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+
 BOT_NAME = "my_scraper"
 
 SPIDER_MODULES = ["my_scraper.spiders"]
 NEWSPIDER_MODULE = "my_scraper.spiders"
 
-ADDONS = {}
+# Source registry the spiders are generated from (TOML; relative paths are
+# relative to this package). SCRAPE_SOURCES points it elsewhere.
+SOURCES_FILE = os.getenv("SCRAPE_SOURCES", "sources.toml")
+
+ADDONS = {
+    # Switches SCHEDULER / DUPEFILTER_CLASS to the shared frontier when
+    # FRONTIER_BACKEND is set.
+    "my_scraper.frontier.FrontierAddon": 0,
+}
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -29,6 +39,79 @@ CONCURRENT_REQUESTS = 4                     # Default is 16 - too high for Playw
 CONCURRENT_REQUESTS_PER_DOMAIN = 1          # Keep at 1 for politeness
 DOWNLOAD_DELAY = 1                          # 1 second delay between requests
 
+# Per-domain rate control (my_scraper.extensions.AdaptiveThrottle).
+# Each downloader slot starts from a profile and then adapts: it ramps up on
+# fast, healthy hosts and backs off on slow responses and 429/503. While it
+# is enabled DOWNLOAD_DELAY / CONCURRENT_REQUESTS_PER_DOMAIN above are only
+# the fallback. Spiders pick a profile with a ``throttle_profile`` attribute;
+# Playwright requests always use the render profile.
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_PROFILES = {
+    # Unknown hosts: the old fixed behaviour, allowed to speed up a little.
+    "default": {
+        "start_delay": 1.0, "min_delay": 0.5, "max_delay": 30.0,
+        "start_concurrency": 1, "max_concurrency": 2, "target_latency": 2.0,
+    },
+    # Shopify products.json endpoints are cheap and cached at the edge.
+    "shopify_json": {
+        "start_delay": 0.25, "min_delay": 0.0, "max_delay": 30.0,
+        "start_concurrency": 2, "max_concurrency": 4, "target_latency": 1.0,
+    },
+    # Product images from the Shopify CDN (ImageMetadataPipeline).
+    "images": {
+        "start_delay": 0.0, "min_delay": 0.0, "max_delay": 10.0,
+        "start_concurrency": 4, "max_concurrency": 8, "target_latency": 1.0,
+    },
+    # Full Playwright renders: one at a time, never faster than 1/s.
+    "render": {
+        "start_delay": 1.0, "min_delay": 1.0, "max_delay": 60.0,
+        "start_concurrency": 1, "max_concurrency": 1, "target_latency": 15.0,
+    },
+}
+ADAPTIVE_THROTTLE_DOMAINS = {}              # e.g. {"tomaz.my": "shopify_json"}
+ADAPTIVE_THROTTLE_RENDER_PROFILE = "render"
+ADAPTIVE_THROTTLE_BACKOFF_CODES = [429, 503]
+ADAPTIVE_THROTTLE_RAMP_AFTER = 5            # healthy responses per ramp-up step
+ADAPTIVE_THROTTLE_SMOOTHING = 0.3           # latency EWMA weight of the newest response
+ADAPTIVE_THROTTLE_DEBUG = False             # log every delay change at INFO
+
+# Shopify products.json spiders request up to this many pages ahead of the
+# last full page instead of walking the collection strictly page by page.
+SHOPIFY_PAGE_WINDOW = 3
+
+# Delta crawls for the Shopify spiders: products whose updated_at is not newer
+# than the collection's watermark from the last complete run (kept under
+# .scrapy/SHOPIFY_WATERMARK_DIR) are only touched in the DB, not re-emitted.
+# Every SHOPIFY_RECONCILE_EVERY_DAYS (or with -a reconcile=1) a full run
+# re-emits everything, so its "complete" feed lets import-products.js mark
+# the products that left the store as removed. The overlap must be longer
+# than a crawl takes. Opt-in: delta feeds only list the changed products, so
+# every feed consumer has to check feed_kinds in last-scrape.json first.
+SHOPIFY_WATERMARK_ENABLED = False
+SHOPIFY_WATERMARK_DIR = "watermarks"
+SHOPIFY_WATERMARK_OVERLAP = 3600            # seconds
+SHOPIFY_RECONCILE_EVERY_DAYS = 7            # 0 = only on demand
+
+# Shared crawl frontier (my_scraper.frontier). With a backend set, the
+# request queue and dupefilter of each spider live in SQLite (several
+# processes on this host) or Redis (several hosts), keyed by spider name and
+# scrape_run_id: start the same spider with the same -a scrape_run_id=... on
+# every worker and they split the work. The Shopify spiders keep their
+# pagination progress there too. Unset = Scrapy's in-process scheduler.
+# run_all_spiders takes RUN_LOCK_NAME on this backend (SQLite when unset) so
+# two runs never overlap; `run_all_spiders --worker --scrape_run_id <id>`
+# joins the run holding it and writes <spider>.<host>-<pid>.<ext> feeds.
+# Each worker's feed only lists its own products, so a run with workers never
+# retires products (see ShopifyCollectionSpider).
+FRONTIER_BACKEND = os.environ.get("SCRAPE_FRONTIER") or None   # "sqlite", "redis" or a class path
+FRONTIER_SQLITE_PATH = "frontier.sqlite"                        # under .scrapy/
+FRONTIER_REDIS_URL = os.environ.get("FRONTIER_REDIS_URL", "redis://localhost:6379/0")
+FRONTIER_REDIS_PREFIX = "my_scraper"
+FRONTIER_IDLE_TIMEOUT = 30          # seconds an idle worker waits for the others' follow-ups
+FRONTIER_RETENTION_DAYS = 7
+RUN_LOCK_NAME = "run_all_spiders"
+RUN_LOCK_TTL = 600                  # seconds; refreshed while the run is alive
+
 # Disable cookies (enabled by default)
 #COOKIES_ENABLED = False
 
@@ -43,28 +126,156 @@ DOWNLOAD_DELAY = 1                          # 1 second delay between requests
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "my_scraper.middlewares.MyScraperSpiderMiddleware": 543,
-#}
+SPIDER_MIDDLEWARES = {
+    "my_scraper.middlewares.IncrementalSpiderMiddleware": 543,
+    "my_scraper.middlewares.MyScraperSpiderMiddleware": 990,   # stage profiling, next to the spider
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "my_scraper.middlewares.MyScraperDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "my_scraper.middlewares.IncrementalDownloaderMiddleware": 543,
+    "my_scraper.middlewares.MyScraperDownloaderMiddleware": 990,   # stage profiling, next to the handler
+}
+
+# ============================================
+# INCREMENTAL CRAWLING
+# ============================================
+# Send If-None-Match / If-Modified-Since for pages seen on earlier runs and
+# skip parsing pages whose content did not change. Products on skipped pages
+# are not written to the feeds, only refreshed in the DB (scrapedAt), so a
+# Shopify feed with skipped pages is a "delta" feed. Shopify spiders use it
+# on delta (and plain full) runs; reconcile runs always parse every page.
+INCREMENTAL_ENABLED = False
+INCREMENTAL_STORE_PATH = "incremental.sqlite"   # relative paths go under .scrapy/
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "my_scraper.extensions.CrawlMetrics": 500,
+    "my_scraper.extensions.AdaptiveThrottle": 510,
+    "my_scraper.extensions.RunStateRecorder": 520,
+    "my_scraper.extensions.ChangeDetector": 530,
+    "my_scraper.extensions.StageProfiling": 540,
+}
+
+# Per-spider run metrics (timings, latency percentiles, bytes, peak RSS),
+# written to METRICS_DIR/<scrape_run_id>/<spider>.json
+METRICS_ENABLED = True
+METRICS_DIR = "metrics"
+
+# Resumable runs: per-run state under .scrapy/RUN_STATE_DIR/<scrape_run_id>/
+# (spider status, items, last committed DB batch) plus a JOBDIR per spider,
+# set by run_all_spiders. `run_all_spiders --resume` re-runs only the spiders
+# that did not finish, continuing their request queues. RUN_RESUME is set by
+# run_all_spiders for resumed crawls.
+RUN_STATE_ENABLED = True
+RUN_STATE_DIR = "runs"
+RUN_STATE_RETENTION_DAYS = 7
+RUN_RESUME = False
+
+# Wall-clock budgets for run_all_spiders (seconds, 0 = no limit). Each spider
+# is closed CLOSESPIDER_TIMEOUT-style after SPIDER_TIME_BUDGET (or its
+# source's time_budget), never later than RUN_TIME_BUDGET into the run, and
+# reported as "partial". A spider that has not stopped RUN_BUDGET_GRACE
+# seconds after its budget is stopped, then killed. Spiders run in
+# sources.toml priority order: plain Shopify JSON sources first.
+SPIDER_TIME_BUDGET = 0
+RUN_TIME_BUDGET = 0
+RUN_BUDGET_GRACE = 60
+
+# Change reports: every run is compared with a per-spider snapshot of the
+# catalogue (.scrapy/CHANGES_SNAPSHOT_DIR/<spider>.sqlite, one row per
+# canonical URL) and the added / changed / removed products are written to
+# CHANGES_DIR/<scrape_run_id>/<spider>.jsonl, with counts in <spider>.json.
+CHANGES_ENABLED = True
+CHANGES_DIR = "changes"
+CHANGES_SNAPSHOT_DIR = "snapshots"
+CHANGES_BATCH_SIZE = 500
+
+# Opt-in stage profiling (run_all_spiders --profile, or -s PROFILE_ENABLED=1):
+# download (HTTP / Playwright / slot queue), callback, JSON decoding, selector,
+# pipeline and DB writer (execute_values, COPY, commit) timings per request
+# and item, written to PROFILE_DIR/<scrape_run_id>/<spider>.json and as a
+# folded flame graph (<spider>.folded; flamegraph.pl, speedscope, inferno).
+# Optionally also a cProfile dump, sampled Python stacks every
+# PROFILE_SAMPLE_INTERVAL seconds (<spider>.stacks.folded) and the top
+# tracemalloc allocation sites.
+PROFILE_ENABLED = False
+PROFILE_DIR = "profiles"
+PROFILE_CPROFILE = False
+PROFILE_SAMPLE_INTERVAL = 0
+PROFILE_TRACEMALLOC = False
+PROFILE_TRACEMALLOC_TOP = 25
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+# Times each pipeline's process_item when PROFILE_ENABLED is on.
+ITEM_PROCESSOR = "my_scraper.profiling.ProfiledItemPipelineManager"
+
 ITEM_PIPELINES = {
+    "my_scraper.pipelines.DedupPipeline": 300,
+    "my_scraper.pipelines.ImageMetadataPipeline": 350,
     "my_scraper.pipelines.DbStorePipeline": 400,
 }
 
+# Drop repeated products (same canonical URL) within a run, before the feed
+# and the DB see them. "set" keeps exact 8-byte hashes; "bloom" uses a fixed
+# amount of memory for very large catalogues at the cost of rare false drops.
+DEDUP_ENABLED = True
+DEDUP_BACKEND = "set"
+DEDUP_BLOOM_CAPACITY = 1_000_000
+DEDUP_BLOOM_ERROR_RATE = 0.001
+
+# Shopify spiders keep the products.json data (vendor, product_type, tags,
+# price range, availability, updated_at). With this on they also attach every
+# variant, which DbStorePipeline writes to "ProductVariant".
+SHOPIFY_EMIT_VARIANTS = True
+
+# Optional image metadata stage: fetch each product image once (a sized
+# Shopify CDN variant), and keep its hash, dimensions, dHash and thumbnail in
+# a content-addressed cache under .scrapy/IMAGE_METADATA_DIR. Dimensions,
+# dHash and thumbnails need Pillow.
+IMAGE_METADATA_ENABLED = False
+IMAGE_METADATA_DIR = "images"
+IMAGE_METADATA_WIDTH = 800
+IMAGE_METADATA_THUMB_SIZE = 256
+IMAGE_METADATA_CONCURRENCY = 8
+IMAGE_METADATA_KEEP_IMAGES = True
+IMAGE_METADATA_MAX_BYTES = 10 * 1024 * 1024
+
+# Products whose name/image/brand did not change are not rewritten by the
+# upsert. When True their scrapedAt is still refreshed, in one bulk UPDATE at
+# spider close; when False unchanged rows are not written at all.
+DB_TOUCH_UNCHANGED = True
+
+# "upsert": INSERT ... ON CONFLICT every DB_BATCH_SIZE items.
+# "copy":   COPY items into an unlogged staging table and merge it into
+#           "Product" in one statement at spider close (faster for big crawls;
+#           use a larger DB_BATCH_SIZE, e.g. 1000).
+DB_LOAD_MODE = "upsert"
+DB_BATCH_SIZE = 100
+# Appended (hashed) to the staging table names; run_all_spiders --worker sets
+# it so each worker stages into tables of its own.
+DB_STAGING_SUFFIX = ""
+# "batch": commit after every batch. "close": one transaction per spider run.
+DB_COMMIT_POLICY = "batch"
+# DB writes run on a background thread; items wait once this many batches
+# are queued behind a slow database.
+DB_MAX_PENDING_BATCHES = 4
+# Connections come from a pool shared by all spiders in the process. Lost
+# connections are re-opened with exponential backoff (1s, 2s, 4s, ... up to
+# DB_RETRY_BACKOFF_MAX) and the uncommitted batches are replayed.
+# Under the "batch" policy a connection is only held while a batch is
+# written; under "close" each spider holds one for its whole run
+# (run_all_spiders raises DB_POOL_MAXCONN to the number of spiders). A spider
+# left waiting DB_POOL_TIMEOUT seconds for a connection fails.
+DB_POOL_MAXCONN = 4
+DB_POOL_TIMEOUT = 300
+DB_RETRY_TIMES = 5
+DB_RETRY_BACKOFF = 1.0
+DB_RETRY_BACKOFF_MAX = 30.0
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -92,12 +303,10 @@ FEED_EXPORT_ENCODING = "utf-8"
 # ============================================
 # PLAYWRIGHT SETTINGS - SERVER OPTIMIZED
 # ============================================
-# Enable Playwright
-DOWNLOAD_HANDLERS = {
-    "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
-    "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
-}
-
+# The Playwright download handler is not enabled here: only spiders that
+# render (RenderFallbackSpider, "rendered"/render_fallback sources) switch
+# DOWNLOAD_HANDLERS to it, so JSON-only spiders never load scrapy-playwright
+# or start a browser. The settings below only apply to those spiders.
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 
 # Playwright tuning
@@ -151,20 +360,57 @@ PLAYWRIGHT_CONTEXTS = {
     }
 }
 
-# Abort unnecessary resource types to save memory and bandwidth
-PLAYWRIGHT_ABORT_REQUEST = lambda req: req.resource_type in [
-    "image",
-    "media", 
-    "font",
-    "stylesheet",
+# Abort unnecessary resource types to save memory and bandwidth, and any
+# script/XHR from hosts outside the allowlist (analytics, chat, trackers).
+# Rendering spiders set PLAYWRIGHT_ABORT_REQUEST to a
+# my_scraper.browser.ResourceBlocker built from this list.
+PLAYWRIGHT_SCRIPT_ALLOWLIST = [
+    "locallab.com.my",
+    "shopify.com",
+    "cdn.shopify.com",
+    "shopifycdn.com",
 ]
 
-# Per-spider JSON feeds so admin can download brand files directly
-FEEDS = {
-    "%(name)s.json": {
-        "format": "json",
-        "encoding": "utf8",
-        "indent": 2,
-        "overwrite": True,
-    },
-}
\ No newline at end of file
+# Browser governor (my_scraper.browser.BrowserGovernor):
+# reuse the warm page for the next pagination request, and restart the
+# browser after N rendered pages or when its processes pass the RSS limit
+# (needs psutil; 0 disables).
+PLAYWRIGHT_REUSE_PAGES = True
+PLAYWRIGHT_RECYCLE_AFTER_PAGES = 50
+PLAYWRIGHT_RECYCLE_MEMORY_MB = 700
+
+# Per-spider feeds so admin can download brand files directly.
+# SCRAPE_FEED_MODE picks the format (run_all_spiders --feed-mode sets it):
+#   "json"     - one indented JSON array per spider (default)
+#   "jsonl"    - JSON Lines, written and read back one item at a time
+#   "jsonl.gz" - gzipped JSON Lines
+SCRAPE_FEED_MODES = ("json", "jsonl", "jsonl.gz")
+SCRAPE_FEED_MODE = os.getenv("SCRAPE_FEED_MODE", "json")
+if SCRAPE_FEED_MODE not in SCRAPE_FEED_MODES:
+    # Anything else would be a JSON Lines feed under an extension the importer never looks for.
+    raise ValueError(
+        f"Unknown SCRAPE_FEED_MODE {SCRAPE_FEED_MODE!r}; expected one of {', '.join(SCRAPE_FEED_MODES)}"
+    )
+
+if SCRAPE_FEED_MODE == "json":
+    FEEDS = {
+        "%(name)s.json": {
+            "format": "json",
+            "encoding": "utf8",
+            "indent": 2,
+            "overwrite": True,
+        },
+    }
+else:
+    FEEDS = {
+        f"%(name)s.{SCRAPE_FEED_MODE}": {
+            "format": "jsonlines",
+            "encoding": "utf8",
+            "overwrite": True,
+            "postprocessing": (
+                ["scrapy.extensions.postprocessing.GzipPlugin"]
+                if SCRAPE_FEED_MODE.endswith(".gz")
+                else []
+            ),
+        },
+    }
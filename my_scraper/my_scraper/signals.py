@@ -0,0 +1,14 @@
+# Signals shared between the spiders, middlewares and pipelines of this project.
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/signals.html
+
+# Sent with ``urls`` (product URLs) and ``spider`` when products were seen on
+# the site during this run but not re-emitted as items, e.g. because the page
+# they are listed on did not change since the previous run.
+products_seen = object()
+
+# Sent by DbStorePipeline with ``rows`` and ``spider`` once a batch of that
+# many products is committed (DB_COMMIT_POLICY = "batch"), so run state can
+# record how far the database got.
+db_committed = object()
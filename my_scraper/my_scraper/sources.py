@@ -0,0 +1,149 @@
+"""
+The source registry: every brand we scrape, declared in ``SOURCES_FILE``
+(TOML, ``sources.toml`` next to this module by default)::
+
+    [[source]]
+    name = "tomaz"                  # spider name, feed file name
+    brand = "Tomaz"                 # stored on every product
+    type = "shopify"                # "shopify" (products.json) or "rendered" (Playwright HTML)
+    render_fallback = false         # shopify only: render the page when products.json is unusable
+    category = "formal"             # default for collections without one
+    throttle_profile = "shopify_json"
+    priority = 0                    # run order, lower first (default: JSON 0, render_fallback 1, rendered 2)
+    time_budget = 600               # seconds before the spider is closed as "partial"
+    collections = [
+        { url = "https://tomaz.my/collections/blazers" },
+    ]
+
+    [source.settings]               # optional per-spider Scrapy settings
+    DOWNLOAD_TIMEOUT = 30
+
+``my_scraper.spiders.registry`` turns each enabled source into a spider class
+and ``run_all_spiders`` runs all of them, so adding a brand is a registry edit.
+"""
+
+import os
+import tomllib
+from dataclasses import dataclass, field
+
+SITE_TYPES = ("shopify", "rendered")
+SOURCE_KEYS = {
+    "name", "brand", "type", "render_fallback", "category", "throttle_profile",
+    "collections", "enabled", "settings", "render_wait_for", "card_selector",
+    "priority", "time_budget",
+}
+
+
+@dataclass(frozen=True, slots=True)
+class Source:
+    name: str
+    brand: str
+    type: str
+    collections: tuple
+    category: str | None = None
+    render_fallback: bool = False
+    throttle_profile: str | None = None
+    enabled: bool = True
+    settings: dict = field(default_factory=dict)
+    # Rendered pages: selector to wait for, and the product card selector.
+    render_wait_for: str | None = None
+    card_selector: str | None = None
+    priority: int | None = None
+    time_budget: float | None = None
+
+    @property
+    def renders(self):
+        """May use Playwright (and so needs its download handler)."""
+        return self.type == "rendered" or self.render_fallback
+
+    @property
+    def run_priority(self):
+        """``priority``, or by cost: plain JSON sources first, rendered sites last."""
+        if self.priority is not None:
+            return self.priority
+        return 2 if self.type == "rendered" else 1 if self.render_fallback else 0
+
+
+def sources_path(path=None):
+    """``path`` (default ``sources.toml``); relative paths are relative to this package."""
+    path = path or os.getenv("SCRAPE_SOURCES") or "sources.toml"
+    return path if os.path.isabs(path) else os.path.join(os.path.dirname(__file__), path)
+
+
+def load_sources(path=None, enabled_only=True, on_error=None):
+    """
+    The sources in the registry, in file order. Raises ``ValueError`` on a
+    malformed entry, or, with ``on_error``, calls ``on_error(message)`` and
+    skips that entry.
+    """
+    path = sources_path(path)
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    sources = []
+    names = set()
+    for index, entry in enumerate(data.get("source", [])):
+        label = f"{path}: source #{index + 1} ({entry.get('name', '?')})"
+        try:
+            source = _parse_source(entry, label)
+            if source.name in names:
+                raise ValueError(f"{label}: duplicate name")
+        except ValueError as exc:
+            if on_error is None:
+                raise
+            on_error(str(exc))
+            continue
+        names.add(source.name)
+        if source.enabled or not enabled_only:
+            sources.append(source)
+    return sources
+
+
+def run_order(sources):
+    """``sources`` by :attr:`Source.run_priority`, keeping file order within a priority."""
+    return sorted(sources, key=lambda source: source.run_priority)
+
+
+def _parse_source(entry, label):
+    unknown = set(entry) - SOURCE_KEYS
+    if unknown:
+        raise ValueError(f"{label}: unknown keys {sorted(unknown)}")
+    for key in ("name", "brand"):
+        if not isinstance(entry.get(key), str) or not entry[key].strip():
+            raise ValueError(f"{label}: {key} is required")
+    if not entry["name"].isidentifier():
+        raise ValueError(f"{label}: name must be a valid identifier")
+    site_type = entry.get("type", "shopify")
+    if site_type not in SITE_TYPES:
+        raise ValueError(f"{label}: type must be one of {SITE_TYPES}, got {site_type!r}")
+    category = entry.get("category")
+    collections = []
+    for collection in entry.get("collections") or []:
+        url = collection.get("url") if isinstance(collection, dict) else None
+        if not isinstance(url, str) or not url.startswith(("https://", "http://")):
+            raise ValueError(f"{label}: every collection needs an absolute url")
+        collections.append({"url": url.rstrip("/"), "category": collection.get("category", category)})
+    if not collections:
+        raise ValueError(f"{label}: no collections")
+    priority = entry.get("priority")
+    if priority is not None and (not isinstance(priority, int) or isinstance(priority, bool)):
+        raise ValueError(f"{label}: priority must be an integer")
+    time_budget = entry.get("time_budget")
+    if time_budget is not None and (
+        not isinstance(time_budget, (int, float)) or isinstance(time_budget, bool) or time_budget <= 0
+    ):
+        raise ValueError(f"{label}: time_budget must be a positive number of seconds")
+    return Source(
+        name=entry["name"],
+        brand=entry["brand"].strip(),
+        type=site_type,
+        collections=tuple(collections),
+        category=category,
+        render_fallback=bool(entry.get("render_fallback", False)),
+        throttle_profile=entry.get("throttle_profile"),
+        enabled=bool(entry.get("enabled", True)),
+        settings=dict(entry.get("settings") or {}),
+        render_wait_for=entry.get("render_wait_for"),
+        card_selector=entry.get("card_selector"),
+        priority=priority,
+        time_budget=float(time_budget) if time_budget is not None else None,
+    )
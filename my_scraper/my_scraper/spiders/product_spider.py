@@ -1,68 +1,160 @@
+from urllib.parse import urlparse
+
 import scrapy
 from scrapy_playwright.page import PageMethod
-from datetime import datetime
 
+from ..browser import BrowserGovernor, ResourceBlocker
+from .shopify_spider import ShopifyCollectionSpider
+
+
+class RenderFallbackSpider(ShopifyCollectionSpider):
+    """
+    Base spider for stores whose collection pages may need rendering
+    (``render_fallback`` / ``type = "rendered"`` sources in the registry).
+
+    The first ``products.json`` page is used as a probe: if it answers with
+    JSON the collection is scraped over plain HTTP like the other Shopify
+    spiders. Rendering the collection page in Playwright is only the fallback
+    when that endpoint is missing, blocked or not JSON, or the only way with
+    ``force_render``; rendered pages are reused, closed and recycled by a
+    :class:`BrowserGovernor`.
+    """
+
+    custom_settings = {
+        **ShopifyCollectionSpider.custom_settings,
+        # Only rendering spiders use (and so import) scrapy-playwright; its
+        # handler starts the Playwright driver when the engine starts.
+        "DOWNLOAD_HANDLERS": {
+            "http": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
+            "https": "scrapy_playwright.handler.ScrapyPlaywrightDownloadHandler",
+        },
+    }
+
+    # Rendered collection pages: wait for the first product card, then read the cards.
+    render_wait_for = "div.product-card__figure"
+    card_selector = "div.product-card__figure, div.product-card, div.grid-product"
 
-class ProductsSpider(scrapy.Spider):
-    name = "products"
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        if settings.get("PLAYWRIGHT_ABORT_REQUEST") is None:
+            blocker = ResourceBlocker(settings.getlist("PLAYWRIGHT_SCRIPT_ALLOWLIST"))
+            settings.set("PLAYWRIGHT_ABORT_REQUEST", blocker, priority="spider")
 
-    def __init__(self, scrape_time=None, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        now = datetime.now()
-        self.scrape_time = scrape_time or now.isoformat()
-        self.scrape_date = now.strftime("%Y-%m-%d")
-        self.scrape_run_id = now.strftime("%Y%m%d_%H%M%S")
-        self.start_urls = [
-            "https://locallab.com.my/collections/aegis",
-        ]
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.governor = BrowserGovernor.from_crawler(crawler)
+        return spider
 
-    def start_requests(self):
-        for url in self.start_urls:
-            yield scrapy.Request(
+    async def start(self):
+        # force_render skips the probe: "rendered" sources, and -a force_render=1
+        # to record HTML benchmark fixtures.
+        if getattr(self, "force_render", False):
+            for collection in self.collections:
+                yield self.render_request(collection["url"], collection)
+            return
+        async for request in super().start():
+            yield request
+
+    def page_request(self, collection, page):
+        request = super().page_request(collection, page)
+        if page == 1:
+            request = request.replace(errback=self.probe_failed)
+        return request
+
+    def parse_products(self, response, page, collection):
+        if page == 1:
+            try:
+                with self.profiler.stage("json_decode"):
+                    data = response.json()
+            except ValueError:
+                data = None
+            if not isinstance(data, dict) or "products" not in data:
+                self.logger.info(f"No products.json for {collection['url']}, rendering with Playwright")
+                self.crawler.stats.inc_value("shopify_probe/fallback")
+                yield self.render_request(collection["url"], collection)
+                # The probe is done; the rendered pages now keep the collection open.
+                self.progress.page_done(collection["url"])
+                return
+            self.crawler.stats.inc_value("shopify_probe/json")
+        yield from super().parse_products(response, page, collection)
+
+    def probe_failed(self, failure):
+        collection = failure.request.cb_kwargs["collection"]
+        self.logger.info(
+            f"products.json probe failed for {collection['url']} ({failure.getErrorMessage()}), "
+            "rendering with Playwright"
+        )
+        self.crawler.stats.inc_value("shopify_probe/fallback")
+        yield self.render_request(collection["url"], collection)
+        self.progress.page_done(collection["url"])
+
+    def render_request(self, url, collection, page=1):
+        # Counted like products.json pages, so completeness covers rendered collections too.
+        self.progress.page_started(collection["url"])
+        return self.governor.track(
+            scrapy.Request(
                 url=url,
-                callback=self.parse_products,
+                callback=self.parse_rendered,
+                errback=self.render_failed,
+                cb_kwargs={"collection": collection, "page": page},
                 meta={
                     "playwright": True,
+                    # Own downloader slot, so renders are throttled apart from products.json.
+                    "download_slot": f"{urlparse(url).hostname}/playwright",
                     "playwright_page_methods": [
-                        PageMethod("wait_for_selector", "div.product-card__figure", timeout=30000)
+                        PageMethod("wait_for_selector", self.render_wait_for, timeout=30000)
                     ],
                 },
             )
+        )
 
-    def parse_products(self, response):
-        cards = response.css("div.product-card__figure, div.product-card, div.grid-product")
+    async def render_failed(self, failure):
+        # A spider method rather than governor.discard, so render requests can
+        # be serialized (shared frontier, JOBDIR). The collection stays incomplete.
+        collection = failure.request.cb_kwargs["collection"]
+        self.progress.page_failed(collection["url"])
+        self.crawler.stats.inc_value("shopify/failed_pages")
+        self.logger.error(f"Failed to render {failure.request.url}: {failure.getErrorMessage()}")
+        await self.governor.discard(failure)
+
+    async def parse_rendered(self, response, collection, page=1):
+        browser_page = response.meta.get("playwright_page")
+        with self.profiler.stage("css_select"):
+            cards = response.css(self.card_selector)
         for product in cards:
-            name = product.css("img::attr(alt)").get() or product.css("a::attr(title)").get()
-            img = (
-                product.css("img::attr(src)").get()
-                or product.css("img::attr(data-src)").get()
-                or product.css("source::attr(srcset)").get()
+            with self.profiler.stage("css_select"):
+                name = product.css("img::attr(alt)").get() or product.css("a::attr(title)").get()
+                img = (
+                    product.css("img::attr(src)").get()
+                    or product.css("img::attr(data-src)").get()
+                    or product.css("source::attr(srcset)").get()
+                )
+                href = product.css("a::attr(href)").get()
+
+            item = self.product_item(
+                name=name,
+                image=response.urljoin(img) if img else None,
+                url=response.urljoin(href) if href else None,
+                category=collection.get("category"),
             )
-            href = product.css("a::attr(href)").get()
-
-            yield {
-                "name": (name or "").strip() or None,
-                "image": response.urljoin(img) if img else None,
-                "url": response.urljoin(href) if href else None,
-                "category": "streetwear",
-                "scraped_at": self.scrape_time,
-                "scrape_date": self.scrape_date,
-                "scrape_run_id": self.scrape_run_id,
-            }
-
-        next_url = (
-            response.css("link[rel='next']::attr(href)").get()
-            or response.css("a[rel='next']::attr(href)").get()
-            or response.css("a.pagination__item--next::attr(href)").get()
-        )
-        if next_url:
-            yield response.follow(
-                next_url,
-                callback=self.parse_products,
-                meta={
-                    "playwright": True,
-                    "playwright_page_methods": [
-                        PageMethod("wait_for_selector", "div.product-card__figure", timeout=30000)
-                    ],
-                },
+            if item is not None:
+                yield item
+
+        with self.profiler.stage("css_select"):
+            next_url = (
+                response.css("link[rel='next']::attr(href)").get()
+                or response.css("a[rel='next']::attr(href)").get()
+                or response.css("a.pagination__item--next::attr(href)").get()
             )
+        if next_url:
+            next_request = self.render_request(response.urljoin(next_url), collection, page + 1)
+        else:
+            next_request = None
+            self.progress.short_page(collection["url"], page)
+        # Done with the DOM: hand the browser page to the next request or close it.
+        await self.governor.release(browser_page, next_request)
+        if next_request is not None:
+            yield next_request
+        self.progress.page_done(collection["url"])
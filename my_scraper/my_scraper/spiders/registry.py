@@ -0,0 +1,59 @@
+"""
+Spiders generated from the source registry (``SOURCES_FILE``, see
+:mod:`my_scraper.sources`). Scrapy's spider loader picks them up from this
+module like hand-written spiders.
+
+A malformed source is logged and left out; an unreadable registry is logged
+and leaves no registry spiders. Either way the spider loader (``scrapy
+list``, ``scrapy crawl`` of the other spiders) keeps working;
+``run_all_spiders`` loads the registry itself and refuses to start.
+"""
+
+import logging
+import tomllib
+
+from scrapy.utils.project import get_project_settings
+
+from ..sources import load_sources
+from .product_spider import RenderFallbackSpider
+from .shopify_spider import ShopifyCollectionSpider
+
+logger = logging.getLogger(__name__)
+
+
+def spider_class(source):
+    """A spider class for one :class:`~my_scraper.sources.Source`."""
+    base = RenderFallbackSpider if source.renders else ShopifyCollectionSpider
+    attrs = {
+        "__module__": __name__,
+        "__doc__": f"{source.brand} ({source.type} source from the registry).",
+        "name": source.name,
+        "brand": source.brand,
+        "collections": [dict(collection) for collection in source.collections],
+        "custom_settings": {**base.custom_settings, **source.settings},
+    }
+    if source.type == "rendered":
+        attrs["force_render"] = True
+    for key in ("throttle_profile", "render_wait_for", "card_selector"):
+        value = getattr(source, key)
+        if value:
+            attrs[key] = value
+    class_name = "".join(part.title() for part in source.name.split("_")) + "Spider"
+    return type(class_name, (base,), attrs)
+
+
+def _generate(settings):
+    try:
+        sources = load_sources(settings.get("SOURCES_FILE"), on_error=_skip_source)
+    except (OSError, tomllib.TOMLDecodeError) as exc:
+        logger.error(f"Source registry not loaded, no registry spiders: {exc}")
+        return {}
+    return {source.name: spider_class(source) for source in sources}
+
+
+def _skip_source(message):
+    logger.error(f"Source registry: {message}; spider not generated")
+
+
+SPIDERS = _generate(get_project_settings())
+globals().update({cls.__name__: cls for cls in SPIDERS.values()})
@@ -1,7 +1,10 @@
+import argparse
+import gzip
 import json
 import os
 import subprocess
 import sys
+import time
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 try:
@@ -13,8 +16,24 @@ except ImportError:  # pragma: no cover
 BASE_DIR = Path(__file__).resolve().parents[2]
 ROOT_DIR = BASE_DIR.parent
 FEED_DIR = BASE_DIR  # feeds are written in the scrapy project root
+METRICS_DIR = BASE_DIR / "metrics"  # METRICS_DIR setting, relative to the project root
+CHANGES_DIR = BASE_DIR / "changes"  # CHANGES_DIR setting, relative to the project root
+PROFILE_DIR = BASE_DIR / "profiles"  # PROFILE_DIR setting, relative to the project root
+PROFILE_EXTRAS = {  # --profile extras -> settings
+    "cprofile": {"PROFILE_CPROFILE": True},
+    "stacks": {"PROFILE_SAMPLE_INTERVAL": 0.005},
+    "tracemalloc": {"PROFILE_TRACEMALLOC": True},
+}
 SUMMARY_FILE = ROOT_DIR / "last-scrape.json"
 ENV_FILE = ROOT_DIR / ".env"
+FEED_MODES = ("json", "jsonl", "jsonl.gz")  # SCRAPE_FEED_MODES in settings.py
+RUN_LOCKED_EXIT = 75  # EX_TEMPFAIL: another run holds the run lock (the admin route answers 409)
+UNFINISHED = ("running", "pending")  # statuses of spiders in an in-progress summary
+
+
+def wrote_feed(status: str) -> bool:
+    """False for spiders that have not run (yet), whose feed file is from an earlier run."""
+    return status not in UNFINISHED and not status.startswith("skipped")
 
 
 def load_env_file(path: Path):
@@ -31,18 +50,102 @@ def load_env_file(path: Path):
         os.environ.setdefault(key, val)
 
 
+def feed_mode() -> str:
+    return os.environ.get("SCRAPE_FEED_MODE", "json")
+
+
+def feed_file(spider_name: str) -> str:
+    return f"{spider_name}.{feed_mode()}"
+
+
 def load_feed_count(spider_name: str) -> int:
-    feed_path = FEED_DIR / f"{spider_name}.json"
+    """
+    Count items in a feed file. Only used when neither the crawler stats nor
+    the spider's metrics file (a subprocess run without CrawlMetrics) give
+    the item count.
+    """
+    feed_path = FEED_DIR / feed_file(spider_name)
     try:
-        with open(feed_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return len(data) if isinstance(data, list) else 0
+        if feed_mode() == "json":
+            with open(feed_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return len(data) if isinstance(data, list) else 0
+        opener = gzip.open if feed_path.suffix == ".gz" else open
+        with opener(feed_path, "rt", encoding="utf-8") as f:
+            return sum(1 for line in f if line.strip())
     except Exception:
         return 0
 
 
-def write_summary(spider_statuses: dict, source: str = "run_all_spiders"):
-    total_count = sum(load_feed_count(name) for name in spider_statuses.keys())
+def load_metrics(scrape_run_id: str) -> dict:
+    """Summarise the per-spider files written by the CrawlMetrics extension for this run."""
+    summary = {}
+    run_dir = METRICS_DIR / scrape_run_id if scrape_run_id else None
+    if not run_dir or not run_dir.is_dir():
+        return summary
+    for path in sorted(run_dir.glob("*.json")):
+        try:
+            metrics = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        summary[metrics.get("spider", path.stem)] = {
+            key: metrics.get(key)
+            for key in (
+                "finish_reason",
+                "feed",
+                "elapsed_seconds",
+                "requests",
+                "bytes_downloaded",
+                "items",
+                "items_per_second",
+                "peak_rss_bytes",
+            )
+        }
+    return summary
+
+
+def load_changes(scrape_run_id: str) -> dict:
+    """The per-spider change counts written by the ChangeDetector extension for this run."""
+    summary = {}
+    run_dir = CHANGES_DIR / scrape_run_id if scrape_run_id else None
+    if not run_dir or not run_dir.is_dir():
+        return summary
+    for path in sorted(run_dir.glob("*.json")):
+        try:
+            changes = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        summary[changes.get("spider", path.stem)] = {
+            key: changes.get(key)
+            for key in (
+                "added",
+                "changed",
+                "removed",
+                "price_changed",
+                "image_changed",
+                "baseline",
+                "removals_checked",
+                "changes_file",
+            )
+        }
+    return summary
+
+
+def write_summary(spider_statuses: dict, source: str = "run_all_spiders", counts: dict = None,
+                  scrape_run_id: str = None, feed_kinds: dict = None, sources: dict = None,
+                  budget=None, in_progress: bool = False):
+    """
+    Write last-scrape.json. With ``in_progress`` the run is still going: the
+    status is ``"running"``. Spiders still ``running``/``pending``, or skipped,
+    are left out of ``sources`` so import-products.js never reads their feeds.
+    """
+    counts = counts or {}
+    feed_kinds = feed_kinds or {}
+    spider_counts = {
+        name: counts[name] if name in counts else load_feed_count(name) if wrote_feed(status) else 0
+        for name, status in spider_statuses.items()
+    }
+    total_count = sum(spider_counts.values())
     overall_ok = all(status == "success" for status in spider_statuses.values())
     # Prefer tz database; fallback to UTC+8 if tzdata is missing
     if ZoneInfo:
@@ -56,46 +159,224 @@ def write_summary(spider_statuses: dict, source: str = "run_all_spiders"):
     ts_display = now_kl.strftime("%d/%m/%Y %H:%M:%S %Z")
     ts_utc = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
     payload = {
-        "status": "success" if overall_ok else "partial",
+        "status": "running" if in_progress else "success" if overall_ok else "partial",
         "timestamp": ts_display,
         "timestamp_utc": ts_utc,
         "source": source,
         "spiders": spider_statuses,
         "count": total_count,
+        "counts": spider_counts,
+        "feeds": {name: feed_file(name) for name in spider_statuses.keys()},
+    }
+    if sources:
+        # import-products.js takes its spider list, brands and brand categories from here.
+        payload["sources"] = {
+            name: {"brand": sources[name].brand, "category": sources[name].category, "type": sources[name].type}
+            for name, status in spider_statuses.items() if name in sources and wrote_feed(status)
+        }
+    if budget is not None and budget.limited:
+        payload["budget"] = budget.summary()
+    if scrape_run_id:
+        payload["scrape_run_id"] = scrape_run_id
+        payload["metrics"] = load_metrics(scrape_run_id)
+        if payload["metrics"]:
+            payload["metrics_dir"] = str((METRICS_DIR / scrape_run_id).relative_to(ROOT_DIR))
+        # Added/changed/removed products per spider; the lists are in changes_dir.
+        payload["changes"] = load_changes(scrape_run_id)
+        if payload["changes"]:
+            payload["changes_dir"] = str((CHANGES_DIR / scrape_run_id).relative_to(ROOT_DIR))
+        if (PROFILE_DIR / scrape_run_id).is_dir():
+            payload["profile_dir"] = str((PROFILE_DIR / scrape_run_id).relative_to(ROOT_DIR))
+    # import-products.js only marks products missing from "complete" feeds as removed;
+    # Shopify delta runs write "delta" feeds with just the changed products.
+    metrics = payload.get("metrics", {})
+    payload["feed_kinds"] = {
+        name: feed_kinds.get(name) or metrics.get(name, {}).get("feed") or "unknown"
+        for name in spider_statuses.keys()
     }
     SUMMARY_FILE.write_text(json.dumps(payload, indent=2), encoding="utf-8")
 
 
-def main():
-    load_env_file(ENV_FILE)
+class RunBudget:
+    """
+    Wall-clock limits of a run: ``run_seconds`` for the whole run and
+    ``spider_seconds[name]`` per spider (None or 0: no limit). A spider gets
+    whichever runs out first from the moment it starts, as its
+    ``CLOSESPIDER_TIMEOUT``, and is stopped ``grace`` seconds after that.
+    """
 
-    now = datetime.now()
-    scrape_time = now.isoformat()
-    scrape_run_id = now.strftime("%Y%m%d_%H%M%S")
+    def __init__(self, run_seconds=0, spider_seconds=None, grace=60):
+        self.run_seconds = run_seconds or None
+        self.spider_seconds = {name: s for name, s in (spider_seconds or {}).items() if s}
+        self.grace = grace
+        self.started = time.monotonic()
+
+    @property
+    def limited(self):
+        return self.run_seconds is not None or bool(self.spider_seconds)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """Seconds left in the run, or None without a run budget."""
+        if self.run_seconds is None:
+            return None
+        return max(0.0, self.run_seconds - self.elapsed())
+
+    def exhausted(self):
+        return self.remaining() == 0
+
+    def limit(self, spider):
+        """Seconds ``spider`` may crawl if it starts now, or None."""
+        limits = [s for s in (self.spider_seconds.get(spider), self.remaining()) if s is not None]
+        # CLOSESPIDER_TIMEOUT = 0 would mean "no timeout".
+        return max(1.0, round(min(limits), 1)) if limits else None
+
+    def summary(self):
+        return {
+            "run_seconds": self.run_seconds,
+            "spider_seconds": self.spider_seconds,
+            "elapsed_seconds": round(self.elapsed(), 1),
+        }
+
+
+# Close reasons that mean the spider's output never reached the database.
+FAILED_REASONS = ("db_pool_exhausted",)
+
+
+def finish_status(reason) -> str:
+    """
+    Status of a spider that exited cleanly: ``"partial"`` when it was closed
+    early (``closespider_timeout`` from its budget, ``shutdown``, ...).
+    """
+    if reason in FAILED_REASONS:
+        return f"failed ({reason})"
+    return "success" if reason in (None, "finished") else "partial"
+
+
+def project_settings():
+    """Scrapy project settings; feeds and scrapy.cfg are resolved relative to the project root."""
+    os.chdir(BASE_DIR)
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "my_scraper.settings")
+
+    from scrapy.utils.project import get_project_settings
+
+    return get_project_settings()
+
+
+def spider_overrides(settings, run_state, spider: str, resume: bool) -> dict:
+    """
+    Per-spider settings for a run with job state: the spider's JOBDIR and, when
+    resuming a spider that had started, ``RUN_RESUME`` and a feed appended to
+    instead of overwritten (a JSON array cannot be appended to, so that feed
+    only holds the resumed part and is reported as ``partial``).
+    """
+    if run_state is None:
+        return {}
+    overrides = {"JOBDIR": run_state.jobdir(spider)}
+    if resume and run_state.spider(spider):
+        overrides["RUN_RESUME"] = True
+        if feed_mode() != "json":
+            overrides["FEEDS"] = {
+                uri: {**options, "overwrite": False}
+                for uri, options in settings.getdict("FEEDS").items()
+            }
+    return overrides
+
+
+def worker_overrides(settings, tag: str) -> dict:
+    """
+    Settings for a ``--worker`` process: feeds, metrics and profiles of its
+    own (``<spider>.<tag>.<ext>``), COPY staging tables of its own, and none
+    of the run state or change detection, which belong to the run that holds
+    the lock.
+    """
+    return {
+        "FEEDS": {
+            uri.replace("%(name)s", f"%(name)s.{tag}"): options
+            for uri, options in settings.getdict("FEEDS").items()
+        },
+        "METRICS_DIR": os.path.join(settings.get("METRICS_DIR", "metrics"), "workers", tag),
+        "PROFILE_DIR": os.path.join(settings.get("PROFILE_DIR", "profiles"), "workers", tag),
+        "DB_STAGING_SUFFIX": tag,
+        "RUN_STATE_ENABLED": False,
+        "CHANGES_ENABLED": False,
+    }
+
+
+def profile_settings(profile: str) -> dict:
+    """Settings for ``--profile [cprofile,stacks,tracemalloc]``; the stage timings are always on."""
+    settings = {"PROFILE_ENABLED": True}
+    for extra in filter(None, (part.strip() for part in profile.split(","))):
+        if extra != "stages":
+            settings.update(PROFILE_EXTRAS[extra])
+    return settings
+
+
+def setting_args(overrides: dict) -> list:
+    """``-s NAME=VALUE`` options for ``scrapy crawl``; dicts are passed as JSON."""
+    args = []
+    for name, value in overrides.items():
+        if isinstance(value, dict):
+            value = json.dumps(value)
+        args += ["-s", f"{name}={value}"]
+    return args
+
+
+def _wait(proc, spider: str, deadline, grace: float):
+    """
+    Wait for a ``scrapy crawl`` process. Past ``deadline`` seconds it is asked
+    to shut down (SIGTERM, which Scrapy handles like Ctrl-C: the feeds are
+    closed; on Windows it ends the process outright) and killed if it is
+    still running ``grace`` seconds later.
+    Returns ``(returncode, killed)``.
+    """
+    try:
+        return proc.wait(timeout=deadline), False
+    except subprocess.TimeoutExpired:
+        print(f"[WARN] Spider {spider} is over its time budget; stopping it")
+        proc.terminate()
+    try:
+        return proc.wait(timeout=grace), False
+    except subprocess.TimeoutExpired:
+        print(f"[ERROR] Spider {spider} did not stop within {grace}s; killing it")
+        proc.kill()
+        return proc.wait(), True
 
-    print("======================================")
-    print("ADMIN SCRAPE STARTED")
-    print(f"Scrape Run ID : {scrape_run_id}")
-    print(f"Scrape Time   : {scrape_time}")
-    print("======================================")
 
-    spiders = [
-        "products",      # Aegis / LocalLab
-        "tomaz",         # Tomaz
-        "smart_master",  # SmartMaster
-    ]
+def run_subprocesses(spiders, scrape_time: str, scrape_run_id: str, reconcile: bool = False,
+                     overrides: dict = None, budget: RunBudget = None, on_finished=None):
+    """
+    Run each spider in its own ``scrapy crawl`` process, one after another, in
+    the given order. With a ``budget`` every spider gets its remaining share
+    as ``CLOSESPIDER_TIMEOUT``, and spiders left when the run budget is spent
+    are skipped. ``on_finished(statuses, counts)`` is called after every spider.
 
+    Returns ``(statuses, counts, feed_kinds)``; item counts and feed kinds
+    come from the metrics file each ``scrapy crawl`` writes (CrawlMetrics).
+    """
+    overrides = overrides or {}
+    budget = budget or RunBudget()
     env = os.environ.copy()
     env["PYTHONIOENCODING"] = "utf-8"
     env["PYTHONPATH"] = os.pathsep.join([str(BASE_DIR), env.get("PYTHONPATH", "")]).strip(os.pathsep)
 
-    statuses = {}
-    had_failure = False
-
+    statuses, counts, feed_kinds = {}, {}, {}
     for spider in spiders:
-        print(f"\nRunning spider: {spider}")
+        if budget.exhausted():
+            statuses[spider] = "skipped (run budget)"
+            print(f"[WARN] Run budget spent; skipping spider {spider}")
+            continue
+        limit = budget.limit(spider)
+        spider_overrides = dict(overrides.get(spider, {}))
+        if limit is not None:
+            spider_overrides["CLOSESPIDER_TIMEOUT"] = limit
+        print(f"\nRunning spider: {spider}" + (f" (budget {limit}s)" if limit is not None else ""))
         try:
-            subprocess.run(
+            proc = subprocess.Popen(
                 [
                     sys.executable,
                     "-m",
@@ -104,22 +385,376 @@ def main():
                     spider,
                     "-a",
                     f"scrape_time={scrape_time}",
+                    "-a",
+                    f"scrape_run_id={scrape_run_id}",
+                    *(["-a", "reconcile=1"] if reconcile else []),
+                    *setting_args(spider_overrides),
                 ],
-                check=True,
                 cwd=str(BASE_DIR),
                 env=env,
             )
-            statuses[spider] = "success"
-        except subprocess.CalledProcessError as exc:
-            had_failure = True
-            statuses[spider] = f"failed (exit {exc.returncode})"
-            print(f"[ERROR] Spider {spider} failed with exit code {exc.returncode}")
+            # Scrapy start-up is not part of CLOSESPIDER_TIMEOUT, hence the grace period.
+            returncode, killed = _wait(proc, spider, limit + budget.grace if limit is not None else None, budget.grace)
+            # Written when the spider closed; a killed process never got that far.
+            metrics = {} if killed else load_metrics(scrape_run_id).get(spider, {})
+            if metrics.get("items") is not None:
+                counts[spider] = metrics["items"]
+            if metrics.get("feed"):
+                feed_kinds[spider] = metrics["feed"]
+            if killed:
+                statuses[spider] = "failed (killed over time budget)"
+            elif returncode:
+                statuses[spider] = f"failed (exit {returncode})"
+                print(f"[ERROR] Spider {spider} failed with exit code {returncode}")
+            else:
+                statuses[spider] = finish_status(metrics.get("finish_reason"))
         except Exception as exc:  # pragma: no cover - defensive
-            had_failure = True
             statuses[spider] = f"failed ({exc})"
             print(f"[ERROR] Spider {spider} failed: {exc}")
+        if on_finished is not None:
+            on_finished(statuses, counts)
+    return statuses, counts, feed_kinds
+
+
+def run_in_process(spiders, scrape_time: str, scrape_run_id: str, reconcile: bool = False,
+                   overrides: dict = None, budget: RunBudget = None, on_finished=None):
+    """
+    Run all spiders concurrently on a single reactor with CrawlerProcess.
+
+    The spiders hit different domains, so the run takes roughly as long as the
+    slowest one, and Scrapy/Twisted/Playwright start up only once. With a
+    ``budget`` each spider gets ``CLOSESPIDER_TIMEOUT`` and is stopped if it
+    is still crawling ``budget.grace`` seconds after that.
+    ``on_finished(statuses, counts)`` is called as each spider finishes.
+
+    Returns ``(statuses, counts, feed_kinds)``; item counts come from each
+    crawler's ``item_scraped_count`` stat, so the feeds never have to be re-read.
+    """
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.defer import deferred_from_coro
+
+    overrides = overrides or {}
+    budget = budget or RunBudget()
+    process = CrawlerProcess(project_settings())
+    statuses = {}
+    crawlers = {}
+
+    def finished_counts():
+        return {
+            spider: crawlers[spider].stats.get_value("item_scraped_count", 0)
+            for spider in statuses if spider in crawlers
+        }
+
+    def on_success(_, spider):
+        reason = crawlers[spider].stats.get_value("finish_reason")
+        statuses[spider] = finish_status(reason)
+        print(f"Spider {spider} finished ({reason})")
+        if on_finished is not None:
+            on_finished(statuses, finished_counts())
+
+    def on_failure(failure, spider):
+        statuses[spider] = f"failed ({failure.getErrorMessage()})"
+        print(f"[ERROR] Spider {spider} failed: {failure.getErrorMessage()}")
+        if on_finished is not None:
+            on_finished(statuses, finished_counts())
+
+    def stop_after(crawler, spider, seconds):
+        """Stop ``crawler`` if it is still crawling ``seconds`` after its spider opened."""
+        def stop():
+            if crawler.crawling:
+                print(f"[WARN] Spider {spider} is over its time budget; stopping it")
+                deferred_from_coro(crawler.stop_async())
+
+        def arm(spider):
+            # The reactor is only installed once the crawl starts.
+            from twisted.internet import reactor
+
+            reactor.callLater(seconds, stop)
+
+        crawler.signals.connect(arm, signal=signals.spider_opened, weak=False)
+
+    for spider in spiders:
+        limit = budget.limit(spider)
+        print(f"\nScheduling spider: {spider}" + (f" (budget {limit}s)" if limit is not None else ""))
+        try:
+            crawler = process.create_crawler(spider)
+            for name, value in overrides.get(spider, {}).items():
+                crawler.settings.set(name, value, priority="cmdline")
+            if crawler.settings.get("DB_COMMIT_POLICY") == "close":
+                # Every spider holds a pooled connection until it closes.
+                pool_size = max(crawler.settings.getint("DB_POOL_MAXCONN", 4), len(spiders))
+                crawler.settings.set("DB_POOL_MAXCONN", pool_size, priority="cmdline")
+            if limit is not None:
+                crawler.settings.set("CLOSESPIDER_TIMEOUT", limit, priority="cmdline")
+                stop_after(crawler, spider, limit + budget.grace)
+            crawlers[spider] = crawler
+            kwargs = {"scrape_time": scrape_time, "scrape_run_id": scrape_run_id}
+            if reconcile:
+                kwargs["reconcile"] = "1"
+            d = process.crawl(crawler, **kwargs)
+        except Exception as exc:
+            statuses[spider] = f"failed ({exc})"
+            print(f"[ERROR] Spider {spider} failed to start: {exc}")
+            continue
+        d.addCallbacks(on_success, on_failure, callbackArgs=(spider,), errbackArgs=(spider,))
+
+    process.start()
+    if process.bootstrap_failed:
+        for spider in spiders:
+            statuses.setdefault(spider, "failed (bootstrap)")
+    counts = {
+        spider: crawler.stats.get_value("item_scraped_count", 0)
+        for spider, crawler in crawlers.items()
+    }
+    feed_kinds = {
+        spider: getattr(crawler.spider, "feed_kind", "complete")
+        for spider, crawler in crawlers.items()
+        if crawler.spider is not None
+    }
+    # Preserve the configured order in the summary.
+    return {spider: statuses.get(spider, "failed (did not finish)") for spider in spiders}, counts, feed_kinds
+
+
+def run_worker(args, settings, sources: dict, spider_budget: float) -> int:
+    """
+    ``--worker``: crawl the spiders of the run that holds the run lock,
+    sharing its frontier. The lock holder writes last-scrape.json; the worker
+    only reports its own statuses. Returns the exit code.
+    """
+    from my_scraper.frontier import RunLock, worker_id
+
+    if not settings.get("FRONTIER_BACKEND"):
+        print("[ERROR] --worker needs a shared frontier (FRONTIER_BACKEND or $SCRAPE_FRONTIER).")
+        return 2
+    lock = RunLock(settings, settings.get("RUN_LOCK_NAME"), settings.getfloat("RUN_LOCK_TTL", 600))
+    holder = lock.holder()
+    if holder is None:
+        print(f"[ERROR] No run in progress to join ({args.scrape_run_id}); start run_all_spiders without --worker.")
+        return 1
+
+    spiders = list(sources)
+    tag = worker_id().replace(":", "-")
+    print("======================================")
+    print("ADMIN SCRAPE WORKER")
+    print(f"Scrape Run ID : {args.scrape_run_id}")
+    print(f"Run lock      : {holder}")
+    print(f"Worker        : {tag}")
+    print(f"Order         : {', '.join(spiders)}")
+    print("======================================")
+    budget = RunBudget(
+        run_seconds=args.run_budget if args.run_budget is not None else settings.getfloat("RUN_TIME_BUDGET"),
+        spider_seconds={spider: sources[spider].time_budget or spider_budget for spider in spiders},
+        grace=settings.getfloat("RUN_BUDGET_GRACE", 60),
+    )
+    overrides = {spider: worker_overrides(settings, tag) for spider in spiders}
+    if args.profile:
+        for spider in spiders:
+            overrides[spider].update(profile_settings(args.profile))
+    statuses, counts, _ = run_in_process(
+        spiders, datetime.now().isoformat(), args.scrape_run_id, args.reconcile, overrides, budget,
+    )
+    print("\nWORKER DONE")
+    for spider, status in statuses.items():
+        print(f"{spider}: {status} ({counts.get(spider, 0)} items)")
+    failed = any(
+        status not in ("success", "partial") and not status.startswith("skipped")
+        for status in statuses.values()
+    )
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run all product spiders and write last-scrape.json")
+    parser.add_argument(
+        "--mode",
+        choices=("in-process", "subprocess"),
+        default="in-process",
+        help="run spiders concurrently in this process (default) or one scrapy subprocess each",
+    )
+    parser.add_argument("--scrape_run_id", default=None, help="run id stamped on every item")
+    parser.add_argument(
+        "--feed-mode",
+        choices=FEED_MODES,
+        default=None,
+        help="feed format (default: $SCRAPE_FEED_MODE or json)",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="force a full Shopify crawl whose feeds also retire products gone from the stores",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted run (--scrape_run_id, default: the latest one), "
+             "skipping the spiders that already finished",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="join the run in progress (--scrape_run_id) on the shared frontier (FRONTIER_BACKEND) "
+             "as an extra worker: no run lock, no last-scrape.json, feeds named <spider>.<worker>.<ext>",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="stages",
+        default=None,
+        metavar="EXTRAS",
+        help="time every stage (download, parse, pipelines, DB) into profiles/<scrape_run_id>/; "
+             f"optionally also {','.join(PROFILE_EXTRAS)} (comma-separated)",
+    )
+    parser.add_argument(
+        "--spider-budget",
+        type=float,
+        default=None,
+        help="seconds each spider may crawl before it is closed as partial "
+             "(default: SPIDER_TIME_BUDGET; a source's time_budget wins)",
+    )
+    parser.add_argument(
+        "--run-budget",
+        type=float,
+        default=None,
+        help="seconds the whole run may take (default: RUN_TIME_BUDGET)",
+    )
+    args = parser.parse_args(argv)
+    if args.worker and (args.resume or args.mode != "in-process" or not args.scrape_run_id):
+        parser.error("--worker needs --scrape_run_id and runs in-process, without --resume")
+    if args.profile:
+        unknown = {part.strip() for part in args.profile.split(",")} - set(PROFILE_EXTRAS) - {"stages", ""}
+        if unknown:
+            parser.error(f"unknown --profile extras: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_env_file(ENV_FILE)
+    if args.feed_mode:
+        os.environ["SCRAPE_FEED_MODE"] = args.feed_mode
+    if feed_mode() not in FEED_MODES:
+        print(f"[ERROR] Unknown SCRAPE_FEED_MODE {feed_mode()!r}; expected one of {', '.join(FEED_MODES)}.")
+        sys.exit(2)
+
+    settings = project_settings()
+    from my_scraper.frontier import RunLock
+    from my_scraper.runstate import RunState
+    from my_scraper.sources import load_sources, run_order
+
+    # Every enabled source in the registry, cheapest (or highest priority) first.
+    try:
+        sources = {source.name: source for source in run_order(load_sources(settings.get("SOURCES_FILE")))}
+    except (OSError, ValueError) as exc:
+        print(f"[ERROR] Source registry: {exc}")
+        sys.exit(2)
+    spiders = list(sources)
+    spider_budget = args.spider_budget if args.spider_budget is not None else settings.getfloat("SPIDER_TIME_BUDGET")
+
+    if args.worker:
+        sys.exit(run_worker(args, settings, sources, spider_budget))
+
+    lock = RunLock(settings, settings.get("RUN_LOCK_NAME"), settings.getfloat("RUN_LOCK_TTL", 600))
+    if not lock.acquire():
+        print(f"[ERROR] Another scrape is already running ({lock.holder()}); not starting.")
+        sys.exit(RUN_LOCKED_EXIT)
+    try:
+        run_state = None
+        if args.resume:
+            if args.scrape_run_id:
+                run_state = RunState.for_run(settings, args.scrape_run_id)
+            else:
+                run_state = RunState.latest(settings)
+            if run_state is None or not run_state.exists():
+                print(f"[ERROR] No run state to resume ({args.scrape_run_id or 'no runs recorded'}).")
+                sys.exit(1)
+            run = run_state.read_run()
+            scrape_run_id, scrape_time = run["scrape_run_id"], run["scrape_time"]
+            spiders = [spider for spider in spiders if spider in run.get("spiders", spiders)]
+        else:
+            now = datetime.now()
+            scrape_time = now.isoformat()
+            scrape_run_id = args.scrape_run_id or now.strftime("%Y%m%d_%H%M%S")
+            if settings.getbool("RUN_STATE_ENABLED"):
+                RunState.prune(settings, settings.getfloat("RUN_STATE_RETENTION_DAYS", 7), keep=(scrape_run_id,))
+                run_state = RunState.for_run(settings, scrape_run_id)
+                run_state.write_run(scrape_run_id=scrape_run_id, scrape_time=scrape_time, spiders=spiders)
+
+        finished = [spider for spider in spiders if args.resume and run_state.finished(spider)]
+        pending = [spider for spider in spiders if spider not in finished]
+
+        print("======================================")
+        print("ADMIN SCRAPE RESUMED" if args.resume else "ADMIN SCRAPE STARTED")
+        print(f"Scrape Run ID : {scrape_run_id}")
+        print(f"Scrape Time   : {scrape_time}")
+        print(f"Mode          : {args.mode}")
+        print(f"Feed format   : {feed_mode()}")
+        if settings.getbool("SHOPIFY_WATERMARK_ENABLED"):
+            print(f"Reconcile     : {'forced' if args.reconcile else 'when due'}")
+        budget = RunBudget(
+            run_seconds=args.run_budget if args.run_budget is not None else settings.getfloat("RUN_TIME_BUDGET"),
+            spider_seconds={spider: sources[spider].time_budget or spider_budget for spider in pending},
+            grace=settings.getfloat("RUN_BUDGET_GRACE", 60),
+        )
+        print(f"Order         : {', '.join(pending)}")
+        if budget.limited:
+            limits = [f"{spider} {seconds:g}s" for spider, seconds in budget.spider_seconds.items()]
+            print(f"Budget        : run {f'{budget.run_seconds:g}s' if budget.run_seconds else 'unlimited'}"
+                  + (f"; {', '.join(limits)}" if limits else ""))
+        if finished:
+            print(f"Already done  : {', '.join(finished)}")
+        print("======================================")
+
+        def write_progress(done: dict, done_counts: dict):
+            """Early summary as each spider finishes, so the admin page sees progress."""
+            current = {}
+            for spider in spiders:
+                if spider in done:
+                    current[spider] = done[spider]
+                elif spider in finished:
+                    current[spider] = "success"
+                elif args.mode == "in-process" or "running" not in current.values():
+                    current[spider] = "running"
+                else:
+                    current[spider] = "pending"
+            write_summary(current, counts=done_counts, scrape_run_id=scrape_run_id, sources=sources,
+                          budget=budget, in_progress=True)
+
+        write_progress({}, {})
+        overrides = {spider: spider_overrides(settings, run_state, spider, args.resume) for spider in pending}
+        if args.profile:
+            for spider in pending:
+                overrides[spider].update(profile_settings(args.profile))
+        if args.mode == "subprocess":
+            statuses, counts, feed_kinds = run_subprocesses(
+                pending, scrape_time, scrape_run_id, args.reconcile, overrides, budget, write_progress,
+            )
+        else:
+            statuses, counts, feed_kinds = run_in_process(
+                pending, scrape_time, scrape_run_id, args.reconcile, overrides, budget, write_progress,
+            )
+    finally:
+        lock.release()
+    # Spiders cut short by a budget still have usable (partial) feeds to import.
+    had_failure = any(
+        status not in ("success", "partial") and not status.startswith("skipped")
+        for status in statuses.values()
+    )
+
+    if run_state is not None:
+        # Item counts and feed kinds over all attempts of the run.
+        for spider in spiders:
+            recorded = run_state.spider(spider)
+            if spider in finished:
+                statuses[spider] = "success"
+            if "items" in recorded:
+                counts[spider] = recorded["items"]
+            if recorded.get("feed"):
+                feed_kinds[spider] = recorded["feed"]
+        statuses = {spider: statuses[spider] for spider in spiders}
 
-    write_summary(statuses)
+    write_summary(statuses, counts=counts, scrape_run_id=scrape_run_id, feed_kinds=feed_kinds,
+                  sources=sources, budget=budget)
 
     print("\nALL SPIDERS COMPLETED")
     print(f"Final Scrape Run ID: {scrape_run_id}")
@@ -0,0 +1,351 @@
+import scrapy
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlencode, urljoin
+
+from ..items import ProductItem, ProductVariant, RunInfo
+from ..profiling import StageProfiler
+from ..progress import CollectionProgress, SharedProgress
+from ..signals import products_seen
+from ..watermarks import WatermarkStore, parse_updated_at
+
+
+class ShopifyCollectionSpider(scrapy.Spider):
+    """
+    Base spider for Shopify stores that expose ``/collections/<handle>/products.json``.
+
+    Subclasses set ``name``, ``brand`` and ``collections``; the spiders in
+    :mod:`my_scraper.spiders.registry` are generated from the source registry:
+
+        collections = [
+            {"url": "https://example.com/collections/shirts", "category": "casual"},
+        ]
+
+    Pages are fetched with a look-ahead window (``SHOPIFY_PAGE_WINDOW``): once a
+    full page comes back, the following pages are requested together instead of
+    one after another. The first empty or short page marks the end of the
+    collection and no further pages are scheduled for it.
+
+    With ``SHOPIFY_WATERMARK_ENABLED`` the spider runs in one of two modes:
+
+    * ``"delta"``: products whose ``updated_at`` is not newer than the
+      collection's watermark from the last complete run are not emitted;
+      they are announced through ``products_seen`` instead, so
+      DbStorePipeline only refreshes their scrapedAt.
+    * ``"reconcile"``: every product is emitted, so a run that saw every page
+      writes a ``"complete"`` feed and ``import-products.js`` marks this
+      brand's products that are no longer in any collection as removed. Used
+      on the first run, every ``SHOPIFY_RECONCILE_EVERY_DAYS`` days and with
+      ``-a reconcile=1``.
+
+    Without watermarks (the default) every run is a plain ``"full"`` crawl.
+    Watermarks only move forward for collections whose pages were all
+    fetched and parsed.
+
+    With ``INCREMENTAL_ENABLED`` the ``"delta"`` and ``"full"`` runs send
+    conditional requests for the products.json pages; a page that did not
+    change is replayed from the summary :meth:`parse_products` left for it
+    (see :meth:`replay_page`). ``"reconcile"`` runs always fetch and parse
+    every page.
+
+    With a shared frontier (``FRONTIER_BACKEND``) the pagination progress
+    lives in the frontier as well (:class:`~my_scraper.progress.SharedProgress`):
+    workers running the same spider and run id page through the collections
+    together and use the crawl mode and watermarks of the first worker that
+    started. Each worker's feed only lists its own products, so a run shared
+    by several workers writes ``"partial"`` feeds and never retires products.
+    """
+
+    collections = []
+
+    # Stored on every item (ProductItem.brand).
+    brand = None
+
+    # AdaptiveThrottle profile for the products.json endpoints.
+    throttle_profile = "shopify_json"
+
+    custom_settings = {
+        "ROBOTSTXT_OBEY": True,
+        # Let the look-ahead window actually overlap on the JSON endpoints.
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 3,
+    }
+
+    page_size = 250  # Shopify products.json supports limit
+
+    # Attach variants to items (SHOPIFY_EMIT_VARIANTS); product-level
+    # prices and availability are filled in either way.
+    emit_variants = True
+
+    def __init__(self, scrape_time=None, scrape_run_id=None, reconcile=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.run = RunInfo.from_args(scrape_time, scrape_run_id)
+        self.scrape_time = self.run.scrape_time
+        self.scrape_date = self.run.scrape_date
+        self.scrape_run_id = self.run.scrape_run_id
+
+        self.force_reconcile = str(reconcile or "").lower() in ("1", "true", "yes")
+        self.mode = "full"
+        self.watermarks = None
+        self._watermarks = {}
+
+        self.progress = CollectionProgress()
+        self.resumed = False
+        # Set once a page is replayed by IncrementalSpiderMiddleware.
+        self.replayed = False
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.profiler = StageProfiler.for_crawler(crawler)
+        if crawler.settings.get("FRONTIER_BACKEND"):
+            spider.progress = SharedProgress.for_spider(spider, crawler.settings)
+        # Decided before the pipelines open so DbStorePipeline knows the mode.
+        if crawler.settings.getbool("SHOPIFY_WATERMARK_ENABLED"):
+            spider.watermarks = WatermarkStore.from_settings(crawler.settings, spider.name)
+            due = spider.watermarks.reconcile_due(crawler.settings.getfloat("SHOPIFY_RECONCILE_EVERY_DAYS", 7))
+            spider.mode = spider.progress.agree("mode", "reconcile" if spider.force_reconcile or due else "delta")
+        return spider
+
+    async def start(self):
+        self.page_window = max(1, self.settings.getint("SHOPIFY_PAGE_WINDOW", 3))
+        self.emit_variants = self.settings.getbool("SHOPIFY_EMIT_VARIANTS", True)
+        self.overlap = timedelta(seconds=self.settings.getfloat("SHOPIFY_WATERMARK_OVERLAP", 3600))
+        self.logger.info(f"Shopify crawl mode: {self.mode}")
+        self.crawler.stats.set_value("shopify/mode", self.mode)
+        state = getattr(self, "state", None)  # None without a JOBDIR
+        if state is not None and self.progress.restore(state):
+            self.resumed = True
+            self.logger.info("Resuming the collections from the job state")
+        for collection in self.collections:
+            # Empty when resumed, or when another worker already started the collection:
+            # its pending pages come back from the JOBDIR queue or the shared frontier.
+            for page in self.progress.claim_pages(collection["url"], 1):
+                yield self.page_request(collection, page)
+
+    def page_request(self, collection, page):
+        api_url = (
+            f"{collection['url']}/products.json?"
+            f"{urlencode({'limit': self.page_size, 'page': page})}"
+        )
+        self.progress.page_started(collection["url"])
+        return scrapy.Request(
+            api_url,
+            callback=self.parse_products,
+            errback=self.page_failed,
+            cb_kwargs={
+                "page": page,
+                "collection": collection,
+            },
+            # A reconcile run has to emit every product, so it cannot take
+            # unchanged pages from the incremental store.
+            meta={"dont_incremental": self.mode == "reconcile"},
+        )
+
+    def parse_products(self, response, page, collection):
+        base_url = collection["url"]
+        with self.profiler.stage("json_decode"):
+            data = response.json()
+        products = data.get("products", [])
+
+        threshold = self.watermark_threshold(base_url)
+        seen = []
+        page_urls = []
+        page_newest = None
+        for product in products:
+            url = urljoin(base_url, f"/products/{product['handle']}") if product.get("handle") else None
+            if url:
+                page_urls.append(url)
+            updated_at = parse_updated_at(product.get("updated_at"))
+            if updated_at is not None:
+                if page_newest is None or updated_at > page_newest:
+                    page_newest = updated_at
+                if threshold is not None and updated_at <= threshold and url:
+                    seen.append(url)
+                    continue
+            with self.profiler.stage("build_item"):
+                item = self.build_item(product, collection)
+            if item is not None:
+                yield item
+
+        self.progress.saw_updated_at(base_url, page_newest)
+        if seen:
+            self.crawler.stats.inc_value("shopify/unchanged_skipped", len(seen))
+            self.crawler.signals.send_catch_log(signal=products_seen, urls=seen, spider=self)
+
+        yield from self.next_page_requests(collection, page, len(products))
+        # Only a page whose output was fully consumed counts as parsed.
+        self.progress.page_done(base_url)
+        # Recorded by IncrementalSpiderMiddleware for replay_page().
+        response.meta["incremental_page"] = {
+            "urls": page_urls,
+            "count": len(products),
+            "newest": page_newest,
+        }
+
+    def replay_page(self, response, summary):
+        """
+        Stand in for :meth:`parse_products` on a page that did not change
+        since it was last parsed: its products are announced through
+        ``products_seen`` and pagination carries on from the stored product
+        count.
+        """
+        page = response.request.cb_kwargs["page"]
+        collection = response.request.cb_kwargs["collection"]
+        base_url = collection["url"]
+        self.replayed = True
+
+        self.progress.saw_updated_at(base_url, summary["newest"])
+        if summary["urls"]:
+            self.crawler.stats.inc_value("shopify/unchanged_skipped", len(summary["urls"]))
+            self.crawler.signals.send_catch_log(signal=products_seen, urls=summary["urls"], spider=self)
+
+        yield from self.next_page_requests(collection, page, summary["count"])
+        self.progress.page_done(base_url)
+
+    def page_failed(self, failure):
+        collection = failure.request.cb_kwargs["collection"]
+        self.progress.page_failed(collection["url"])
+        self.crawler.stats.inc_value("shopify/failed_pages")
+        self.logger.error(f"Failed to fetch {failure.request.url}: {failure.getErrorMessage()}")
+
+    def watermark_threshold(self, collection_url):
+        """``updated_at`` at or below which products are skipped, or None to emit everything."""
+        if self.mode != "delta":
+            return None
+        watermark = self.watermark(collection_url)
+        # The overlap re-emits products updated while the previous run was
+        # still paging through the collection.
+        return watermark - self.overlap if watermark is not None else None
+
+    def watermark(self, collection_url):
+        """The collection's watermark, as agreed by every worker of the run."""
+        if collection_url not in self._watermarks:
+            mark = self.watermarks.get(collection_url)
+            agreed = self.progress.agree(f"watermark {collection_url}", mark.isoformat() if mark else "")
+            self._watermarks[collection_url] = parse_updated_at(agreed)
+        return self._watermarks[collection_url]
+
+    def collection_complete(self, collection_url):
+        return self.progress.complete(collection_url)
+
+    @property
+    def complete(self):
+        """True when every page of every collection was fetched and parsed."""
+        return all(self.collection_complete(c["url"]) for c in self.collections)
+
+    @property
+    def feed_kind(self):
+        """``"complete"``, ``"partial"`` or ``"delta"``: whether the feed lists the whole catalogue."""
+        # Products on replayed pages were only announced, not emitted.
+        if self.mode == "delta" or self.replayed:
+            return "delta"
+        # Products other workers emitted are in their own feeds.
+        return "complete" if self.complete and self.progress.sole_worker else "partial"
+
+    @property
+    def reconciled(self):
+        """A reconcile run that saw everything: products it did not emit are gone."""
+        # A resumed run did not see what the interrupted attempt emitted.
+        return self.mode == "reconcile" and self.feed_kind == "complete" and not self.resumed
+
+    def closed(self, reason):
+        try:
+            self.save_watermarks(reason)
+        finally:
+            self.progress.close()
+
+    def save_watermarks(self, reason):
+        if self.watermarks is None:
+            return
+        done = {
+            url: newest for url, newest in self.progress.newest_seen().items()
+            if reason == "finished" and self.collection_complete(url)
+        }
+        self.watermarks.save(done, reconciled=reason == "finished" and self.reconciled)
+        self.logger.info(
+            f"Watermarks updated for {len(done)} of {len(self.collections)} collections "
+            f"(mode={self.mode}, feed={self.feed_kind})"
+        )
+
+    def next_page_requests(self, collection, page, count):
+        base_url = collection["url"]
+        if count < self.page_size:
+            self.progress.short_page(base_url, page)
+            return
+
+        # A full page: keep up to page_window pages in flight past this one.
+        last_page = self.progress.last_page(base_url)
+        upper = page + self.page_window
+        if last_page is not None:
+            upper = min(upper, last_page)
+        for next_page in self.progress.claim_pages(base_url, upper, after=page):
+            yield self.page_request(collection, next_page)
+
+    def build_item(self, product, collection):
+        title = product.get("title")
+        handle = product.get("handle") or ""
+        images = product.get("images") or []
+        src = images[0].get("src") if images else None
+        if src and not src.startswith(("https://", "http://")):
+            src = urljoin(collection["url"], src)  # protocol-relative CDN URLs
+        first_image = src or None
+
+        variants = product.get("variants") or []
+        prices = [price for price in (_decimal(v.get("price")) for v in variants) if price is not None]
+        tags = product.get("tags") or []
+        if isinstance(tags, str):  # the Admin API returns a comma-separated string
+            tags = [tag.strip() for tag in tags.split(",")]
+        url = urljoin(collection["url"], f"/products/{handle}") if handle else None
+        try:
+            children = [self.build_variant(v) for v in variants] if self.emit_variants else None
+        except ValueError as exc:
+            return self.invalid_product(url or title, exc)
+
+        return self.product_item(
+            name=title,
+            image=first_image,
+            url=url,
+            category=collection.get("category"),
+            shopify_id=product.get("id"),
+            vendor=product.get("vendor") or None,
+            product_type=product.get("product_type") or None,
+            tags=[tag for tag in tags if tag],
+            price_min=str(min(prices)) if prices else None,
+            price_max=str(max(prices)) if prices else None,
+            available=any(v.get("available") for v in variants) if variants else None,
+            shopify_updated_at=product.get("updated_at") or None,
+            variants=children,
+        )
+
+    def build_variant(self, variant):
+        return ProductVariant(
+            shopify_id=variant.get("id"),
+            title=variant.get("title"),
+            sku=variant.get("sku") or None,
+            price=variant.get("price") or None,
+            compare_at_price=variant.get("compare_at_price") or None,
+            available=variant.get("available"),
+            options=[o for o in (variant.get(f"option{i}") for i in (1, 2, 3)) if o],
+            position=variant.get("position"),
+        )
+
+    def product_item(self, **fields):
+        """A :class:`ProductItem` for this run, or None (logged and counted) if it is invalid."""
+        fields.setdefault("brand", self.brand)
+        try:
+            return ProductItem(run=self.run, **fields)
+        except ValueError as exc:
+            return self.invalid_product(fields.get("url") or fields.get("name"), exc)
+
+    def invalid_product(self, label, exc):
+        self.logger.warning(f"Skipping invalid product {label!r}: {exc}")
+        self.crawler.stats.inc_value("items/invalid")
+        return None
+
+
+def _decimal(value):
+    try:
+        return Decimal(value) if value not in (None, "") else None
+    except InvalidOperation:
+        return None
@@ -0,0 +1,82 @@
+"""
+Per-collection ``updated_at`` high-water marks for the Shopify spiders.
+"""
+
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from scrapy.utils.project import data_path
+
+
+def parse_updated_at(value):
+    """Shopify ``updated_at`` (``2024-05-01T10:00:00+08:00``) as an aware datetime, or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class WatermarkStore:
+    """
+    JSON file with the newest ``updated_at`` seen per collection URL, and
+    when the spider last ran a full reconcile::
+
+        {"collections": {"https://shop/collections/x": "2024-05-01T02:00:00+00:00"},
+         "reconciled_at": "2024-05-03T00:00:00+00:00"}
+
+    Only written by :meth:`save`, which the spider calls once a run has seen
+    every page of a collection, so a crashed or cut-short run never moves a
+    watermark past products it did not look at.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        self.collections = {
+            url: parse_updated_at(value) for url, value in data.get("collections", {}).items()
+        }
+        self.reconciled_at = parse_updated_at(data.get("reconciled_at"))
+
+    @classmethod
+    def from_settings(cls, settings, spider_name):
+        path = data_path(os.path.join(settings.get("SHOPIFY_WATERMARK_DIR", "watermarks"), f"{spider_name}.json"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return cls(path)
+
+    def get(self, collection_url):
+        return self.collections.get(collection_url)
+
+    def reconcile_due(self, every_days):
+        """True when there is nothing to compare against or the last reconcile is too old."""
+        if not self.collections or self.reconciled_at is None:
+            return True
+        if every_days <= 0:
+            return False
+        return datetime.now(timezone.utc) - self.reconciled_at >= timedelta(days=every_days)
+
+    def save(self, watermarks, reconciled=False):
+        """Merge ``{collection_url: datetime}`` into the file (never moving a mark backwards)."""
+        for url, value in watermarks.items():
+            current = self.collections.get(url)
+            if value is not None and (current is None or value > current):
+                self.collections[url] = value
+        if reconciled:
+            self.reconciled_at = datetime.now(timezone.utc)
+        data = {
+            "collections": {url: value.isoformat() for url, value in self.collections.items() if value},
+            "reconciled_at": self.reconciled_at.isoformat() if self.reconciled_at else None,
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
@@ -0,0 +1,99 @@
+import logging
+import os
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+from urllib.parse import quote
+
+import pytest
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+
+SCRAPED_AT = datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def database():
+    """
+    DATABASE_URL pointing at a scratch schema with empty "Product" and
+    "ProductVariant" tables shaped like the real ones; dropped afterwards.
+    """
+    if not os.getenv("DATABASE_URL"):
+        pytest.skip("needs DATABASE_URL")
+    psycopg2 = pytest.importorskip("psycopg2")
+    from my_scraper.pipelines import _normalize_db_url
+
+    db_url = _normalize_db_url(os.environ["DATABASE_URL"])
+    schema = f"scraper_test_{uuid.uuid4().hex[:12]}"
+    conn = psycopg2.connect(db_url)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f'CREATE TABLE {schema}."Product" (LIKE public."Product" INCLUDING ALL)')
+        cur.execute(f'CREATE TABLE {schema}."ProductVariant" (LIKE public."ProductVariant" INCLUDING ALL)')
+    separator = "&" if "?" in db_url else "?"
+    try:
+        yield f"{db_url}{separator}options={quote(f'-csearch_path={schema}')}"
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.close()
+
+
+@pytest.fixture
+def db_writer(database):
+    """
+    Factory for DbStorePipelines whose writer-thread methods (``_connect``,
+    ``_write_batch``, ``_finish``) the test calls directly, in order.
+    """
+    from my_scraper import pipelines
+
+    pipelines._import_psycopg2()
+    opened = []
+
+    def make(spider_name="shop", load_mode="upsert", commit_policy="batch", **settings):
+        settings = Settings({"DB_RETRY_BACKOFF": 0, **settings})
+        pipeline = pipelines.DbStorePipeline(
+            MemoryStatsCollector(SimpleNamespace(settings=settings)),
+            settings,
+            load_mode=load_mode,
+            commit_policy=commit_policy,
+        )
+        pipeline.spider = SimpleNamespace(name=spider_name, logger=logging.getLogger(spider_name))
+        pipeline.uncommitted = []
+        pipeline.conn = None
+        pipeline.db = pipelines.ConnectionManager(database, retry_times=settings.getint("DB_RETRY_TIMES", 5))
+        pipeline._connect(spider_name)
+        opened.append(pipeline)
+        return pipeline
+
+    yield make
+    for pipeline in opened:
+        if pipeline.conn is not None:
+            pipeline.db.putconn(pipeline.conn)
+        pipeline.db.pool.closeall()
+
+
+@pytest.fixture
+def query(database):
+    """Run one statement against the scratch schema and return its rows."""
+    import psycopg2
+
+    conn = psycopg2.connect(database)
+
+    def run(statement, params=None):
+        with conn.cursor() as cur:
+            cur.execute(statement, params)
+            rows = cur.fetchall() if cur.description else None
+        conn.commit()
+        return rows
+
+    yield run
+    conn.close()
+
+
+def product_row(url, name="Shirt", image="https://cdn.test/shirt.jpg", brand="Shop", scraped_at=SCRAPED_AT,
+                tags=(), price_min=None):
+    """A DbStorePipeline product row (PRODUCT_COLUMNS order)."""
+    return (str(uuid.uuid4()), name, image, url, brand, scraped_at,
+            None, None, None, list(tags), price_min, price_min, None, None)
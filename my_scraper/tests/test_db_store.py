@@ -0,0 +1,111 @@
+from decimal import Decimal
+
+import pytest
+from scrapy.settings import Settings
+
+from conftest import SCRAPED_AT, product_row
+from my_scraper.pipelines import Batch, staging_tables
+from my_scraper.spiders.run_all_spiders import worker_overrides
+
+
+def test_staging_tables_per_worker():
+    assert staging_tables("shop") == ("product_staging_shop", "product_variant_staging_shop")
+    first, second = staging_tables("shop", "host-1"), staging_tables("shop", "host-2")
+    assert first != second != staging_tables("shop")
+    long_tag = "a-very-long-build-host-name.internal.example.com-123456"
+    assert all(len(name) <= 63 for name in staging_tables("some_spider_name", long_tag))
+    assert worker_overrides(Settings(), "host-1")["DB_STAGING_SUFFIX"] == "host-1"
+
+
+def test_copy_workers_do_not_drop_each_others_staging(db_writer, query):
+    # Two --worker processes of one spider; neither is resuming.
+    first = db_writer(load_mode="copy", DB_STAGING_SUFFIX="host-1")
+    first._write_batch(Batch([product_row("https://shop.test/products/a")], []))
+    second = db_writer(load_mode="copy", DB_STAGING_SUFFIX="host-2")
+    second._write_batch(Batch([product_row("https://shop.test/products/b")], []))
+
+    assert first._finish([], SCRAPED_AT)["db/rows_written"] == 1
+    assert second._finish([], SCRAPED_AT)["db/rows_written"] == 1
+    assert query('SELECT url FROM "Product" ORDER BY url') == [
+        ("https://shop.test/products/a",),
+        ("https://shop.test/products/b",),
+    ]
+    assert query("SELECT count(*) FROM pg_tables WHERE tablename LIKE '%staging%'") == [(0,)]
+
+
+PRODUCT_STATE = 'SELECT name, image, url, brand, "scrapedAt", tags, "priceMin" FROM "Product" ORDER BY url, name'
+
+
+@pytest.mark.parametrize("load_mode", ["upsert", "copy"])
+def test_load_modes_store_the_same_rows(db_writer, query, load_mode):
+    rows = [
+        product_row("https://shop.test/products/a", name="First"),
+        product_row("https://shop.test/products/a", name="Last", price_min="10.50"),
+        product_row(None, name="No url 1"),
+        product_row(None, name="No url 2"),
+        product_row("https://shop.test/products/b", name="", image=None, tags=["", "x"]),
+    ]
+    pipeline = db_writer(load_mode=load_mode)
+    if load_mode == "upsert":
+        # Upsert batches never hold a URL twice; the copy merge keeps the last row.
+        pipeline._write_batch(Batch(rows[:1], []))
+        pipeline._write_batch(Batch(rows[1:], []))
+    else:
+        pipeline._write_batch(Batch(rows, []))
+    pipeline._finish([], SCRAPED_AT)
+
+    assert query(PRODUCT_STATE) == [
+        ("Last", "https://cdn.test/shirt.jpg", "https://shop.test/products/a", "Shop", SCRAPED_AT, [],
+         Decimal("10.50")),
+        ("", None, "https://shop.test/products/b", "Shop", SCRAPED_AT, ["", "x"], None),
+        ("No url 1", "https://cdn.test/shirt.jpg", None, "Shop", SCRAPED_AT, [], None),
+        ("No url 2", "https://cdn.test/shirt.jpg", None, "Shop", SCRAPED_AT, [], None),
+    ]
+
+
+def test_unchanged_rows_are_not_rewritten(db_writer, query):
+    a, b = "https://shop.test/products/a", "https://shop.test/products/b"
+    pipeline = db_writer()
+    counts, unchanged = pipeline._write_batch(Batch([product_row(a), product_row(b)], []))
+    assert (counts["db/rows_written"], counts["db/rows_unchanged"], unchanged) == (2, 0, set())
+
+    later = SCRAPED_AT.replace(day=2)
+    counts, unchanged = pipeline._write_batch(Batch([
+        product_row(a, scraped_at=later),
+        product_row(b, name="Renamed", scraped_at=later),
+    ], []))
+    # scrapedAt alone is no change: only b is rewritten.
+    assert (counts["db/rows_written"], counts["db/rows_unchanged"], unchanged) == (1, 1, {a})
+    assert query('SELECT url, name, "scrapedAt" FROM "Product" ORDER BY url') == [
+        (a, "Shirt", SCRAPED_AT),
+        (b, "Renamed", later),
+    ]
+
+    # The unchanged row only gets scrapedAt refreshed, once, at close.
+    assert pipeline._finish(sorted(unchanged), later)["db/rows_touched"] == 1
+    assert query('SELECT "scrapedAt" FROM "Product" WHERE url = %s', (a,)) == [(later,)]
+
+
+def test_removed_products_are_rewritten_even_when_unchanged(db_writer, query):
+    url = "https://shop.test/products/a"
+    pipeline = db_writer()
+    pipeline._write_batch(Batch([product_row(url)], []))
+    query('UPDATE "Product" SET "removedAt" = now()')
+
+    counts, _ = pipeline._write_batch(Batch([product_row(url)], []))
+    assert counts["db/rows_written"] == 1
+    assert query('SELECT "removedAt" FROM "Product"') == [(None,)]
+
+
+def test_copy_merge_skips_unchanged_rows(db_writer, query):
+    url = "https://shop.test/products/a"
+    first = db_writer(load_mode="copy")
+    first._write_batch(Batch([product_row(url)], []))
+    first._finish([], SCRAPED_AT)
+
+    later = SCRAPED_AT.replace(day=2)
+    second = db_writer(load_mode="copy")
+    second._write_batch(Batch([product_row(url, scraped_at=later), product_row(None)], []))
+    counts = second._finish([], later)
+    assert (counts["db/rows_written"], counts["db/rows_unchanged"], counts["db/rows_touched"]) == (1, 1, 1)
+    assert query('SELECT "scrapedAt" FROM "Product" WHERE url = %s', (url,)) == [(later,)]
@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from my_scraper.extensions import parse_retry_after
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        (b"", None),
+        (b"120", 120.0),
+        (" 2.5 ", 2.5),
+        (b"-3", 0.0),
+        (b"soon", None),
+    ],
+)
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=90)
+    seconds = parse_retry_after(format_datetime(when, usegmt=True).encode("latin-1"))
+    assert 85 <= seconds <= 90
+
+
+def test_parse_retry_after_date_in_the_past():
+    when = datetime.now(timezone.utc) - timedelta(hours=1)
+    assert parse_retry_after(format_datetime(when, usegmt=True)) == 0.0
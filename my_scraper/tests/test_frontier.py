@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from my_scraper.frontier import SqliteFrontier
+from my_scraper.progress import CollectionProgress, SharedProgress
+
+URL = "https://shop.test/collections/shirts"
+
+
+@pytest.fixture
+def shared(tmp_path):
+    """Two SharedProgress views of one frontier, as two workers would have."""
+    path = str(tmp_path / "frontier.sqlite")
+    workers = [SharedProgress(SqliteFrontier(path), "shop:run1") for _ in range(2)]
+    yield workers
+    for worker in workers:
+        worker.close()
+
+
+def test_shared_page_claims_do_not_overlap(shared):
+    a, b = shared
+    assert list(a.claim_pages(URL, 1)) == [1]
+    assert list(b.claim_pages(URL, 1)) == []  # another worker started the collection
+    assert list(b.claim_pages(URL, 4, after=2)) == [2, 3, 4]
+    assert list(a.claim_pages(URL, 5, after=1)) == [5]
+
+
+def test_shared_completeness_balances_across_workers(shared):
+    a, b = shared
+    a.page_started(URL)
+    a.page_started(URL)
+    b.page_done(URL)  # a page requested by one worker, parsed by the other
+    b.short_page(URL, 3)
+    a.short_page(URL, 2)
+    assert not a.complete(URL)
+
+    a.page_done(URL)
+    assert a.complete(URL) and b.complete(URL)
+    assert b.last_page(URL) == 2
+
+    b.page_failed(URL)
+    assert not a.complete(URL)
+
+
+def test_shared_agreement_and_newest(shared):
+    a, b = shared
+    assert a.agree("mode", "reconcile") == "reconcile"
+    assert b.agree("mode", "delta") == "reconcile"
+
+    older = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    newer = datetime(2026, 2, 1, tzinfo=timezone.utc)
+    b.saw_updated_at(URL, newer)
+    a.saw_updated_at(URL, older)
+    a.saw_updated_at(URL, None)
+    assert a.newest_seen() == {URL: newer}
+
+
+def test_shared_progress_keeps_its_final_values_after_close(tmp_path):
+    progress = SharedProgress(SqliteFrontier(str(tmp_path / "frontier.sqlite")), "shop:run1")
+    progress.claim_pages(URL, 1)
+    progress.page_started(URL)
+    progress.short_page(URL, 1)
+    progress.page_done(URL)
+    progress.close()
+    assert progress.complete(URL)
+    assert progress.sole_worker
+
+
+def test_local_progress_matches_the_shared_one():
+    progress = CollectionProgress()
+    assert list(progress.claim_pages(URL, 1)) == [1]
+    assert list(progress.claim_pages(URL, 1)) == []
+    assert list(progress.claim_pages(URL, 4, after=1)) == [2, 3, 4]
+    progress.page_started(URL)
+    progress.short_page(URL, 3)
+    progress.short_page(URL, 2)
+    assert not progress.complete(URL)
+    progress.page_done(URL)
+    assert progress.complete(URL)
+    assert progress.last_page(URL) == 2
@@ -0,0 +1,152 @@
+import pytest
+from scrapy import Request, Spider
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from my_scraper.middlewares import (
+    IncrementalDownloaderMiddleware,
+    IncrementalSpiderMiddleware,
+    ResponseFingerprintStore,
+)
+from my_scraper.signals import products_seen
+
+PAGE = "https://shop.test/collections/shirts?page=1"
+BODY = b"<html>two shirts</html>"
+
+
+class ShopSpider(Spider):
+    name = "shop"
+
+    def parse(self, response):
+        yield {"url": "https://shop.test/collections/shirts/products/a?variant=1"}
+        yield {"url": "https://shop.test/products/b"}
+        yield Request("https://shop.test/collections/shirts?page=2", callback=self.parse, cb_kwargs={"page": 2})
+
+
+@pytest.fixture
+def incremental(tmp_path):
+    crawler = get_crawler(ShopSpider, {
+        "INCREMENTAL_ENABLED": True,
+        "INCREMENTAL_STORE_PATH": str(tmp_path / "incremental.sqlite"),
+    })
+    spider = crawler.spider = ShopSpider.from_crawler(crawler)
+    downloader = IncrementalDownloaderMiddleware.from_crawler(crawler)
+    spider_mw = IncrementalSpiderMiddleware.from_crawler(crawler)
+    seen = []
+    crawler.signals.connect(lambda urls, spider: seen.extend(urls), signal=products_seen, weak=False)
+    yield crawler, spider, downloader, spider_mw, seen
+    downloader.spider_closed(spider)
+    spider_mw.spider_closed(spider)
+
+
+def fetch(downloader, spider, status=200, body=BODY, headers=None, **meta):
+    """A request for PAGE through the downloader middleware, answered with ``status``."""
+    request = Request(PAGE, callback=spider.parse, meta=meta)
+    downloader.process_request(request, spider)
+    response = HtmlResponse(PAGE, status=status, body=body, headers=headers or {}, request=request)
+    return request, downloader.process_response(request, response, spider)
+
+
+def parse(spider_mw, spider, response):
+    return list(spider_mw.process_spider_output(response, spider.parse(response), spider))
+
+
+def never_parsed():
+    raise AssertionError("callback iterated for an unchanged page")
+    yield
+
+
+def test_first_fetch_is_parsed_and_recorded(incremental):
+    crawler, spider, downloader, spider_mw, seen = incremental
+    request, response = fetch(downloader, spider, headers={"ETag": '"v1"'})
+
+    assert "If-None-Match" not in request.headers
+    assert "incremental" not in response.meta
+    output = parse(spider_mw, spider, response)
+    assert len(output) == 3
+    assert seen == []
+
+    record = ResponseFingerprintStore(crawler.settings["INCREMENTAL_STORE_PATH"]).get(PAGE)
+    assert record["etag"] == '"v1"'
+    assert record["item_urls"] == ["https://shop.test/products/a", "https://shop.test/products/b"]
+    assert [followup["url"] for followup in record["followups"]] == ["https://shop.test/collections/shirts?page=2"]
+
+
+def test_not_modified_is_converted_and_replayed(incremental):
+    crawler, spider, downloader, spider_mw, seen = incremental
+    _, response = fetch(downloader, spider, headers={"ETag": '"v1"'})
+    parse(spider_mw, spider, response)
+
+    request, response = fetch(downloader, spider, status=304, body=b"")
+    assert request.headers["If-None-Match"] == b'"v1"'
+    # The 304 reaches the spider middlewares as an empty 200, so HttpErrorMiddleware lets it through.
+    assert (response.status, response.body, response.meta["incremental"]) == (200, b"", "not_modified")
+
+    replayed = list(spider_mw.process_spider_output(response, never_parsed(), spider))
+    assert seen == ["https://shop.test/products/a", "https://shop.test/products/b"]
+    (followup,) = replayed
+    assert followup.url == "https://shop.test/collections/shirts?page=2"
+    assert followup.callback == spider.parse
+    assert followup.cb_kwargs == {"page": 2}
+    assert crawler.stats.get_value("incremental/not_modified") == 1
+    assert crawler.stats.get_value("incremental/replayed_pages") == 1
+    assert crawler.stats.get_value("incremental/seen_items") == 2
+
+
+def test_unchanged_body_is_replayed_without_validators(incremental):
+    crawler, spider, downloader, spider_mw, seen = incremental
+    parse(spider_mw, spider, fetch(downloader, spider)[1])
+
+    _, response = fetch(downloader, spider)
+    assert response.meta["incremental"] == "unchanged"
+    assert len(list(spider_mw.process_spider_output(response, never_parsed(), spider))) == 1
+
+    _, response = fetch(downloader, spider, body=b"<html>three shirts</html>")
+    assert "incremental" not in response.meta
+    assert len(parse(spider_mw, spider, response)) == 3
+
+
+def test_not_modified_without_a_record_is_left_alone(incremental):
+    crawler, spider, downloader, spider_mw, seen = incremental
+    _, response = fetch(downloader, spider, status=304, body=b"")
+    assert response.status == 304
+    assert "incremental" not in response.meta
+
+
+def test_opted_out_requests_are_neither_conditional_nor_recorded(incremental):
+    crawler, spider, downloader, spider_mw, seen = incremental
+    parse(spider_mw, spider, fetch(downloader, spider, headers={"ETag": '"v1"'})[1])
+
+    for meta in ({"dont_incremental": True}, {"playwright_include_page": True}):
+        request, response = fetch(downloader, spider, status=304, body=b"", **meta)
+        assert "If-None-Match" not in request.headers
+        assert response.status == 304
+
+
+def test_a_callback_that_fails_halfway_is_not_recorded(incremental):
+    crawler, spider, downloader, spider_mw, seen = incremental
+    _, response = fetch(downloader, spider, headers={"ETag": '"v1"'})
+
+    def failing(response):
+        yield {"url": "https://shop.test/products/a"}
+        raise ValueError("bad page")
+
+    with pytest.raises(ValueError):
+        list(spider_mw.process_spider_output(response, failing(response), spider))
+    assert ResponseFingerprintStore(crawler.settings["INCREMENTAL_STORE_PATH"]).get(PAGE) is None
+
+
+def test_fingerprint_store_round_trip(tmp_path):
+    store = ResponseFingerprintStore(str(tmp_path / "store.sqlite"))
+    followup = Request("https://shop.test/p2").to_dict()
+    store.put(PAGE, '"v1"', None, "abc", ["https://shop.test/products/a", None], [followup], page={"count": 2})
+    assert store.get(PAGE) == {
+        "etag": '"v1"',
+        "last_modified": None,
+        "body_hash": "abc",
+        "item_urls": ["https://shop.test/products/a", None],
+        "followups": [followup],
+        "page": {"count": 2},
+    }
+    assert store.get("https://shop.test/other") is None
+    store.close()
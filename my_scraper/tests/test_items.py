@@ -0,0 +1,21 @@
+import logging
+from datetime import datetime
+
+from my_scraper.items import RunInfo
+
+
+def test_run_info_from_args():
+    run = RunInfo.from_args("2026-03-01T12:30:00", "run1")
+    assert run.scraped_at == datetime(2026, 3, 1, 12, 30)
+    assert run.scrape_time == "2026-03-01T12:30:00"
+    assert run.scrape_run_id == "run1"
+
+
+def test_run_info_falls_back_to_now_on_a_malformed_scrape_time(caplog):
+    before = datetime.now()
+    with caplog.at_level(logging.WARNING):
+        run = RunInfo.from_args("yesterday", "run1")
+
+    assert before <= run.scraped_at <= datetime.now()
+    assert run.scrape_time == run.scraped_at.isoformat()
+    assert "malformed scrape_time 'yesterday'" in caplog.text
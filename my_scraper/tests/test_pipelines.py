@@ -0,0 +1,54 @@
+import csv
+import io
+import os
+from datetime import datetime, timezone
+
+import pytest
+
+from my_scraper.pipelines import _copy_row, _copy_value
+
+AWKWARD = ['plain', 'quote " inside', 'back\\slash', 'comma, brace {}', '', 'NULL', "new\nline"]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        ("", ""),
+        (True, "t"),
+        (False, "f"),
+        (42, 42),
+        ("text", "text"),
+        (datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc), "2026-01-02T03:04:05+00:00"),
+        ([], "{}"),
+        (["men", "formal"], '{"men","formal"}'),
+        (['a"b', "c\\d"], '{"a\\"b","c\\\\d"}'),
+    ],
+)
+def test_copy_value(value, expected):
+    assert _copy_value(value) == expected
+
+
+def test_copy_row_quotes_everything_but_null():
+    row = ("text", "", None, 'say "hi"', 3, ["a", "b"])
+    assert _copy_row(row) == '"text","",,"say ""hi""","3","{""a"",""b""}"\n'
+
+
+def test_copy_value_array_survives_the_csv_layer():
+    (field,) = next(csv.reader(io.StringIO(_copy_row([AWKWARD]))))
+    assert field == _copy_value(AWKWARD)
+
+
+@pytest.mark.skipif(not os.getenv("DATABASE_URL"), reason="needs DATABASE_URL")
+def test_copy_row_round_trips_through_postgres():
+    psycopg2 = pytest.importorskip("psycopg2")
+    conn = psycopg2.connect(os.environ["DATABASE_URL"])
+    try:
+        cur = conn.cursor()
+        cur.execute("CREATE TEMP TABLE copy_check (tags text[], note text, empty text)")
+        buf = io.StringIO(_copy_row([AWKWARD, None, ""]))
+        cur.copy_expert("COPY copy_check (tags, note, empty) FROM STDIN WITH (FORMAT csv)", buf)
+        cur.execute("SELECT tags, note, empty FROM copy_check")
+        assert cur.fetchone() == (AWKWARD, None, "")
+    finally:
+        conn.close()
@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+from scrapy import Spider
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from my_scraper.profiling import ProfiledItemPipelineManager, StageProfiler
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = StageProfiler()
+    with profiler.stage("parse"):
+        pass
+    assert profiler.summary() == {}
+
+
+def test_nested_stages_and_self_time():
+    profiler = StageProfiler(enabled=True)
+    with profiler.stage("parse"):
+        time.sleep(0.02)
+        with profiler.stage("json_decode"):
+            time.sleep(0.03)
+    with profiler.stage("parse"):
+        pass
+
+    summary = profiler.summary()
+    assert list(summary) == ["parse", "parse;json_decode"]  # slowest total first
+    assert summary["parse"]["count"] == 2
+    assert summary["parse;json_decode"]["count"] == 1
+    assert summary["parse"]["total"] >= summary["parse;json_decode"]["total"] >= 0.03
+
+    total = {path: entry[1] for path, entry in profiler.stages.items()}
+    self_time = {path: entry[3] for path, entry in profiler.stages.items()}
+    assert self_time["parse"] == pytest.approx(total["parse"] - total["parse;json_decode"])
+    assert self_time["parse"] >= 0.02
+    assert self_time["parse;json_decode"] == total["parse;json_decode"]
+
+
+def test_interleaved_stages_pop_out_of_order():
+    profiler = StageProfiler(enabled=True)
+    outer = profiler.push("outer")
+    first = profiler.push("first")
+    second = profiler.push("second")
+    profiler.pop(first)  # an async callback resuming before the later one
+    profiler.pop(second)
+    profiler.pop(outer)
+    assert set(profiler.summary()) == {"outer", "outer;first", "outer;first;second"}
+    assert profiler._stack() == []
+
+
+def test_folded_output():
+    profiler = StageProfiler(enabled=True)
+    profiler.record("parse", 0.5, 0.25)
+    profiler.record("parse;json_decode", 0.25)
+    profiler.record("idle", 0.0)
+    assert list(profiler.folded("shop")) == [
+        "shop;parse 250000\n",
+        "shop;parse;json_decode 250000\n",
+    ]
+
+
+# Deferred-returning pipelines are deprecated, but still supported.
+legacy_deferred = pytest.mark.filterwarnings("ignore::scrapy.exceptions.ScrapyDeprecationWarning")
+
+
+class SyncPipeline:
+    def process_item(self, item):
+        item.append("sync")
+        return item
+
+
+class DeferredPipeline:
+    def process_item(self, item):
+        d = defer.Deferred()
+        asyncio.get_running_loop().call_later(0.02, d.callback, item + ["deferred"])
+        return d
+
+
+class AsyncPipeline:
+    async def process_item(self, item):
+        await asyncio.sleep(0.02)
+        return item + ["async"]
+
+
+def process(profile_enabled):
+    crawler = get_crawler(Spider, {"PROFILE_ENABLED": profile_enabled})
+    manager = ProfiledItemPipelineManager(SyncPipeline(), DeferredPipeline(), AsyncPipeline(), crawler=crawler)
+    item = asyncio.run(manager.process_item_async([]))
+    return item, StageProfiler.for_crawler(crawler).summary()
+
+
+@legacy_deferred
+def test_pipeline_manager_times_deferred_and_coroutine_pipelines():
+    item, summary = process(True)
+    assert item == ["sync", "deferred", "async"]
+    assert set(summary) == {"pipeline;SyncPipeline", "pipeline;DeferredPipeline", "pipeline;AsyncPipeline"}
+    # Timed until the Deferred fires / the coroutine returns, not until it is handed back.
+    assert summary["pipeline;DeferredPipeline"]["total"] >= 0.015
+    assert summary["pipeline;AsyncPipeline"]["total"] >= 0.015
+
+
+@legacy_deferred
+def test_pipeline_manager_is_the_stock_one_when_profiling_is_off():
+    item, summary = process(False)
+    assert item == ["sync", "deferred", "async"]
+    assert summary == {}
@@ -0,0 +1,182 @@
+import asyncio
+import json
+
+from scrapy import Request, Spider
+from scrapy.extensions.spiderstate import SpiderState
+from scrapy.http import TextResponse
+from scrapy.utils.request import request_from_dict
+from scrapy.utils.test import get_crawler
+
+from conftest import SCRAPED_AT, product_row
+from my_scraper.extensions import RunStateRecorder
+from my_scraper.pipelines import Batch
+from my_scraper.runstate import RunState
+from my_scraper.spiders import run_all_spiders
+from my_scraper.spiders.shopify_spider import ShopifyCollectionSpider
+
+COLLECTION = {"url": "https://shop.test/collections/shirts", "category": "casual"}
+
+
+class ShopSpider(ShopifyCollectionSpider):
+    name = "shop"
+    brand = "Shop"
+    page_size = 2
+    collections = [COLLECTION]
+
+
+def open_spider(jobdir):
+    """A spider whose ``state`` comes from the JOBDIR, as SpiderState loads it on spider_opened."""
+    crawler = get_crawler(ShopSpider, {"SHOPIFY_PAGE_WINDOW": 3, "JOBDIR": str(jobdir)})
+    spider = ShopSpider.from_crawler(crawler, scrape_run_id="run1")
+    SpiderState(str(jobdir)).spider_opened(spider)
+    requests = asyncio.run(_collect(spider.start()))
+    return spider, requests
+
+
+async def _collect(agen):
+    return [obj async for obj in agen]
+
+
+def parse(spider, request, count):
+    """Feed ``request`` a products.json page with ``count`` products; return the requests it yields."""
+    page = request.cb_kwargs["page"]
+    products = [{"id": page * 10 + i, "title": f"Shirt {i}", "handle": f"shirt-{page}-{i}"} for i in range(count)]
+    response = TextResponse(request.url, body=json.dumps({"products": products}).encode(),
+                            encoding="utf-8", request=request)
+    return [obj for obj in request.callback(response, **request.cb_kwargs) if isinstance(obj, Request)]
+
+
+def interrupt(spider, jobdir, pending):
+    """Save the spider state and the pending requests, as a Ctrl-C'd crawl leaves them in the JOBDIR."""
+    SpiderState(str(jobdir)).spider_closed(spider)
+    return [request.to_dict(spider=spider) for request in pending]
+
+
+def test_resumed_crawl_picks_up_the_pagination_from_the_jobdir(tmp_path):
+    spider, (first,) = open_spider(tmp_path)
+    assert not spider.resumed
+    second, third, fourth = parse(spider, first, 2)
+    parse(spider, second, 1)  # page 2 is short: the collection ends there
+    queued = interrupt(spider, tmp_path, [third, fourth])
+
+    resumed, start_requests = open_spider(tmp_path)
+    assert resumed.resumed
+    assert start_requests == []  # page 1 is not requested again
+
+    third, fourth = (request_from_dict(d, spider=resumed) for d in queued)
+    assert parse(resumed, third, 2) == []  # no new pages past the short page
+    assert not resumed.complete
+    parse(resumed, fourth, 0)
+    assert resumed.complete
+
+
+def test_requests_lost_with_the_interrupted_process_keep_the_collection_incomplete(tmp_path):
+    spider, (first,) = open_spider(tmp_path)
+    second, third, fourth = parse(spider, first, 2)
+    parse(spider, second, 1)
+    interrupt(spider, tmp_path, [])  # the queue did not make it to disk
+
+    resumed, _ = open_spider(tmp_path)
+    assert not resumed.complete
+    assert resumed.feed_kind == "partial"
+
+
+def recorder(tmp_path, resume=False):
+    crawler = get_crawler(Spider, {
+        "RUN_STATE_ENABLED": True,
+        "RUN_STATE_DIR": str(tmp_path),
+        "RUN_RESUME": resume,
+        "JOBDIR": str(tmp_path / "run1" / "jobs" / "shop"),
+    })
+    spider = Spider("shop")
+    spider.scrape_run_id = "run1"
+    ext = RunStateRecorder.from_crawler(crawler)
+    ext.spider_opened(spider)
+    return ext, spider
+
+
+def test_run_state_keeps_items_and_checkpoints_across_attempts(tmp_path):
+    state = RunState.for_run(get_crawler(Spider, {"RUN_STATE_DIR": str(tmp_path)}).settings, "run1")
+
+    ext, spider = recorder(tmp_path)
+    ext.stats.set_value("item_scraped_count", 100)
+    ext.db_committed(rows=100, spider=spider)
+    ext.stats.set_value("item_scraped_count", 150)
+    ext.db_committed(rows=50, spider=spider)
+    # Killed before spider_closed: the file still says running, with the last checkpoint.
+    first = state.spider("shop")
+    assert (first["status"], first["attempts"], first["items"]) == ("running", 1, 150)
+    assert (first["checkpoint"]["batches"], first["checkpoint"]["rows"]) == (2, 150)
+
+    ext, spider = recorder(tmp_path, resume=True)
+    ext.stats.set_value("item_scraped_count", 30)
+    ext.db_committed(rows=30, spider=spider)
+    ext.spider_closed(spider, "finished")
+
+    second = state.spider("shop")
+    assert (second["status"], second["attempts"], second["items"]) == ("finished", 2, 180)
+    assert (second["checkpoint"]["batches"], second["checkpoint"]["rows"]) == (3, 180)
+    assert second["feed"] == "partial"  # the first attempt's items are not in the resumed feed
+    assert state.finished("shop")
+
+
+def test_a_fresh_attempt_starts_over(tmp_path):
+    ext, spider = recorder(tmp_path)
+    ext.stats.set_value("item_scraped_count", 100)
+    ext.db_committed(rows=100, spider=spider)
+
+    ext, spider = recorder(tmp_path, resume=False)
+    ext.spider_closed(spider, "finished")
+    record = RunState(str(tmp_path / "run1")).spider("shop")
+    assert (record["attempts"], record["items"], record["checkpoint"]) == (1, 0, None)
+
+
+def test_resume_overrides(tmp_path, monkeypatch):
+    settings = get_crawler(Spider, {"FEEDS": {"%(name)s.jsonl": {"format": "jsonlines"}}}).settings
+    state = RunState(str(tmp_path / "run1"))
+    assert run_all_spiders.spider_overrides(settings, None, "shop", resume=True) == {}
+    # Not started before: a fresh JOBDIR, the feed overwritten as usual.
+    assert run_all_spiders.spider_overrides(settings, state, "shop", resume=True) == {"JOBDIR": state.jobdir("shop")}
+
+    state.update_spider("shop", status="running")
+    monkeypatch.setenv("SCRAPE_FEED_MODE", "jsonl")
+    assert run_all_spiders.spider_overrides(settings, state, "shop", resume=True) == {
+        "JOBDIR": state.jobdir("shop"),
+        "RUN_RESUME": True,
+        "FEEDS": {"%(name)s.jsonl": {"format": "jsonlines", "overwrite": False}},
+    }
+    monkeypatch.setenv("SCRAPE_FEED_MODE", "json")  # a JSON array cannot be appended to
+    assert "FEEDS" not in run_all_spiders.spider_overrides(settings, state, "shop", resume=True)
+
+
+def test_resumed_copy_load_merges_the_rows_staged_before_the_interruption(db_writer, query):
+    a, b = "https://shop.test/products/a", "https://shop.test/products/b"
+    interrupted = db_writer(load_mode="copy")
+    interrupted._write_batch(Batch([product_row(a)], []))  # committed: the run state checkpoint
+
+    resumed = db_writer(load_mode="copy", RUN_RESUME=True)
+    resumed._write_batch(Batch([product_row(b)], []))
+    assert resumed._finish([], SCRAPED_AT)["db/rows_written"] == 2
+    assert query('SELECT url FROM "Product" ORDER BY url') == [(a,), (b,)]
+
+
+def test_fresh_copy_load_drops_an_old_staging_table(db_writer, query):
+    interrupted = db_writer(load_mode="copy")
+    interrupted._write_batch(Batch([product_row("https://shop.test/products/a")], []))
+
+    fresh = db_writer(load_mode="copy")
+    fresh._write_batch(Batch([product_row("https://shop.test/products/b")], []))
+    fresh._finish([], SCRAPED_AT)
+    assert query('SELECT url FROM "Product"') == [("https://shop.test/products/b",)]
+
+
+def test_committed_batches_are_checkpointed(db_writer, tmp_path):
+    ext, spider = recorder(tmp_path)
+    pipeline = db_writer()
+    pipeline.spider, pipeline.signals = spider, ext.crawler.signals
+
+    batch = Batch([product_row("https://shop.test/products/a"), product_row("https://shop.test/products/b")], [])
+    pipeline._batch_written(pipeline._write_batch(batch), len(batch.products))
+
+    checkpoint = RunState(str(tmp_path / "run1")).spider("shop")["checkpoint"]
+    assert (checkpoint["batches"], checkpoint["rows"]) == (1, 2)
@@ -0,0 +1,193 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+from my_scraper.spiders import run_all_spiders
+from my_scraper.spiders.run_all_spiders import RunBudget, run_subprocesses
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+
+
+class FakeCrawl:
+    """Stands in for a ``scrapy crawl`` process; writes the spider's metrics file like CrawlMetrics."""
+
+    metrics_dir = None
+    results = {}
+    started = []
+
+    def __init__(self, args, cwd=None, env=None):
+        self.spider = args[args.index("crawl") + 1]
+        self.args = args
+        FakeCrawl.started.append(self)
+        result = FakeCrawl.results.get(self.spider, {})
+        self.returncode = result.get("returncode", 0)
+        if "metrics" in result:
+            run_dir = FakeCrawl.metrics_dir / "run1"
+            run_dir.mkdir(parents=True, exist_ok=True)
+            (run_dir / f"{self.spider}.json").write_text(json.dumps({"spider": self.spider, **result["metrics"]}))
+
+    def wait(self, timeout=None):
+        if FakeCrawl.results.get(self.spider, {}).get("hangs") and timeout is not None:
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+
+    def kill(self):
+        self.returncode = -9
+
+    def setting(self, name):
+        """The value of ``-s name=...`` on the command line, or None."""
+        prefix = f"{name}="
+        return next((arg[len(prefix):] for arg in self.args if arg.startswith(prefix)), None)
+
+
+@pytest.fixture
+def fake_crawl(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_all_spiders, "METRICS_DIR", tmp_path)
+    monkeypatch.setattr(run_all_spiders.subprocess, "Popen", FakeCrawl)
+    FakeCrawl.metrics_dir = tmp_path
+    FakeCrawl.results = {}
+    FakeCrawl.started = []
+    return FakeCrawl
+
+
+def test_subprocess_counts_come_from_the_metrics_files(fake_crawl, monkeypatch):
+    monkeypatch.setattr(run_all_spiders, "load_feed_count", lambda name: pytest.fail("feed re-read"))
+    fake_crawl.results = {
+        "shop": {"metrics": {"finish_reason": "finished", "items": 12, "feed": "delta"}},
+        "other": {"metrics": {"finish_reason": "closespider_timeout", "items": 3, "feed": "partial"}},
+    }
+    progress = []
+
+    statuses, counts, feed_kinds = run_subprocesses(
+        ["shop", "other"], "2026-03-01T12:00:00", "run1",
+        on_finished=lambda statuses, counts: progress.append(dict(counts)),
+    )
+
+    assert statuses == {"shop": "success", "other": "partial"}
+    assert counts == {"shop": 12, "other": 3}
+    assert feed_kinds == {"shop": "delta", "other": "partial"}
+    assert progress == [{"shop": 12}, {"shop": 12, "other": 3}]
+
+
+def test_subprocess_without_metrics_falls_back_to_the_feed(fake_crawl, tmp_path, monkeypatch):
+    monkeypatch.setattr(run_all_spiders, "SUMMARY_FILE", tmp_path / "last-scrape.json")
+    monkeypatch.setattr(run_all_spiders, "load_feed_count", lambda name: 7)
+    fake_crawl.results = {"shop": {"returncode": 0}}
+
+    statuses, counts, feed_kinds = run_subprocesses(["shop"], "2026-03-01T12:00:00", "run1")
+    assert (statuses, counts, feed_kinds) == ({"shop": "success"}, {}, {})
+
+    run_all_spiders.write_summary(statuses, counts=counts, feed_kinds=feed_kinds)
+    assert json.loads((tmp_path / "last-scrape.json").read_text())["counts"] == {"shop": 7}
+
+
+def test_subprocesses_run_in_the_given_order_with_their_budgets(fake_crawl):
+    budget = RunBudget(spider_seconds={"slow": 30}, grace=5)
+    statuses, _, _ = run_subprocesses(["fast", "slow", "rendered"], "2026-03-01T12:00:00", "run1", budget=budget)
+
+    assert [crawl.spider for crawl in fake_crawl.started] == ["fast", "slow", "rendered"]
+    assert [crawl.setting("CLOSESPIDER_TIMEOUT") for crawl in fake_crawl.started] == [None, "30", None]
+    assert list(statuses) == ["fast", "slow", "rendered"]
+
+
+def test_subprocess_over_budget_is_killed(fake_crawl):
+    fake_crawl.results = {"slow": {"hangs": True}}
+    budget = RunBudget(spider_seconds={"slow": 30}, grace=5)
+    statuses, _, _ = run_subprocesses(["slow"], "2026-03-01T12:00:00", "run1", budget=budget)
+
+    (crawl,) = fake_crawl.started
+    assert crawl.terminated
+    assert statuses == {"slow": "failed (killed over time budget)"}
+
+
+def test_spent_run_budget_skips_the_remaining_subprocesses(fake_crawl, monkeypatch):
+    budget = RunBudget(run_seconds=60)
+    fake_crawl.results = {"first": {"returncode": 0}}
+    original_init = FakeCrawl.__init__
+
+    def slow_init(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        budget.started -= 61  # the first spider used up the run
+
+    monkeypatch.setattr(FakeCrawl, "__init__", slow_init)
+    statuses, _, _ = run_subprocesses(["first", "second", "third"], "2026-03-01T12:00:00", "run1", budget=budget)
+
+    assert [crawl.spider for crawl in fake_crawl.started] == ["first"]
+    assert fake_crawl.started[0].setting("CLOSESPIDER_TIMEOUT") == "60.0"
+    assert statuses == {"first": "success", "second": "skipped (run budget)", "third": "skipped (run budget)"}
+
+
+# run_in_process starts (and stops) the Twisted reactor, so it runs in a child process.
+IN_PROCESS_RUN = textwrap.dedent("""
+    import json
+
+    from scrapy import Spider, signals
+    from scrapy.exceptions import DontCloseSpider
+
+    from my_scraper.spiders.run_all_spiders import RunBudget, run_in_process
+
+
+    class Quick(Spider):
+        name = "quick"
+
+        async def start(self):
+            return
+            yield
+
+
+    class Idle(Quick):
+        # Never finishes on its own.
+        name = "idle"
+
+        @classmethod
+        def from_crawler(cls, crawler, *args, **kwargs):
+            spider = super().from_crawler(crawler, *args, **kwargs)
+            crawler.signals.connect(spider.keep_open, signal=signals.spider_idle)
+            return spider
+
+        def keep_open(self):
+            raise DontCloseSpider
+
+
+    class Stuck(Idle):
+        # Runs without the CloseSpider extension, so only the grace period stops it.
+        name = "stuck"
+
+
+    quiet = {"FEEDS": {}, "METRICS_ENABLED": False, "CHANGES_ENABLED": False, "LOG_LEVEL": "ERROR"}
+    overrides = {
+        Quick: quiet,
+        Idle: quiet,
+        Stuck: {**quiet, "EXTENSIONS": {"scrapy.extensions.closespider.CloseSpider": None}},
+    }
+    budget = RunBudget(spider_seconds={Idle: 1, Stuck: 1}, grace=0.5)
+    statuses, _, _ = run_in_process([Stuck, Quick, Idle], "2026-03-01T12:00:00", "run1",
+                                    overrides=overrides, budget=budget)
+    print(json.dumps([[spider.name, status] for spider, status in statuses.items()]))
+""")
+
+
+def test_in_process_budgets_close_and_then_stop_spiders():
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    env["PYTHONPATH"] = str(PROJECT_DIR)
+    result = subprocess.run([sys.executable, "-c", IN_PROCESS_RUN], env=env, capture_output=True, text=True,
+                            timeout=60)
+    assert result.returncode == 0, result.stderr
+
+    scheduled = [line for line in result.stdout.splitlines() if line.startswith("Scheduling spider")]
+    assert [line.split("__main__.")[1].split("'")[0] for line in scheduled] == ["Stuck", "Quick", "Idle"]
+    assert "Stuck'> is over its time budget; stopping it" in result.stdout
+    # Idle is closed by CLOSESPIDER_TIMEOUT; Stuck ignores it and is stopped after the grace period.
+    assert json.loads(result.stdout.splitlines()[-1]) == [
+        ["stuck", "partial"],
+        ["quick", "success"],
+        ["idle", "partial"],
+    ]
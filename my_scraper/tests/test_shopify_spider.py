@@ -0,0 +1,117 @@
+import asyncio
+import json
+
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+from twisted.python.failure import Failure
+
+from my_scraper.items import ProductItem
+from my_scraper.spiders.shopify_spider import ShopifyCollectionSpider
+
+COLLECTION = {"url": "https://shop.test/collections/shirts", "category": "casual"}
+
+
+class ShopSpider(ShopifyCollectionSpider):
+    name = "shop"
+    brand = "Shop"
+    page_size = 2
+    collections = [COLLECTION]
+
+
+def make_spider(**settings):
+    crawler = get_crawler(ShopSpider, {"SHOPIFY_PAGE_WINDOW": 3, **settings})
+    return ShopSpider.from_crawler(crawler)
+
+
+def start(spider):
+    async def collect():
+        return [request async for request in spider.start()]
+
+    return asyncio.run(collect())
+
+
+def products(page, count):
+    return [
+        {
+            "id": page * 10 + i,
+            "title": f"Shirt {page}-{i}",
+            "handle": f"shirt-{page}-{i}",
+            "updated_at": "2026-01-01T10:00:00+08:00",
+            "variants": [{"id": 1, "title": "M", "price": "10.00", "available": True}],
+        }
+        for i in range(count)
+    ]
+
+
+def parse(spider, request, count):
+    """Feed ``request`` a products.json page with ``count`` products; return (items, requests)."""
+    page = request.cb_kwargs["page"]
+    response = TextResponse(
+        request.url,
+        body=json.dumps({"products": products(page, count)}).encode(),
+        encoding="utf-8",
+        request=request,
+    )
+    output = list(request.callback(response, **request.cb_kwargs))
+    items = [obj for obj in output if isinstance(obj, ProductItem)]
+    requests = [obj for obj in output if isinstance(obj, Request)]
+    return items, requests
+
+
+def pages(requests):
+    return [request.cb_kwargs["page"] for request in requests]
+
+
+def test_full_page_opens_the_look_ahead_window():
+    spider = make_spider()
+    (first,) = start(spider)
+
+    items, requests = parse(spider, first, 2)
+
+    assert len(items) == 2
+    assert pages(requests) == [2, 3, 4]
+    assert not spider.complete
+
+
+def test_pages_already_requested_are_not_requested_again():
+    spider = make_spider()
+    (first,) = start(spider)
+    _, window = parse(spider, first, 2)
+
+    _, requests = parse(spider, window[0], 2)
+
+    # Page 2 only extends the window by one page past what page 1 asked for.
+    assert pages(requests) == [5]
+
+
+def test_short_page_ends_the_collection_once_every_page_is_parsed():
+    spider = make_spider()
+    (first,) = start(spider)
+    _, (second, third, fourth) = parse(spider, first, 2)
+
+    _, requests = parse(spider, second, 1)
+    assert requests == []
+    assert not spider.complete  # pages 3 and 4 are still in flight
+
+    parse(spider, fourth, 0)
+    assert not spider.complete
+    _, requests = parse(spider, third, 2)
+    assert requests == []  # the window stops at the short page
+    assert spider.complete
+    assert spider.feed_kind == "complete"
+
+
+def test_failed_page_keeps_the_collection_incomplete():
+    spider = make_spider()
+    (first,) = start(spider)
+    _, (second, third, fourth) = parse(spider, first, 2)
+    parse(spider, second, 1)
+    parse(spider, third, 2)
+
+    failure = Failure(ConnectionError("reset"))
+    failure.request = fourth
+    fourth.errback(failure)
+
+    assert not spider.complete
+    assert spider.feed_kind == "partial"
+    assert spider.crawler.stats.get_value("shopify/failed_pages") == 1
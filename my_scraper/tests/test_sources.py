@@ -0,0 +1,127 @@
+import pytest
+from scrapy.settings import Settings
+
+from my_scraper.sources import load_sources, run_order
+from my_scraper.spiders import registry
+
+VALID = """
+[[source]]
+name = "rendered_shop"
+brand = "Rendered"
+type = "rendered"
+collections = [{ url = "https://rendered.test/collections/all" }]
+
+[[source]]
+name = "shop"
+brand = " Shop "
+category = "casual"
+time_budget = 300
+collections = [
+    { url = "https://shop.test/collections/shirts/" },
+    { url = "https://shop.test/collections/suits", category = "formal" },
+]
+[source.settings]
+DOWNLOAD_TIMEOUT = 30
+
+[[source]]
+name = "fallback_shop"
+brand = "Fallback"
+render_fallback = true
+collections = [{ url = "https://fallback.test/collections/all" }]
+
+[[source]]
+name = "retired"
+brand = "Retired"
+enabled = false
+collections = [{ url = "https://retired.test/collections/all" }]
+"""
+
+
+def write(tmp_path, text):
+    path = tmp_path / "sources.toml"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_load_sources(tmp_path):
+    sources = {source.name: source for source in load_sources(write(tmp_path, VALID))}
+
+    assert list(sources) == ["rendered_shop", "shop", "fallback_shop"]
+    shop = sources["shop"]
+    assert shop.brand == "Shop"
+    assert shop.type == "shopify"
+    assert shop.collections == (
+        {"url": "https://shop.test/collections/shirts", "category": "casual"},
+        {"url": "https://shop.test/collections/suits", "category": "formal"},
+    )
+    assert shop.settings == {"DOWNLOAD_TIMEOUT": 30}
+    assert shop.time_budget == 300.0
+    assert sources["fallback_shop"].renders and not shop.renders
+
+
+def test_disabled_sources_are_kept_on_request(tmp_path):
+    names = [source.name for source in load_sources(write(tmp_path, VALID), enabled_only=False)]
+    assert names[-1] == "retired"
+
+
+def test_run_order_puts_json_sources_first(tmp_path):
+    sources = load_sources(write(tmp_path, VALID))
+    assert [source.name for source in run_order(sources)] == ["shop", "fallback_shop", "rendered_shop"]
+
+
+@pytest.mark.parametrize(
+    "entry, error",
+    [
+        ('brand = "B"', "name is required"),
+        ('name = "shop"', "brand is required"),
+        ('name = "my-shop"\nbrand = "B"', "valid identifier"),
+        ('name = "shop"\nbrand = "B"\ntype = "api"', "type must be one of"),
+        ('name = "shop"\nbrand = "B"\ncolour = "red"', "unknown keys ['colour']"),
+        ('name = "shop"\nbrand = "B"\ncollections = []', "no collections"),
+        ('name = "shop"\nbrand = "B"\ncollections = [{ url = "/collections/x" }]', "absolute url"),
+        ('name = "shop"\nbrand = "B"\npriority = "high"', "priority must be an integer"),
+        ('name = "shop"\nbrand = "B"\npriority = true', "priority must be an integer"),
+        ('name = "shop"\nbrand = "B"\ntime_budget = 0', "time_budget must be a positive"),
+        ('name = "shop"\nbrand = "B"\ntime_budget = true', "time_budget must be a positive"),
+    ],
+)
+def test_invalid_source(tmp_path, entry, error):
+    if "collections" not in entry:
+        entry += '\ncollections = [{ url = "https://shop.test/collections/x" }]'
+    with pytest.raises(ValueError, match="source #1") as excinfo:
+        load_sources(write(tmp_path, f"[[source]]\n{entry}\n"))
+    assert error in str(excinfo.value)
+
+
+def test_duplicate_names(tmp_path):
+    entry = '[[source]]\nname = "shop"\nbrand = "B"\ncollections = [{ url = "https://shop.test/collections/x" }]\n'
+    with pytest.raises(ValueError, match="source #2 .*duplicate name"):
+        load_sources(write(tmp_path, entry * 2))
+
+
+def test_shipped_registry_is_valid():
+    assert load_sources()
+
+
+def test_on_error_skips_the_malformed_entry(tmp_path):
+    good = '[[source]]\nname = "shop"\nbrand = "B"\ncollections = [{ url = "https://shop.test/collections/x" }]\n'
+    errors = []
+    sources = load_sources(write(tmp_path, '[[source]]\nname = "bad"\n' + good + good), on_error=errors.append)
+
+    assert [source.name for source in sources] == ["shop"]
+    assert len(errors) == 2
+    assert "source #1 (bad): brand is required" in errors[0]
+    assert "source #3 (shop): duplicate name" in errors[1]
+
+
+def test_registry_leaves_out_malformed_sources(tmp_path, caplog):
+    text = VALID.replace('name = "shop"\n', 'name = "shop"\ncolour = "red"\n')
+    spiders = registry._generate(Settings({"SOURCES_FILE": write(tmp_path, text)}))
+    assert list(spiders) == ["rendered_shop", "fallback_shop"]
+    assert "source #2 (shop): unknown keys ['colour']" in caplog.text
+
+
+def test_registry_survives_an_unreadable_file(tmp_path, caplog):
+    assert registry._generate(Settings({"SOURCES_FILE": write(tmp_path, "[[source")})) == {}
+    assert registry._generate(Settings({"SOURCES_FILE": str(tmp_path / "missing.toml")})) == {}
+    assert caplog.text.count("Source registry not loaded") == 2
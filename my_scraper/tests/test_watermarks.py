@@ -0,0 +1,131 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+from scrapy.http import TextResponse
+from scrapy.utils.test import get_crawler
+
+from my_scraper.items import ProductItem
+from my_scraper.signals import products_seen
+from my_scraper.spiders.shopify_spider import ShopifyCollectionSpider
+from my_scraper.watermarks import WatermarkStore, parse_updated_at
+
+COLLECTION = {"url": "https://shop.test/collections/shirts", "category": "casual"}
+MARK = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+class ShopSpider(ShopifyCollectionSpider):
+    name = "shop"
+    brand = "Shop"
+    collections = [COLLECTION]
+
+
+def make_spider(tmp_path, enabled=True, **kwargs):
+    crawler = get_crawler(
+        ShopSpider,
+        {
+            "SHOPIFY_WATERMARK_ENABLED": enabled,
+            "SHOPIFY_WATERMARK_DIR": str(tmp_path),
+            "SHOPIFY_WATERMARK_OVERLAP": 0,
+        },
+    )
+    return ShopSpider.from_crawler(crawler, **kwargs)
+
+
+def start(spider):
+    async def collect():
+        return [request async for request in spider.start()]
+
+    (first,) = asyncio.run(collect())
+    return first
+
+
+def store(tmp_path):
+    return WatermarkStore(str(tmp_path / "shop.json"))
+
+
+def test_parse_updated_at():
+    assert parse_updated_at("2026-03-01T08:00:00+08:00") == MARK
+    assert parse_updated_at("2026-03-01T00:00:00Z") == MARK
+    assert parse_updated_at("2026-03-01T00:00:00") == MARK
+    assert parse_updated_at("yesterday") is None
+    assert parse_updated_at(None) is None
+
+
+def test_reconcile_due(tmp_path):
+    marks = store(tmp_path)
+    assert marks.reconcile_due(7)  # nothing to compare against yet
+
+    marks.save({COLLECTION["url"]: MARK}, reconciled=True)
+    assert not marks.reconcile_due(7)
+    assert not marks.reconcile_due(0)
+
+    marks.reconciled_at -= timedelta(days=8)
+    assert marks.reconcile_due(7)
+    assert not marks.reconcile_due(0)  # 0 = only on demand
+
+
+def test_save_never_moves_a_watermark_back(tmp_path):
+    marks = store(tmp_path)
+    marks.save({COLLECTION["url"]: MARK})
+    marks.save({COLLECTION["url"]: MARK - timedelta(days=1), "https://shop.test/collections/new": None})
+
+    reloaded = store(tmp_path)
+    assert reloaded.get(COLLECTION["url"]) == MARK
+    assert reloaded.get("https://shop.test/collections/new") is None
+    assert reloaded.reconciled_at is None
+
+
+def test_mode_selection(tmp_path):
+    assert make_spider(tmp_path, enabled=False).mode == "full"
+    assert make_spider(tmp_path).mode == "reconcile"  # first run
+
+    store(tmp_path).save({COLLECTION["url"]: MARK}, reconciled=True)
+    assert make_spider(tmp_path).mode == "delta"
+    assert make_spider(tmp_path, reconcile="1").mode == "reconcile"
+
+
+def products_response(request, updated_at):
+    body = {
+        "products": [
+            {"id": i, "title": f"Shirt {i}", "handle": f"shirt-{i}", "updated_at": value}
+            for i, value in enumerate(updated_at)
+        ]
+    }
+    return TextResponse(request.url, body=json.dumps(body).encode(), encoding="utf-8", request=request)
+
+
+def test_delta_run_only_emits_products_newer_than_the_watermark(tmp_path):
+    store(tmp_path).save({COLLECTION["url"]: MARK}, reconciled=True)
+    spider = make_spider(tmp_path)
+    announced = []
+    spider.crawler.signals.connect(lambda urls, spider: announced.extend(urls), signal=products_seen, weak=False)
+
+    updated_at = ["2026-02-01T00:00:00Z", "2026-03-01T00:00:00Z", "2026-03-02T00:00:00Z"]
+    response = products_response(start(spider), updated_at)
+    output = spider.parse_products(response, **response.request.cb_kwargs)
+    items = [obj for obj in output if isinstance(obj, ProductItem)]
+
+    assert [item.url for item in items] == ["https://shop.test/products/shirt-2"]
+    assert announced == ["https://shop.test/products/shirt-0", "https://shop.test/products/shirt-1"]
+    assert spider.complete
+    assert spider.feed_kind == "delta"
+
+    spider.closed("finished")
+    assert store(tmp_path).get(COLLECTION["url"]) == datetime(2026, 3, 2, tzinfo=timezone.utc)
+
+
+def test_replayed_page_keeps_pagination_and_watermarks(tmp_path):
+    spider = make_spider(tmp_path, enabled=False)
+    announced = []
+    spider.crawler.signals.connect(lambda urls, spider: announced.extend(urls), signal=products_seen, weak=False)
+
+    response = products_response(start(spider), [])
+    summary = {"urls": ["https://shop.test/products/shirt-0"], "count": 1, "newest": MARK}
+    assert list(spider.replay_page(response, summary)) == []
+
+    assert announced == summary["urls"]
+    assert spider.complete
+    assert spider.progress.newest_seen() == {COLLECTION["url"]: MARK}
+    # The feed does not list the replayed products.
+    assert spider.feed_kind == "delta"
@@ -0,0 +1,35 @@
+-- AlterTable
+ALTER TABLE "Product" ADD COLUMN     "available" BOOLEAN,
+ADD COLUMN     "priceMax" DECIMAL(10,2),
+ADD COLUMN     "priceMin" DECIMAL(10,2),
+ADD COLUMN     "productType" TEXT,
+ADD COLUMN     "shopifyId" BIGINT,
+ADD COLUMN     "shopifyUpdatedAt" TIMESTAMP(3),
+ADD COLUMN     "tags" TEXT[] DEFAULT ARRAY[]::TEXT[],
+ADD COLUMN     "vendor" TEXT;
+
+-- CreateTable
+CREATE TABLE "ProductVariant" (
+    "id" TEXT NOT NULL,
+    "productId" TEXT NOT NULL,
+    "shopifyId" BIGINT NOT NULL,
+    "title" TEXT,
+    "sku" TEXT,
+    "price" DECIMAL(10,2),
+    "compareAtPrice" DECIMAL(10,2),
+    "available" BOOLEAN,
+    "options" TEXT[] DEFAULT ARRAY[]::TEXT[],
+    "position" INTEGER,
+    "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT "ProductVariant_pkey" PRIMARY KEY ("id")
+);
+
+-- CreateIndex
+CREATE UNIQUE INDEX "ProductVariant_shopifyId_key" ON "ProductVariant"("shopifyId");
+
+-- CreateIndex
+CREATE INDEX "ProductVariant_productId_idx" ON "ProductVariant"("productId");
+
+-- AddForeignKey
+ALTER TABLE "ProductVariant" ADD CONSTRAINT "ProductVariant_productId_fkey" FOREIGN KEY ("productId") REFERENCES "Product"("id") ON DELETE CASCADE ON UPDATE CASCADE;
@@ -1,12 +1,17 @@
 const { PrismaClient } = require("@prisma/client");
-const { readFile } = require("fs/promises");
+const { createReadStream } = require("fs");
+const { readFile, stat } = require("fs/promises");
 const path = require("path");
+const readline = require("readline");
+const zlib = require("zlib");
 const { GoogleGenAI } = require("@google/genai");
 
 const aiClient = new GoogleGenAI({
   apiKey: process.env.GEMINI_API_KEY
 });
 
+// Category of fashion products per brand; the source registry's categories
+// (from last-scrape.json) are added on top at import time.
 const BRAND_CATEGORY_MAP = {
   tomaz: "formal",
   "smart master": "casual",
@@ -17,23 +22,154 @@ const BRAND_CATEGORY_MAP = {
 
 const prisma = new PrismaClient();
 
-const sources = [
-  { file: "products.json", brand: "Aegis" },
-  { file: "tomaz.json", brand: "Tomaz" },
-  { file: "smart_master.json", brand: "Smart Master" },
-];
+const FEED_DIR = path.join(process.cwd(), "my_scraper");
+const SUMMARY_FILE = path.join(process.cwd(), "last-scrape.json");
 
-async function loadJson(file) {
+// Feeds are <spider>.json, .jsonl or .jsonl.gz depending on SCRAPE_FEED_MODE;
+// the newest one wins so switching formats never imports a stale file.
+async function resolveFeed(spider) {
+  let newest = null;
+  for (const ext of ["jsonl.gz", "jsonl", "json"]) {
+    const file = path.join(FEED_DIR, `${spider}.${ext}`);
+    try {
+      const { mtimeMs } = await stat(file);
+      if (!newest || mtimeMs > newest.mtimeMs) newest = { file, mtimeMs };
+    } catch {
+      // not written in this format
+    }
+  }
+  return newest?.file || null;
+}
+
+// The last run_all_spiders summary: which spiders ran (with brand and default
+// category from the source registry) and their feed kinds. Only "complete"
+// feeds list the whole catalogue of a brand; Shopify delta runs write "delta"
+// feeds with just the changed products, so nothing may be marked removed for them.
+async function loadSummary() {
+  let summary = {};
   try {
-    const raw = await readFile(path.join(process.cwd(), "my_scraper", file), "utf8");
-    const data = JSON.parse(raw);
-    return Array.isArray(data) ? data : [];
+    summary = JSON.parse(await readFile(SUMMARY_FILE, "utf8"));
+  } catch {
+    console.warn(`No readable ${SUMMARY_FILE}; nothing to import`);
+  }
+  const sources = Object.entries(summary.sources || {}).map(([spider, source]) => ({
+    spider,
+    brand: source.brand,
+    category: source.category,
+  }));
+  const feedKinds = {};
+  for (const [spider, kind] of Object.entries(summary.feed_kinds || {})) {
+    // Spiders cut short by their time budget ("partial") wrote a partial feed.
+    const status = summary.spiders?.[spider];
+    feedKinds[spider] = status === "success" ? kind : status === "partial" ? "partial" : "failed";
+  }
+  return { sources, feedKinds };
+}
+
+// Yields feed items one at a time. JSON Lines feeds are streamed, so memory
+// stays flat however large the catalog is.
+async function* readFeed(spider) {
+  const file = await resolveFeed(spider);
+  if (!file) {
+    console.warn(`Skipping ${spider}: no feed found`);
+    return;
+  }
+  try {
+    if (file.endsWith(".json")) {
+      const data = JSON.parse(await readFile(file, "utf8"));
+      if (Array.isArray(data)) yield* data;
+      return;
+    }
+    let input = createReadStream(file);
+    if (file.endsWith(".gz")) input = input.pipe(zlib.createGunzip());
+    const lines = readline.createInterface({ input, crlfDelay: Infinity });
+    for await (const line of lines) {
+      if (!line.trim()) continue;
+      try {
+        yield JSON.parse(line);
+      } catch {
+        console.warn(`Skipping malformed line in ${file}`);
+      }
+    }
   } catch (err) {
     console.warn(`Skipping ${file}: not found or unreadable (${err?.message || err})`);
-    return [];
   }
 }
 
+// products.json data carried by the Shopify feeds; absent for rendered products.
+function shopifyFields(item) {
+  const fields = {};
+  if (item.shopify_id != null) fields.shopifyId = BigInt(item.shopify_id);
+  if (item.vendor != null) fields.vendor = item.vendor;
+  if (item.product_type != null) fields.productType = item.product_type;
+  if (Array.isArray(item.tags)) fields.tags = item.tags;
+  if (item.price_min != null) fields.priceMin = item.price_min;
+  if (item.price_max != null) fields.priceMax = item.price_max;
+  if (item.available != null) fields.available = item.available;
+  if (item.shopify_updated_at) fields.shopifyUpdatedAt = new Date(item.shopify_updated_at);
+  return fields;
+}
+
+const SHOPIFY_CATEGORY_WORDS = {
+  clothing: [
+    "shirt", "t-shirt", "tee", "polo", "blouse", "top", "sweater", "hoodie",
+    "jacket", "coat", "blazer", "suit", "vest", "pants", "trousers", "jeans",
+    "chinos", "shorts", "skirt", "dress", "kurta", "jersey", "cardigan",
+    "underwear", "boxers", "socks", "pajamas", "clothing", "apparel"
+  ],
+  footwear: ["shoes", "sneakers", "boots", "sandals", "loafers", "slippers", "footwear"],
+  accessories: ["belt", "tie", "wallet", "bag", "cap", "hat", "scarf", "watch", "sunglasses", "accessories"]
+};
+
+const SHOPIFY_GENDER_WORDS = {
+  men: ["men", "mens", "men's", "male", "man", "boys"],
+  women: ["women", "womens", "women's", "female", "woman", "ladies", "girls"],
+  unisex: ["unisex"]
+};
+
+const SHOPIFY_OCCASION_WORDS = ["formal", "casual", "outdoor", "sport", "sportswear", "office", "party", "wedding", "lounge"];
+
+// Words of product_type plus every tag, lower-cased ("Men's Shirts" -> men's, shirts).
+function shopifyWords(product) {
+  const text = [product.productType || "", ...(product.tags || [])].join(" ").toLowerCase();
+  return new Set(text.split(/[^a-z0-9'-]+/).filter(Boolean));
+}
+
+function hasWord(words, candidates) {
+  // Tolerate plurals: "shirts" matches "shirt".
+  return candidates.some((c) => words.has(c) || words.has(`${c}s`));
+}
+
+// Classifies from the Shopify product_type and tags alone. Returns the same
+// shape as the Gemini label, or null when the data is not conclusive and the
+// product has to go to the LLM.
+function classifyFromShopify(product) {
+  const words = shopifyWords(product);
+  if (words.size === 0) return null;
+
+  const mainCategory = Object.keys(SHOPIFY_CATEGORY_WORDS).find((category) =>
+    hasWord(words, SHOPIFY_CATEGORY_WORDS[category])
+  );
+  if (!mainCategory) return null;
+
+  const subcategory = mainCategory === "clothing"
+    ? SHOPIFY_CATEGORY_WORDS.clothing.find((word) => hasWord(words, [word])) || null
+    : null;
+  const genders = Object.keys(SHOPIFY_GENDER_WORDS).filter((gender) =>
+    hasWord(words, SHOPIFY_GENDER_WORDS[gender])
+  );
+  const gender = genders.length === 1 ? genders[0] : genders.length > 1 ? "unisex" : null;
+  const occasion = SHOPIFY_OCCASION_WORDS.find((word) => words.has(word)) || null;
+
+  return {
+    main_category: mainCategory,
+    subcategory: subcategory || product.productType || null,
+    gender,
+    occasion,
+    source: "shopify"
+  };
+}
+
 async function classifyProductAI(product) {
   const name = product.name?.trim();
   const brand = product.brand?.trim();
@@ -74,33 +210,49 @@ Return JSON only.
 async function main() {
 
   // 🔹 Phase 1: Import JSON feeds
+  const { sources, feedKinds } = await loadSummary();
+
   for (const src of sources) {
-    const items = await loadJson(src.file);
+    if (src.brand && src.category) {
+      BRAND_CATEGORY_MAP[src.brand.toLowerCase().replace(/\s+/g, " ")] = src.category;
+    }
     const seenUrls = [];
 
-    for (const item of items) {
+    for await (const item of readFeed(src.spider)) {
       const name = (item.name || "").trim() || null;
       const url = item.url || null;
       const image = item.image || null;
+      const brand = item.brand || src.brand;
       const scrapedAt = new Date();
       if (!url) continue;
 
       seenUrls.push(url);
 
+      const shopify = shopifyFields(item);
+
       await prisma.product.upsert({
         where: { url },
-        update: { name, image, brand: src.brand, scrapedAt },
-        create: { name, image, url, brand: src.brand, scrapedAt },
+        update: { name, image, brand, scrapedAt, removedAt: null, ...shopify },
+        create: { name, image, url, brand, scrapedAt, ...shopify },
       });
     }
 
-    if (seenUrls.length > 0) {
-      await prisma.product.deleteMany({
+    // The only place products are retired. They are marked rather than
+    // deleted, so a product missing from one crawl keeps its wishlist links
+    // and comes back as soon as a feed lists it again.
+    const feedKind = feedKinds[src.spider] || "unknown";
+    if (feedKind !== "complete") {
+      console.log(`${src.spider}: ${feedKind} feed, ${seenUrls.length} products updated, none marked removed`);
+    } else if (seenUrls.length > 0) {
+      const { count } = await prisma.product.updateMany({
         where: {
           brand: src.brand,
-          url: { notIn: seenUrls }
-        }
+          url: { notIn: seenUrls },
+          removedAt: null
+        },
+        data: { removedAt: new Date() }
       });
+      console.log(`${src.spider}: ${seenUrls.length} products updated, ${count} marked removed`);
     }
   }
 
@@ -131,6 +283,7 @@ async function runAIClassification() {
   console.log(`AI classifying ${products.length} products...`);
 
   const fashionCategories = ["clothing", "apparel"];
+  let fromShopify = 0;
 
   for (const product of products) {
     try {
@@ -139,18 +292,25 @@ async function runAIClassification() {
         continue;
       }
 
-      const raw = await classifyProductAI(product);
+      let parsed = classifyFromShopify(product);
+      let clean;
 
-      const clean = raw
-        .replace(/```json/gi, "")
-        .replace(/```/g, "")
-        .trim();
+      if (parsed) {
+        fromShopify++;
+        clean = JSON.stringify(parsed);
+      } else {
+        const raw = await classifyProductAI(product);
 
-      let parsed;
-      try {
-        parsed = JSON.parse(clean);
-      } catch {
-        throw new Error("AI returned invalid JSON");
+        clean = raw
+          .replace(/```json/gi, "")
+          .replace(/```/g, "")
+          .trim();
+
+        try {
+          parsed = JSON.parse(clean);
+        } catch {
+          throw new Error("AI returned invalid JSON");
+        }
       }
 
       // ✅ Fashion decision
@@ -186,6 +346,8 @@ async function runAIClassification() {
       console.error(`❌ AI failed for ${product.url}`, err.message);
     }
   }
+
+  console.log(`Classified ${fromShopify} of ${products.length} products from Shopify data (no LLM call)`);
 }
 
 